@@ -0,0 +1,266 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+"""Eclipse 插件清理工具的性能基准
+
+生成合成的 Eclipse 插件目录（可放在本地磁盘或 tmpfs 上），分别计时
+扫描/分析/备份/删除各阶段，记录吞吐量 (entries/s, MB/s) 和峰值内存，
+并可与保存的 JSON 基线比较以发现性能回退。
+
+插件目录生成在 --root 下新建的私有临时目录中，结束后只删除该临时目录。
+备份默认使用 copy 方式：auto 在同一文件系统上会选择重命名，备份和删除的吞吐量就没有意义了。
+
+    python benchmark_plugin_cleaner.py --entries 10000 --root /dev/shm/bench --save-baseline baseline.json
+    python benchmark_plugin_cleaner.py --entries 10000 --root /dev/shm/bench --compare baseline.json
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import random
+import shutil
+import tempfile
+import zipfile
+import argparse
+import platform
+import contextlib
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from smart_plugin_cleaner import SmartPluginCleaner
+
+PHASES = ('scan', 'analyze', 'backup', 'delete')
+# 比较基线时忽略耗时低于该值的阶段，太短的阶段受调度和缓存影响，单次波动远超容差
+MIN_COMPARE_SECONDS = 0.5
+
+def generate_installation(root, entries=1000, dir_ratio=0.1, max_versions=3, jar_size=16 * 1024,
+                          files_per_dir=20, file_size=4096, valid_jars=True, seed=0):
+    """生成合成的 Eclipse 安装，返回 plugins 目录路径
+
+    entries: 插件条目总数（jar 和目录插件）
+    dir_ratio: 目录插件所占比例
+    max_versions: 每个插件最多的版本数，实际版本数在 1..max_versions 之间随机
+    valid_jars: 为 True 时生成带 MANIFEST.MF 的有效 jar，否则只写入填充数据
+    """
+    rng = random.Random(seed)
+    plugins_dir = os.path.join(root, 'plugins')
+    os.makedirs(plugins_dir, exist_ok=True)
+    open(os.path.join(root, 'eclipse.ini'), 'w').close()
+
+    # 所有文件共用同一块随机数据，避免生成大量随机数本身成为瓶颈
+    payload = bytes(rng.getrandbits(8) for _ in range(max(jar_size, file_size)))
+
+    created = 0
+    family = 0
+    while created < entries:
+        name = f"org.bench.family{family}.{rng.choice(['core', 'ui', 'runtime', 'jdt', 'team'])}"
+        family += 1
+        versions = min(rng.randint(1, max_versions), entries - created)
+        is_dir = rng.random() < dir_ratio
+
+        for i in range(versions):
+            version = f"{rng.randint(1, 4)}.{rng.randint(0, 20)}.{i}.v{20200101 + rng.randint(0, 50000)}-{rng.randint(1000, 9999)}"
+            manifest = f"Manifest-Version: 1.0\nBundle-SymbolicName: {name}\nBundle-Version: {version}\n".encode('utf-8')
+
+            if is_dir:
+                bundle_dir = os.path.join(plugins_dir, f"{name}_{version}")
+                os.makedirs(os.path.join(bundle_dir, 'META-INF'), exist_ok=True)
+                with open(os.path.join(bundle_dir, 'META-INF', 'MANIFEST.MF'), 'wb') as f:
+                    f.write(manifest)
+                for j in range(files_per_dir):
+                    with open(os.path.join(bundle_dir, f"file{j}.class"), 'wb') as f:
+                        f.write(payload[:file_size])
+            else:
+                jar_path = os.path.join(plugins_dir, f"{name}_{version}.jar")
+                if valid_jars:
+                    with zipfile.ZipFile(jar_path, 'w') as jar:
+                        jar.writestr('META-INF/MANIFEST.MF', manifest)
+                        jar.writestr('payload.bin', payload[:jar_size])
+                else:
+                    with open(jar_path, 'wb') as f:
+                        f.write(payload[:jar_size])
+            created += 1
+
+    return plugins_dir
+
+def _reset_peak_rss():
+    """重置进程的峰值内存统计（Linux 的 /proc/self/clear_refs），成功时返回 True"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def _peak_rss_mb():
+    """返回峰值内存 (MB)：能读取 VmHWM 时为上次重置以来的峰值，否则为进程迄今为止的峰值"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return round(peak / (1024 * 1024 if platform.system() == 'Darwin' else 1024), 1)
+
+def _tree_bytes(plugins):
+    """统计插件占用的字节数（不计入计时）"""
+    return sum(SmartPluginCleaner._path_size(plugin['path'], plugin['is_dir']) for plugin in plugins)
+
+def run_benchmark(root, entries=1000, repeat=3, **options):
+    """生成插件目录并逐阶段计时，返回各阶段的最佳结果
+
+    root 下每轮新建一个私有临时目录，只删除这些临时目录，不会动 root 中已有的内容。
+    options 中 generate_ 开头的参数传给 generate_installation，其余传给 SmartPluginCleaner；
+    backup_strategy 默认为 copy，保证备份和删除阶段真正复制和删除数据。
+    """
+    generate_options = {key[len('generate_'):]: value for key, value in options.items() if key.startswith('generate_')}
+    cleaner_options = {key: value for key, value in options.items() if not key.startswith('generate_')}
+    cleaner_options.setdefault('backup_strategy', 'copy')
+    best = {}
+    os.makedirs(root, exist_ok=True)
+
+    for _ in range(repeat):
+        work_dir = tempfile.mkdtemp(prefix='plugin_cleaner_bench_', dir=root)
+        try:
+            plugins_dir = generate_installation(work_dir, entries=entries, **generate_options)
+            backup_dir = os.path.join(work_dir, 'backup_bench')
+            cleaner = SmartPluginCleaner(plugins_dir, backup_dir=backup_dir, **cleaner_options)
+            timings = {}
+
+            def timed(phase, func, count, size=None):
+                # 每个阶段开始前重置峰值内存，峰值只反映该阶段
+                scope = 'phase' if _reset_peak_rss() else 'process'
+                started = time.perf_counter()
+                func()
+                timings[phase] = (time.perf_counter() - started, count, size, _peak_rss_mb(), scope)
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                timed('scan', cleaner.scan_plugins, entries)
+                timed('analyze', cleaner.analyze_duplicates, entries)
+                doomed_bytes = _tree_bytes(cleaner.to_delete)
+                timed('backup', cleaner.create_backup, len(cleaner.to_delete), doomed_bytes)
+                timed('delete', cleaner.delete_plugins, len(cleaner.to_delete), doomed_bytes)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        for phase, (seconds, count, size, peak_rss, scope) in timings.items():
+            result = {
+                'seconds': round(seconds, 4),
+                'entries': count,
+                'entries_per_s': round(count / seconds, 1) if seconds > 0 else None,
+                'mb_per_s': round(size / (1024 * 1024) / seconds, 1) if size is not None and seconds > 0 else None,
+                'peak_rss_mb': peak_rss,
+                # phase: 该阶段内的峰值；process: 平台不支持重置，为进程迄今为止的峰值
+                'peak_rss_scope': scope
+            }
+            if phase not in best or result['seconds'] < best[phase]['seconds']:
+                best[phase] = result
+
+    return best
+
+def compare_with_baseline(results, baseline, tolerance=0.2, min_seconds=MIN_COMPARE_SECONDS):
+    """与基线比较 entries/s，返回(回退的阶段列表, 因耗时过短而跳过的阶段列表)
+
+    本次或基线中耗时低于 min_seconds 的阶段不参与比较。
+    """
+    regressions = []
+    skipped = []
+    for phase in PHASES:
+        current_result = results.get(phase, {})
+        expected_result = baseline.get('phases', {}).get(phase, {})
+        current = current_result.get('entries_per_s')
+        expected = expected_result.get('entries_per_s')
+        if current is None or not expected:
+            continue
+        if min(current_result.get('seconds', 0), expected_result.get('seconds', 0)) < min_seconds:
+            skipped.append(phase)
+            continue
+        if current < expected * (1 - tolerance):
+            regressions.append((phase, current, expected))
+    return regressions, skipped
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="Eclipse 插件清理工具性能基准")
+    parser.add_argument('--root', default=os.path.join(os.environ.get('TMPDIR', '/tmp'), 'plugin_cleaner_bench'),
+                        help="生成插件目录的位置（可指向 tmpfs，如 /dev/shm/bench），在其中新建临时目录，结束后只删除该临时目录")
+    parser.add_argument('--entries', type=int, default=1000, help="插件条目数 (1k - 200k)")
+    parser.add_argument('--dir-ratio', type=float, default=0.1, help="目录插件所占比例")
+    parser.add_argument('--max-versions', type=int, default=3, help="每个插件最多的版本数")
+    parser.add_argument('--jar-size', type=int, default=16 * 1024, help="每个 jar 的大小 (字节)")
+    parser.add_argument('--files-per-dir', type=int, default=20, help="每个目录插件中的文件数")
+    parser.add_argument('--file-size', type=int, default=4096, help="目录插件中每个文件的大小 (字节)")
+    parser.add_argument('--repeat', type=int, default=3, help="重复次数，取每阶段最快的一次（默认 3）")
+    parser.add_argument('--workers', type=int, default=4, help="备份/删除并发数")
+    parser.add_argument('--backup-strategy', default='copy', choices=('auto',) + SmartPluginCleaner.BACKUP_METHODS,
+                        help="备份方式（默认 copy；auto/move/hardlink 在同一文件系统上不复制数据）")
+    parser.add_argument('--save-baseline', metavar='FILE', help="把结果保存为基线 (JSON)")
+    parser.add_argument('--compare', metavar='FILE', help="与基线比较，出现回退时返回非零退出码")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="允许的吞吐量下降比例")
+    parser.add_argument('--min-seconds', type=float, default=MIN_COMPARE_SECONDS,
+                        help="比较时忽略耗时低于该秒数的阶段（本次或基线）")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """主函数"""
+    args = parse_args(argv)
+
+    print(f"=== 性能基准: {args.entries} 个条目 @ {args.root} ===")
+    results = run_benchmark(
+        args.root,
+        entries=args.entries,
+        repeat=args.repeat,
+        workers=args.workers,
+        backup_strategy=args.backup_strategy,
+        generate_dir_ratio=args.dir_ratio,
+        generate_max_versions=args.max_versions,
+        generate_jar_size=args.jar_size,
+        generate_files_per_dir=args.files_per_dir,
+        generate_file_size=args.file_size
+    )
+
+    for phase in PHASES:
+        result = results[phase]
+        mb_per_s = f", {result['mb_per_s']} MB/s" if result['mb_per_s'] is not None else ""
+        scope = "" if result['peak_rss_scope'] == 'phase' else " (进程峰值)"
+        print(f"  {phase:<8} {result['seconds']:>8.3f}s  {result['entries']} 条目, "
+              f"{result['entries_per_s']} entries/s{mb_per_s}, 峰值内存 {result['peak_rss_mb']} MB{scope}")
+
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('save_baseline', 'compare')},
+        'phases': results
+    }
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"基线已保存: {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions, skipped = compare_with_baseline(results, baseline, args.tolerance, args.min_seconds)
+        if skipped:
+            print(f"  ⚠️ 耗时不足 {args.min_seconds}s，未参与比较: {', '.join(skipped)}（可增大 --entries）")
+        for phase, current, expected in regressions:
+            print(f"  ❌ 性能回退: {phase} {current} entries/s (基线 {expected} entries/s)")
+        if regressions:
+            sys.exit(1)
+        print("  ✅ 未发现性能回退")
+
+if __name__ == "__main__":
+    main()
@@ -5,17 +5,1840 @@ import os
 import re
 import shutil
 import json
+import io
+import functools
+import itertools
+import heapq
+import operator
+import bisect
+import stat
+import struct
+import zlib
+import contextlib
+import tarfile
+import zipfile
+import hashlib
+import uuid
+import tempfile
+import time
+import threading
+import queue
+import subprocess
+import select
+import ctypes
+import ctypes.util
 from datetime import datetime
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import platform
+import xml.etree.ElementTree as ElementTree
+import xml.sax
+from xml.sax import saxutils
+from urllib.parse import urlparse, unquote
+from urllib.request import url2pathname
+import argparse
+import sys
+
+# 版本号: major[.minor[.micro]][.qualifier]，非标准写法（如 2.0.0-SNAPSHOT）时数字之后的部分都作为限定符
+_VERSION_PATTERN = re.compile(r'^\s*(\d+)(?:\.(\d+))?(?:\.(\d+))?(?:[.\-_]?(.*?))?\s*$')
+
+class OSGiVersion:
+    """OSGi 版本号，按 major.minor.micro 数值再按 qualifier 排序
+    
+    qualifier 按字符串比较，但纯数字的 qualifier 按数值比较（1.2.3.10 > 1.2.3.4，与旧版本的
+    四段数字比较一致），并排在空 qualifier 之后、其他 qualifier 之前。
+    """
+    
+    __slots__ = ('major', 'minor', 'micro', 'qualifier', 'key')
+    
+    def __init__(self, major=0, minor=0, micro=0, qualifier=''):
+        self.major = major
+        self.minor = minor
+        self.micro = micro
+        self.qualifier = sys.intern(qualifier)
+        if not qualifier:
+            rank, number = 0, -1
+        elif qualifier.isdigit():
+            rank, number = 0, int(qualifier)
+        else:
+            rank, number = 1, 0
+        # 扁平元组，便于写入 JSON 后按列表比较（流式清理计划的外部排序）
+        self.key = (major, minor, micro, rank, number, self.qualifier)
+    
+    def __eq__(self, other):
+        return isinstance(other, OSGiVersion) and self.key == other.key
+    
+    def __lt__(self, other):
+        return self.key < other.key
+    
+    def __le__(self, other):
+        return self.key <= other.key
+    
+    def __gt__(self, other):
+        return self.key > other.key
+    
+    def __ge__(self, other):
+        return self.key >= other.key
+    
+    def __hash__(self):
+        return hash(self.key)
+    
+    def __repr__(self):
+        return f"OSGiVersion({str(self)!r})"
+    
+    def __str__(self):
+        version = f"{self.major}.{self.minor}.{self.micro}"
+        return f"{version}.{self.qualifier}" if self.qualifier else version
+
+@functools.lru_cache(maxsize=65536)
+def parse_version(version_str):
+    """解析版本字符串（预编译正则 + 缓存），相同字符串返回同一个 OSGiVersion 对象"""
+    match = _VERSION_PATTERN.match(version_str or '')
+    if not match:
+        # 没有数字开头的版本号整体作为限定符
+        return OSGiVersion(qualifier=(version_str or '').strip())
+    major, minor, micro, qualifier = match.groups()
+    return OSGiVersion(int(major), int(minor or 0), int(micro or 0), qualifier or '')
+
+def sort_plugin_groups(plugins_by_name, reverse=True):
+    """一次性把每个插件名下的记录按版本排序（默认从高到低），返回{插件名: 有序列表}"""
+    version_key = operator.attrgetter('version_tuple')
+    return {name: sorted(plugins, key=version_key, reverse=reverse) for name, plugins in plugins_by_name.items()}
+
+class PluginRecord:
+    """扫描到的单个插件
+    
+    使用 __slots__，每条记录的内存占用固定；path 由所在目录和文件名拼出，
+    目录字符串和插件名在记录之间共享。保留字典式访问 plugin['name']，兼容原有代码。
+    """
+    
+    __slots__ = ('directory', 'original_name', 'name', 'version', 'version_tuple', 'is_dir', 'require_bundle', 'size')
+    
+    def __init__(self, directory, original_name, name, version, version_tuple, is_dir, require_bundle=None):
+        self.directory = directory
+        self.original_name = original_name
+        self.name = sys.intern(name)
+        self.version = version
+        self.version_tuple = version_tuple
+        self.is_dir = is_dir
+        self.require_bundle = require_bundle
+    
+    @property
+    def path(self):
+        return os.path.join(self.directory, self.original_name)
+    
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+    
+    def __setitem__(self, key, value):
+        try:
+            setattr(self, key, value)
+        except AttributeError:
+            raise KeyError(key) from None
+    
+    def __contains__(self, key):
+        return hasattr(self, key)
+    
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+    
+    def __repr__(self):
+        return f"PluginRecord({self.path!r}, {self.name!r}, {self.version!r})"
+
+class CleanupPlan:
+    """保留/删除计划，按插件名索引，预览和报告只需线性遍历"""
+    
+    def __init__(self):
+        self.to_keep = []
+        self.to_delete = []
+        self.keep_by_name = defaultdict(list)
+        self.delete_by_name = defaultdict(list)
+    
+    def keep(self, plugins):
+        """标记为保留"""
+        for plugin in plugins:
+            self.to_keep.append(plugin)
+            self.keep_by_name[plugin.name].append(plugin)
+    
+    def delete(self, plugins):
+        """标记为删除"""
+        for plugin in plugins:
+            self.to_delete.append(plugin)
+            self.delete_by_name[plugin.name].append(plugin)
+    
+    def retain(self, plugins):
+        """把原本要删除的插件改为保留"""
+        retained_ids = set(id(plugin) for plugin in plugins)
+        self.to_delete = [plugin for plugin in self.to_delete if id(plugin) not in retained_ids]
+        for name in set(plugin.name for plugin in plugins):
+            remaining = [plugin for plugin in self.delete_by_name[name] if id(plugin) not in retained_ids]
+            if remaining:
+                self.delete_by_name[name] = remaining
+            else:
+                del self.delete_by_name[name]
+        self.keep(plugins)
+    
+    def kept(self, name):
+        """返回该插件名下保留的插件（最新版本在前）"""
+        return self.keep_by_name.get(name, [])
+
+# zip 结构签名
+ZIP_EOCD_SIGNATURE = b'PK\x05\x06'
+ZIP64_EOCD_LOCATOR_SIGNATURE = b'PK\x06\x07'
+ZIP64_EOCD_SIGNATURE = b'PK\x06\x06'
+ZIP_CENTRAL_DIR_SIGNATURE = b'PK\x01\x02'
+ZIP_LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+MANIFEST_ENTRY = 'META-INF/MANIFEST.MF'
+
+def _read_zip_directory_location(f, file_size):
+    """从文件末尾的 end-of-central-directory 记录中读取(条目数, 中央目录大小, 中央目录偏移)"""
+    tail_size = min(file_size, 22 + 65535)
+    f.seek(file_size - tail_size)
+    tail = f.read(tail_size)
+    
+    pos = tail.rfind(ZIP_EOCD_SIGNATURE)
+    if pos < 0 or pos + 22 > len(tail):
+        raise zipfile.BadZipFile("找不到 end-of-central-directory 记录")
+    
+    _, _, _, _, count, cd_size, cd_offset, _ = struct.unpack('<4s4H2LH', tail[pos:pos + 22])
+    
+    # zip64: 真实的值保存在 zip64 end-of-central-directory 记录中
+    if count == 0xFFFF or cd_size == 0xFFFFFFFF or cd_offset == 0xFFFFFFFF:
+        locator = tail[pos - 20:pos] if pos >= 20 else b''
+        if locator[:4] != ZIP64_EOCD_LOCATOR_SIGNATURE:
+            raise zipfile.BadZipFile("zip64 定位记录损坏")
+        _, _, zip64_offset, _ = struct.unpack('<4sLQL', locator)
+        f.seek(zip64_offset)
+        record = f.read(56)
+        if len(record) < 56 or record[:4] != ZIP64_EOCD_SIGNATURE:
+            raise zipfile.BadZipFile("zip64 end-of-central-directory 记录损坏")
+        _, _, _, _, _, _, _, count, cd_size, cd_offset = struct.unpack('<4sQ2H2L4Q', record)
+    
+    if cd_offset + cd_size > file_size:
+        raise zipfile.BadZipFile("中央目录超出文件范围")
+    return count, cd_size, cd_offset
+
+def iter_zip_central_directory(f, file_size):
+    """只读取中央目录，逐个返回(条目名, 压缩方式, crc, 压缩后大小, 原始大小, 本地头偏移)"""
+    count, cd_size, cd_offset = _read_zip_directory_location(f, file_size)
+    f.seek(cd_offset)
+    data = f.read(cd_size)
+    
+    pos = 0
+    for _ in range(count):
+        if data[pos:pos + 4] != ZIP_CENTRAL_DIR_SIGNATURE:
+            raise zipfile.BadZipFile("中央目录条目损坏")
+        (_, _, _, flags, method, _, _, crc, comp_size, size,
+         name_len, extra_len, comment_len, _, _, _, offset) = struct.unpack('<4s6H3L5H2L', data[pos:pos + 46])
+        name = data[pos + 46:pos + 46 + name_len].decode('utf-8' if flags & 0x800 else 'cp437')
+        
+        # zip64 扩展字段中保存超过 4GB 的大小和偏移
+        if 0xFFFFFFFF in (comp_size, size, offset):
+            extra = data[pos + 46 + name_len:pos + 46 + name_len + extra_len]
+            extra_pos = 0
+            while extra_pos + 4 <= len(extra):
+                tag, length = struct.unpack('<2H', extra[extra_pos:extra_pos + 4])
+                if tag == 0x0001:
+                    values = list(struct.unpack(f'<{length // 8}Q', extra[extra_pos + 4:extra_pos + 4 + length // 8 * 8]))
+                    if size == 0xFFFFFFFF and values:
+                        size = values.pop(0)
+                    if comp_size == 0xFFFFFFFF and values:
+                        comp_size = values.pop(0)
+                    if offset == 0xFFFFFFFF and values:
+                        offset = values.pop(0)
+                    break
+                extra_pos += 4 + length
+        
+        yield name, method, crc, comp_size, size, offset
+        pos += 46 + name_len + extra_len + comment_len
+
+def read_zip_entry(f, method, comp_size, offset):
+    """根据本地文件头读取并解压单个条目"""
+    f.seek(offset)
+    header = f.read(30)
+    if len(header) < 30 or header[:4] != ZIP_LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile("本地文件头损坏")
+    name_len, extra_len = struct.unpack('<2H', header[26:30])
+    f.seek(offset + 30 + name_len + extra_len)
+    data = f.read(comp_size)
+    
+    if method == zipfile.ZIP_STORED:
+        return data
+    if method == zipfile.ZIP_DEFLATED:
+        return zlib.decompressobj(-15).decompress(data)
+    raise zipfile.BadZipFile(f"不支持的压缩方式: {method}")
+
+def parse_manifest(data):
+    """解析 MANIFEST.MF 主段，返回{头名: 值}，处理以空格开头的续行
+    
+    清单按 72 字节折行，多字节 UTF-8 字符可能被拆到两行，因此先按字节拼接续行再解码。
+    """
+    raw_headers = {}
+    last_key = None
+    
+    for line in data.replace(b'\r\n', b'\n').replace(b'\r', b'\n').split(b'\n'):
+        if not line:
+            # 空行之后是各条目的独立段，只需要主段
+            if raw_headers:
+                break
+            continue
+        if line.startswith(b' ') and last_key:
+            raw_headers[last_key] += line[1:]
+        elif b':' in line:
+            key, value = line.split(b':', 1)
+            last_key = key.strip().decode('utf-8', errors='replace')
+            raw_headers[last_key] = value
+    
+    return {key: value.decode('utf-8', errors='replace').strip() for key, value in raw_headers.items()}
+
+def read_bundle_manifest(path, is_dir):
+    """读取插件的 OSGi 清单：jar 只读取中央目录和清单条目，目录插件直接读取清单文件"""
+    if is_dir:
+        manifest_path = os.path.join(path, 'META-INF', 'MANIFEST.MF')
+        if not os.path.isfile(manifest_path):
+            return None
+        with open(manifest_path, 'rb') as f:
+            return parse_manifest(f.read())
+    
+    with open(path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        for name, method, _, comp_size, _, offset in iter_zip_central_directory(f, file_size):
+            if name == MANIFEST_ENTRY:
+                return parse_manifest(read_zip_entry(f, method, comp_size, offset))
+    return None
+
+def verify_jar(path, level='quick'):
+    """检查 jar 是否完整，返回错误描述，完整时返回 None
+    
+    quick: 只读取中央目录，检查各条目是否落在文件范围内，并抽查首尾条目的本地文件头；
+    full: 另外解压全部条目并校验 CRC。
+    """
+    try:
+        with open(path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            offsets = []
+            for name, _, _, comp_size, _, offset in iter_zip_central_directory(f, file_size):
+                if offset + 30 + comp_size > file_size:
+                    return f"条目超出文件范围: {name}"
+                offsets.append(offset)
+            if not offsets:
+                return "jar 中没有任何条目"
+            for offset in {min(offsets), max(offsets)}:
+                f.seek(offset)
+                if f.read(4) != ZIP_LOCAL_HEADER_SIGNATURE:
+                    return "本地文件头损坏"
+        
+        if level == 'full':
+            with zipfile.ZipFile(path) as archive:
+                bad_entry = archive.testzip()
+            if bad_entry:
+                return f"CRC 校验失败: {bad_entry}"
+    except (OSError, EOFError, zipfile.BadZipFile, zipfile.LargeZipFile, zlib.error, struct.error,
+            UnicodeDecodeError, NotImplementedError) as e:
+        return str(e) or type(e).__name__
+    return None
+
+def bundle_identity(headers):
+    """从清单中取出(Bundle-SymbolicName, Bundle-Version)，不是 OSGi 插件时返回 None"""
+    if not headers or 'Bundle-SymbolicName' not in headers:
+        return None
+    symbolic_name = headers['Bundle-SymbolicName'].split(';', 1)[0].strip()
+    version = headers.get('Bundle-Version', '0.0.0').strip() or '0.0.0'
+    return symbolic_name, version
+
+def split_manifest_clauses(value):
+    """按逗号拆分清单头的各子句，忽略引号内的逗号（例如版本范围）"""
+    clauses = []
+    current = []
+    in_quotes = False
+    for char in value:
+        if char == '"':
+            in_quotes = not in_quotes
+        if char == ',' and not in_quotes:
+            clauses.append(''.join(current).strip())
+            current = []
+        else:
+            current.append(char)
+    if current:
+        clauses.append(''.join(current).strip())
+    return [clause for clause in clauses if clause]
+
+def parse_require_bundle(value):
+    """解析 Require-Bundle，返回[(插件名, 版本范围字符串或 None)]"""
+    requirements = []
+    for clause in split_manifest_clauses(value or ''):
+        parts = [part.strip() for part in clause.split(';')]
+        version_range = None
+        for part in parts[1:]:
+            if part.startswith('bundle-version') and '=' in part and ':=' not in part:
+                version_range = part.split('=', 1)[1].strip().strip('"')
+        requirements.append((parts[0], version_range))
+    return requirements
+
+def replace_file_atomically(path, write):
+    """在同一目录写临时文件并落盘后原子替换 path，write(f) 负责写入二进制内容"""
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+class _ArtifactIndexFilter(saxutils.XMLGenerator):
+    """流式复制 artifacts.xml：去掉 removed 中的 artifact 元素、在末尾加入 added 中的 artifact 片段并更新
+    artifacts 的 size，去掉 unfolded 中 artifact 的 artifact.folder 属性（目录插件已打包为 jar）
+    
+    同时作为 LexicalHandler 使用，保留原文件中的注释（被删除元素内部的注释除外）。
+    """
+    
+    FOLDER_PROPERTY = 'artifact.folder'
+    
+    def __init__(self, out, removed, removed_count, unfolded=frozenset(), added=()):
+        super().__init__(out, encoding='UTF-8', short_empty_elements=True)
+        self._removed = removed
+        self._removed_count = removed_count
+        self._unfolded = unfolded
+        self._added = added
+        self._in_unfolded = False
+        self._depth = 0
+        self._skip_depth = 0
+        # 元素之间的空白先暂存，被删除的元素连同前面的缩进一起去掉
+        self._pending = ''
+    
+    def _write_pending(self):
+        if self._pending:
+            super().characters(self._pending)
+            self._pending = ''
+    
+    def startElement(self, name, attrs):
+        if self._skip_depth:
+            self._skip_depth += 1
+            return
+        if name == 'artifact' and (attrs.get('classifier'), attrs.get('id'), attrs.get('version')) in self._removed:
+            self._pending = ''
+            self._skip_depth = 1
+            return
+        if name == 'artifact':
+            self._in_unfolded = (attrs.get('classifier'), attrs.get('id'), attrs.get('version')) in self._unfolded
+        if self._in_unfolded and name == 'property' and attrs.get('name') == self.FOLDER_PROPERTY:
+            self._pending = ''
+            self._skip_depth = 1
+            return
+        if (name == 'artifacts' and (self._removed_count or self._added)) or (name == 'properties' and self._in_unfolded):
+            if 'size' in attrs:
+                attrs = dict(attrs.items())
+                delta = len(self._added) - self._removed_count if name == 'artifacts' else -1
+                attrs['size'] = str(int(attrs['size']) + delta)
+        self._write_pending()
+        self._depth += 1
+        super().startElement(name, attrs)
+    
+    def endElement(self, name):
+        if self._skip_depth:
+            self._skip_depth -= 1
+            return
+        if name == 'artifact':
+            self._in_unfolded = False
+        if name == 'artifacts':
+            # 加入的 artifact 比结束标签多缩进一级
+            for fragment in self._added:
+                self._write(self._pending + '  ' + fragment)
+        self._write_pending()
+        self._depth -= 1
+        super().endElement(name)
+    
+    def characters(self, content):
+        if self._skip_depth:
+            return
+        if content.strip():
+            self._write_pending()
+            super().characters(content)
+        else:
+            self._pending += content
+    
+    ignorableWhitespace = characters
+    
+    def comment(self, content):
+        if self._skip_depth:
+            return
+        self._write_pending()
+        self._write(f'<!--{content}-->')
+        if not self._depth:
+            # 根元素之外的注释单独占一行
+            self._write('\n')
+    
+    def startDTD(self, name, public_id, system_id):
+        pass
+    
+    def endDTD(self):
+        pass
+    
+    def startCDATA(self):
+        pass
+    
+    def endCDATA(self):
+        pass
+    
+    def processingInstruction(self, target, data):
+        super().processingInstruction(target, data)
+        self._write('\n')
+    
+    def endDocument(self):
+        self._write('\n')
+        super().endDocument()
+
+class P2Metadata:
+    """Eclipse 安装的 p2 元数据索引
+    
+    bundles.info（simpleconfigurator 实际加载的插件）逐行读取，artifacts.xml/artifacts.jar
+    用 iterparse 流式解析，不构建完整 DOM；活动插件按路径和 (插件名, 版本) 存入集合，O(1) 查询。
+    删除或打包插件后按同样的方式流式重写这些文件，原文件保留为 .bak。
+    """
+    
+    BUNDLES_INFO = os.path.join('configuration', 'org.eclipse.equinox.simpleconfigurator', 'bundles.info')
+    ARTIFACT_FILES = ('artifacts.jar', 'artifacts.xml')
+    BUNDLE_CLASSIFIER = 'osgi.bundle'
+    
+    def __init__(self, install_root):
+        self.install_root = install_root
+        bundles_info = os.path.join(install_root, self.BUNDLES_INFO)
+        self.bundles_info_path = bundles_info if os.path.isfile(bundles_info) else None
+        self.artifact_paths = [os.path.join(install_root, name) for name in self.ARTIFACT_FILES
+                               if os.path.isfile(os.path.join(install_root, name))]
+        # 活动插件的规范化路径和 (插件名, 版本)
+        self.active_paths = set()
+        self.active_bundles = set()
+        # 每个 artifact 索引中的 (classifier, id, version)，以及其中以目录形式存放的 artifact
+        self.artifacts = {}
+        self.folder_artifacts = {}
+    
+    @property
+    def found(self):
+        """是否存在任何 p2 元数据文件"""
+        return bool(self.bundles_info_path or self.artifact_paths)
+    
+    @classmethod
+    def load(cls, install_root):
+        """读取安装目录下的 p2 元数据"""
+        metadata = cls(install_root)
+        if metadata.bundles_info_path:
+            for name, version, location in metadata._iter_bundles_info():
+                metadata.active_bundles.add((name, version))
+                metadata.active_paths.add(metadata.resolve_location(location))
+        for path in metadata.artifact_paths:
+            metadata.artifacts[path], metadata.folder_artifacts[path] = metadata._read_artifact_keys(path)
+        return metadata
+    
+    @staticmethod
+    def normalize_path(path):
+        return os.path.normcase(os.path.normpath(os.path.abspath(path)))
+    
+    def resolve_location(self, location):
+        """把 bundles.info 中的位置（相对安装目录的路径或 file: URL）解析为规范化路径"""
+        if location.startswith('file:'):
+            path = url2pathname(unquote(urlparse(location).path))
+        else:
+            path = os.path.join(self.install_root, *location.split('/'))
+        return self.normalize_path(path)
+    
+    def _iter_bundles_info(self):
+        """产出 bundles.info 中每一行的 (插件名, 版本, 位置)"""
+        with open(self.bundles_info_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                fields = line.strip().split(',')
+                if line.startswith('#') or len(fields) < 3:
+                    continue
+                yield fields[0], fields[1], fields[2]
+    
+    @contextlib.contextmanager
+    def _open_artifacts_xml(self, path):
+        """打开 artifacts.xml，artifacts.jar 时直接读取其中的条目"""
+        if path.endswith('.jar'):
+            with zipfile.ZipFile(path) as archive, archive.open('artifacts.xml') as f:
+                yield f
+        else:
+            with open(path, 'rb') as f:
+                yield f
+    
+    def _read_artifact_keys(self, path):
+        """用 iterparse 流式读取 artifact 索引，返回(全部 artifact, 目录形式的 artifact)，处理完的元素立即清除"""
+        keys = set()
+        folders = set()
+        with self._open_artifacts_xml(path) as f:
+            container = None
+            for event, elem in ElementTree.iterparse(f, events=('start', 'end')):
+                if event == 'start':
+                    if elem.tag == 'artifacts':
+                        container = elem
+                    continue
+                if elem.tag == 'artifact':
+                    key = (elem.get('classifier'), elem.get('id'), elem.get('version'))
+                    keys.add(key)
+                    for prop in elem.iterfind('properties/property'):
+                        if prop.get('name') == _ArtifactIndexFilter.FOLDER_PROPERTY and prop.get('value') == 'true':
+                            folders.add(key)
+                    if container is not None:
+                        container.clear()
+        return keys, folders
+    
+    def is_active(self, plugin):
+        """插件是否在 bundles.info 中（即 Eclipse 实际加载的版本）"""
+        return (self.normalize_path(plugin['path']) in self.active_paths
+                or (plugin['name'], plugin['version']) in self.active_bundles)
+    
+    def _rewrite_bundles_info(self, removed_paths, repacked_paths=()):
+        """去掉指向本次已删除插件的行，返回修改的行数（其他行原样保留，即使其文件已不存在）
+        
+        repacked_paths 中的目录插件已打包为同名 jar，对应行改为指向 jar。
+        """
+        with open(self.bundles_info_path, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        
+        kept = []
+        changed = 0
+        for line in lines:
+            fields = line.strip().split(',')
+            if not line.startswith('#') and len(fields) >= 3:
+                path = self.resolve_location(fields[2])
+                if path in removed_paths:
+                    changed += 1
+                    continue
+                if path in repacked_paths:
+                    fields[2] = fields[2].rstrip('/') + '.jar'
+                    line = ','.join(fields) + '\n'
+                    changed += 1
+            kept.append(line)
+        
+        if changed:
+            shutil.copy2(self.bundles_info_path, self.bundles_info_path + '.bak')
+            replace_file_atomically(self.bundles_info_path, lambda f: f.write(''.join(kept).encode('utf-8')))
+        return changed
+    
+    def _rewrite_artifacts(self, path, removed_keys, repacked_keys=frozenset(), added=None):
+        """流式重写 artifact 索引，去掉已删除插件的条目、把已打包插件改为 jar 形式，
+        加入 added（{key: artifact 片段}）中尚不存在的条目，返回修改的条目数"""
+        present = removed_keys & self.artifacts.get(path, set())
+        unfolded = repacked_keys & self.folder_artifacts.get(path, set())
+        added = {key: fragment for key, fragment in (added or {}).items() if key not in self.artifacts.get(path, set())}
+        if not present and not unfolded and not added:
+            return 0
+        
+        def filter_xml(source, out):
+            handler = _ArtifactIndexFilter(out, present, len(present), unfolded, list(added.values()))
+            parser = xml.sax.make_parser()
+            parser.setContentHandler(handler)
+            parser.setProperty(xml.sax.handler.property_lexical_handler, handler)
+            parser.parse(source)
+        
+        def write(f):
+            with self._open_artifacts_xml(path) as source:
+                if path.endswith('.jar'):
+                    entry = zipfile.ZipInfo('artifacts.xml', time.localtime()[:6])
+                    entry.compress_type = zipfile.ZIP_DEFLATED
+                    with zipfile.ZipFile(f, 'w') as archive, archive.open(entry, 'w') as out:
+                        filter_xml(source, out)
+                else:
+                    filter_xml(source, f)
+        
+        shutil.copy2(path, path + '.bak')
+        replace_file_atomically(path, write)
+        self.artifacts[path] -= present
+        self.artifacts[path] |= added.keys()
+        self.folder_artifacts[path] -= unfolded
+        return len(present) + len(unfolded) + len(added)
+    
+    def collect_entries(self, plugins):
+        """读取插件在 bundles.info 和 artifact 索引中的原始条目，返回{插件路径: 条目}
+        
+        条目形如 {'bundles_info': 行, 'artifacts': {索引文件名: artifact 元素}}，
+        写入备份清单，还原插件时由 restore_entries 重新加入。
+        """
+        by_path = {self.normalize_path(plugin['path']): plugin['path'] for plugin in plugins}
+        by_key = {(self.BUNDLE_CLASSIFIER, plugin['name'], plugin['version']): plugin['path'] for plugin in plugins}
+        entries = defaultdict(dict)
+        
+        if self.bundles_info_path:
+            with open(self.bundles_info_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    fields = line.strip().split(',')
+                    if line.startswith('#') or len(fields) < 3:
+                        continue
+                    source = by_path.get(self.resolve_location(fields[2]))
+                    if source:
+                        entries[source]['bundles_info'] = line.rstrip('\r\n')
+        
+        for path in self.artifact_paths:
+            wanted = by_key.keys() & self.artifacts.get(path, set())
+            if not wanted:
+                continue
+            with self._open_artifacts_xml(path) as f:
+                container = None
+                for event, elem in ElementTree.iterparse(f, events=('start', 'end')):
+                    if event == 'start':
+                        if elem.tag == 'artifacts':
+                            container = elem
+                        continue
+                    if elem.tag == 'artifact':
+                        key = (elem.get('classifier'), elem.get('id'), elem.get('version'))
+                        if key in wanted:
+                            elem.tail = None
+                            artifacts = entries[by_key[key]].setdefault('artifacts', {})
+                            artifacts[os.path.basename(path)] = ElementTree.tostring(elem, encoding='unicode')
+                        if container is not None:
+                            container.clear()
+        return dict(entries)
+    
+    def restore_entries(self, entries):
+        """把 collect_entries 记录的条目重新加入 bundles.info 和 artifact 索引，已存在的条目跳过，
+        返回{文件: 加入的条目数}"""
+        changes = {}
+        
+        if self.bundles_info_path:
+            lines = []
+            for entry in entries:
+                line = entry.get('bundles_info')
+                if line and self.resolve_location(line.split(',')[2]) not in self.active_paths:
+                    lines.append(line)
+                    self.active_paths.add(self.resolve_location(line.split(',')[2]))
+            if lines:
+                with open(self.bundles_info_path, 'r', encoding='utf-8') as f:
+                    content = f.read()
+                if content and not content.endswith('\n'):
+                    content += '\n'
+                content += ''.join(line + '\n' for line in lines)
+                shutil.copy2(self.bundles_info_path, self.bundles_info_path + '.bak')
+                replace_file_atomically(self.bundles_info_path, lambda f: f.write(content.encode('utf-8')))
+                changes[self.bundles_info_path] = len(lines)
+        
+        for path in self.artifact_paths:
+            added = {}
+            for entry in entries:
+                fragment = entry.get('artifacts', {}).get(os.path.basename(path))
+                if fragment:
+                    elem = ElementTree.fromstring(fragment)
+                    added[(elem.get('classifier'), elem.get('id'), elem.get('version'))] = fragment
+            changed = self._rewrite_artifacts(path, set(), added=added)
+            if changed:
+                changes[path] = changed
+        return changes
+    
+    def remove_bundles(self, plugins):
+        """删除插件后同步更新 bundles.info 和 artifact 索引，返回{文件: 删除的条目数}
+        
+        只去掉 plugins（本次实际删除的插件）对应的条目；没有对应条目时不改写任何文件。
+        """
+        changes = {}
+        if not plugins:
+            return changes
+        
+        if self.bundles_info_path:
+            removed = self._rewrite_bundles_info(set(self.normalize_path(plugin['path']) for plugin in plugins))
+            if removed:
+                changes[self.bundles_info_path] = removed
+        
+        removed_keys = set((self.BUNDLE_CLASSIFIER, plugin['name'], plugin['version']) for plugin in plugins)
+        for path in self.artifact_paths:
+            removed = self._rewrite_artifacts(path, removed_keys)
+            if removed:
+                changes[path] = removed
+        return changes
+    
+    def repack_bundles(self, plugins):
+        """目录插件打包为 jar 后同步更新 bundles.info 和 artifact 索引，返回{文件: 修改的条目数}"""
+        changes = {}
+        if not plugins:
+            return changes
+        
+        if self.bundles_info_path:
+            changed = self._rewrite_bundles_info(set(), repacked_paths=set(self.normalize_path(plugin['path']) for plugin in plugins))
+            if changed:
+                changes[self.bundles_info_path] = changed
+        
+        repacked_keys = set((self.BUNDLE_CLASSIFIER, plugin['name'], plugin['version']) for plugin in plugins)
+        for path in self.artifact_paths:
+            changed = self._rewrite_artifacts(path, set(), repacked_keys)
+            if changed:
+                changes[path] = changed
+        return changes
+
+def format_size(size):
+    """把字节数格式化为便于阅读的字符串"""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+def parse_rate(text):
+    """解析带单位的字节数（如 20M、512K、1.5G），返回字节数"""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(?:i?B)?\s*', str(text), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"无法解析的大小: {text}")
+    number, unit = match.groups()
+    rate = int(float(number) * 1024 ** ' KMGT'.index(unit.upper() or ' '))
+    if rate <= 0:
+        raise ValueError(f"限速必须大于 0: {text}")
+    return rate
+
+def parse_positive_int(text):
+    """解析正整数（并发数等）"""
+    value = int(text)
+    if value <= 0:
+        raise ValueError(f"必须大于 0: {text}")
+    return value
+
+def parse_ops_rate(text):
+    """解析每秒操作数，必须大于 0"""
+    rate = float(text)
+    if not rate > 0:
+        raise ValueError(f"限速必须大于 0: {text}")
+    return rate
+
+def disk_usage(path, is_dir):
+    """按 st_blocks 统计插件实际占用的磁盘空间，文件按 (设备, inode) 去重
+    
+    返回 (目录项本身占用的字节数, {(设备, inode): [链接数, 字节数, 出现次数]}, 文件数)。
+    不支持 st_blocks 的平台（Windows）退回到 st_size；拿不到 inode 时不去重。
+    """
+    files = {}
+    dir_bytes = 0
+    count = 0
+    
+    def allocated(st):
+        blocks = getattr(st, 'st_blocks', None)
+        return blocks * 512 if blocks is not None else st.st_size
+    
+    def add_file(st):
+        nonlocal count
+        count += 1
+        key = (st.st_dev, st.st_ino) if st.st_ino else ('unique', count)
+        usage = files.get(key)
+        if usage:
+            usage[2] += 1
+        else:
+            files[key] = [st.st_nlink if st.st_ino else 1, allocated(st), 1]
+    
+    st = os.lstat(path)
+    if not is_dir:
+        add_file(st)
+        return dir_bytes, files, count
+    
+    dir_bytes += allocated(st)
+    stack = [path]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                try:
+                    entry_stat = entry.stat(follow_symlinks=False)
+                    if entry.is_dir(follow_symlinks=False):
+                        dir_bytes += allocated(entry_stat)
+                        stack.append(entry.path)
+                    else:
+                        add_file(entry_stat)
+                except OSError:
+                    pass
+    return dir_bytes, files, count
+
+def tree_fingerprint(path, is_dir, with_hash=False):
+    """统计插件的大小和文件数，with_hash 为 True 时同时计算内容哈希（目录按相对路径排序后汇总）"""
+    if not is_dir:
+        fingerprint = {'size': os.path.getsize(path), 'file_count': 1}
+        if with_hash:
+            fingerprint['sha256'] = BackupStore.hash_file(path)
+        return fingerprint
+    
+    size = 0
+    files = []
+    for root, dirs, filenames in os.walk(path):
+        for filename in filenames:
+            file_path = os.path.join(root, filename)
+            size += os.path.getsize(file_path)
+            files.append(os.path.relpath(file_path, path).replace(os.sep, '/'))
+    
+    fingerprint = {'size': size, 'file_count': len(files)}
+    if with_hash:
+        digest = hashlib.sha256()
+        for rel_path in sorted(files):
+            digest.update(f"{rel_path}\0{BackupStore.hash_file(os.path.join(path, rel_path))}\n".encode('utf-8'))
+        fingerprint['sha256'] = digest.hexdigest()
+    return fingerprint
+
+
+def try_lock_file(path):
+    """打开锁文件并尝试加排他锁（不等待），成功返回文件对象，锁被其他进程持有时返回 None"""
+    lock_file = open(path, 'a+b')
+    try:
+        try:
+            import fcntl
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except ImportError:
+            import msvcrt
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+class BackupStore:
+    """按文件内容哈希寻址的去重备份库
+    
+    目录结构:
+        objects/ab/abcdef...   以 sha256 命名的文件内容（blob）
+        manifests/*.json       每次备份的清单，只引用 blob
+        sessions/*.lock        进行中的备份（由备份进程加锁，回收时据此保护其引用的 blob）
+        tmp/                   写入中的临时文件
+    
+    blob 总是独立的副本（支持时用 reflink），不与插件文件共享 inode，
+    插件文件之后被原地改写也不会破坏备份。
+    """
+    
+    # 新写入或刚被引用的 blob 在该时间内不会被回收，避免与正在进行的备份冲突
+    GC_GRACE_SECONDS = 3600
+    
+    def __init__(self, store_dir, throttle=None):
+        self.store_dir = store_dir
+        # 可选的 I/O 限速（IOThrottle）
+        self.throttle = throttle
+        self.objects_dir = os.path.join(store_dir, 'objects')
+        self.manifests_dir = os.path.join(store_dir, 'manifests')
+        self.sessions_dir = os.path.join(store_dir, 'sessions')
+        self.tmp_dir = os.path.join(store_dir, 'tmp')
+        # 当前进程持有的备份会话 (锁文件路径, 锁文件)
+        self._session = None
+    
+    def ensure_layout(self):
+        """创建备份库目录结构"""
+        for directory in (self.objects_dir, self.manifests_dir, self.sessions_dir, self.tmp_dir):
+            os.makedirs(directory, exist_ok=True)
+    
+    def begin_session(self):
+        """在存入 blob 之前登记进行中的备份，直到 end_session 或进程退出为止
+        
+        回收时不会删除会话开始之后被写入或刷新时间戳的 blob，即使备份持续超过宽限期。
+        """
+        if self._session is not None:
+            return
+        os.makedirs(self.sessions_dir, exist_ok=True)
+        path = os.path.join(self.sessions_dir, f"{os.getpid()}_{time.time():.6f}.lock")
+        lock_file = try_lock_file(path)
+        if lock_file is None:
+            raise OSError(f"无法锁定备份会话: {path}")
+        self._session = (path, lock_file)
+    
+    def end_session(self):
+        """结束备份会话（清单已写入，引用的 blob 由清单保护）"""
+        if self._session is None:
+            return
+        path, lock_file = self._session
+        self._session = None
+        with contextlib.suppress(OSError):
+            os.remove(path)
+        lock_file.close()
+    
+    def live_session_start(self):
+        """返回仍在进行的备份会话中最早的开始时间，没有时返回 None；顺带清除已结束进程遗留的会话"""
+        earliest = None
+        if not os.path.isdir(self.sessions_dir):
+            return earliest
+        for entry in os.scandir(self.sessions_dir):
+            if not entry.name.endswith('.lock'):
+                continue
+            try:
+                started = float(entry.name[:-len('.lock')].split('_', 1)[1])
+            except (IndexError, ValueError):
+                continue
+            if self._session is not None and entry.path == self._session[0]:
+                lock_file = None
+            else:
+                lock_file = try_lock_file(entry.path)
+            if lock_file is not None:
+                # 拿得到锁说明所属进程已经退出
+                with contextlib.suppress(OSError):
+                    os.remove(entry.path)
+                lock_file.close()
+                continue
+            earliest = started if earliest is None else min(earliest, started)
+        return earliest
+    
+    def blob_path(self, digest):
+        """返回 blob 的存储路径"""
+        return os.path.join(self.objects_dir, digest[:2], digest)
+    
+    @staticmethod
+    def hash_file(path, chunk_size=1024 * 1024):
+        """流式计算文件的 sha256"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    def add_file(self, path):
+        """把单个文件存入备份库，内容相同的文件只存一份，返回(digest, size)
+        
+        blob 是独立的副本（支持时用 reflink），按实际存入的内容计算哈希，
+        复制过程中源文件被改写时记录的也是存入的内容。
+        """
+        digest = self.hash_file(path)
+        blob = self.blob_path(digest)
+        
+        if os.path.exists(blob):
+            # 已存在的 blob 刷新时间戳，防止被并发的回收操作删除
+            os.utime(blob)
+            return digest, os.path.getsize(blob)
+        
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        os.close(fd)
+        try:
+            try:
+                SmartPluginCleaner._reflink_file(path, tmp_path, self.throttle)
+            except OSError:
+                if self.throttle is not None:
+                    self.throttle.copy_file(path, tmp_path)
+                else:
+                    shutil.copy2(path, tmp_path)
+            digest = self.hash_file(tmp_path)
+            size = os.path.getsize(tmp_path)
+            blob = self.blob_path(digest)
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.replace(tmp_path, blob)
+        finally:
+            if os.path.lexists(tmp_path):
+                os.remove(tmp_path)
+        
+        return digest, size
+    
+    def add_plugin(self, plugin):
+        """把插件（jar 或目录）存入备份库，返回清单中引用 blob 的条目"""
+        if not plugin['is_dir']:
+            digest, size = self.add_file(plugin['path'])
+            return {'blob': digest, 'size': size}
+        
+        files = []
+        empty_dirs = []
+        for root, dirs, filenames in os.walk(plugin['path']):
+            dirs.sort()
+            rel_root = os.path.relpath(root, plugin['path'])
+            if not dirs and not filenames and rel_root != '.':
+                empty_dirs.append(rel_root.replace(os.sep, '/'))
+            for filename in sorted(filenames):
+                rel_path = os.path.normpath(os.path.join(rel_root, filename)).replace(os.sep, '/')
+                digest, size = self.add_file(os.path.join(root, filename))
+                files.append({'path': rel_path, 'blob': digest, 'size': size})
+        
+        return {'files': files, 'empty_dirs': empty_dirs}
+    
+    def write_manifest(self, manifest):
+        """写入本次备份的清单，返回清单路径"""
+        source_key = hashlib.sha1(manifest['source_dir'].encode('utf-8')).hexdigest()[:8]
+        name = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{source_key}.json"
+        manifest_path = os.path.join(self.manifests_dir, name)
+        
+        tmp_path = manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, manifest_path)
+        return manifest_path
+    
+    def load_manifests(self):
+        """读取所有备份清单，返回[(路径, 清单)]"""
+        manifests = []
+        if not os.path.isdir(self.manifests_dir):
+            return manifests
+        
+        for entry in os.scandir(self.manifests_dir):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    manifests.append((entry.path, json.load(f)))
+            except (OSError, ValueError) as e:
+                print(f"  跳过无法读取的清单: {entry.name} - {e}")
+        
+        return manifests
+    
+    @staticmethod
+    def referenced_blobs(manifest):
+        """列出清单引用的所有 blob"""
+        for plugin in manifest.get('deleted_plugins', []):
+            if 'blob' in plugin:
+                yield plugin['blob']
+            for file_entry in plugin.get('files', []):
+                yield file_entry['blob']
+    
+    def gc(self, keep_days=None, keep_last=None):
+        """按保留策略删除旧清单，并回收不再被任何清单引用的 blob
+        
+        keep_days: 只保留最近 N 天内的清单
+        keep_last: 每个源目录只保留最近 N 份清单
+        """
+        stats = {'manifests_removed': 0, 'blobs_removed': 0, 'bytes_freed': 0}
+        manifests = self.load_manifests()
+        
+        # 1. 按保留策略挑出要删除的清单
+        expired = set()
+        if keep_days is not None:
+            cutoff = time.time() - keep_days * 86400
+            for path, manifest in manifests:
+                try:
+                    timestamp = datetime.fromisoformat(manifest['timestamp']).timestamp()
+                except (KeyError, ValueError):
+                    continue
+                if timestamp < cutoff:
+                    expired.add(path)
+        
+        if keep_last is not None:
+            by_source = defaultdict(list)
+            for path, manifest in manifests:
+                by_source[manifest.get('source_dir')].append((manifest.get('timestamp', ''), path))
+            for entries in by_source.values():
+                entries.sort(reverse=True)
+                expired.update(path for _, path in entries[keep_last:])
+        
+        for path in expired:
+            os.remove(path)
+            stats['manifests_removed'] += 1
+        
+        # 2. 标记仍被引用的 blob
+        referenced = set()
+        for path, manifest in manifests:
+            if path not in expired:
+                referenced.update(self.referenced_blobs(manifest))
+        
+        # 3. 清除未被引用的 blob（宽限期内以及进行中的备份开始之后写入或刷新过的除外）
+        if not os.path.isdir(self.objects_dir):
+            return stats
+        
+        grace_cutoff = time.time() - self.GC_GRACE_SECONDS
+        session_start = self.live_session_start()
+        if session_start is not None:
+            grace_cutoff = min(grace_cutoff, session_start)
+        for prefix in os.scandir(self.objects_dir):
+            if not prefix.is_dir():
+                continue
+            for blob in os.scandir(prefix.path):
+                if blob.name in referenced:
+                    continue
+                st = blob.stat()
+                if st.st_ctime > grace_cutoff:
+                    continue
+                os.remove(blob.path)
+                stats['blobs_removed'] += 1
+                stats['bytes_freed'] += st.st_size
+        
+        return stats
+
+
+class DeleteJournal:
+    """两阶段删除的日志
+    
+    第一阶段把待删除的插件重命名到同一文件系统上的回收目录，并在重命名前后
+    把日志落盘（prepared -> committed）；第二阶段再慢慢 rmtree 回收目录。
+    进程中途被杀时，下次启动根据日志回滚（prepared）或继续清理（committed）。
+    
+    事务从开始到清理完成一直由所属进程持有锁文件上的排他锁，恢复时拿不到锁的事务
+    属于仍在运行的进程，跳过不处理，避免回滚或删除其他进程正在进行的事务。
+    
+    目录结构（位于插件目录旁边）:
+        .plugin_cleaner_trash/journal_<事务>.json
+        .plugin_cleaner_trash/journal_<事务>.lock
+        .plugin_cleaner_trash/<事务>/<插件目录名>/<插件>
+    """
+    
+    TRASH_DIR_NAME = '.plugin_cleaner_trash'
+    
+    def __init__(self, trash_dir):
+        self.trash_dir = trash_dir
+        # 当前进程持有的事务锁 {日志路径: 锁文件}
+        self._locks = {}
+    
+    @classmethod
+    def trash_dir_for(cls, directory):
+        """返回插件目录对应的回收目录（与插件目录同级，保证重命名不跨文件系统）"""
+        return os.path.join(os.path.dirname(os.path.abspath(directory)), cls.TRASH_DIR_NAME)
+    
+    @staticmethod
+    def _fsync_dir(directory):
+        """把目录项的变化落盘（Windows 不支持打开目录，直接跳过）"""
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+    
+    def _write(self, journal_path, journal):
+        """原子地写入日志并落盘"""
+        tmp_path = journal_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(journal, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, journal_path)
+        self._fsync_dir(self.trash_dir)
+    
+    @staticmethod
+    def _lock_path(journal_path):
+        return journal_path[:-len('.json')] + '.lock'
+    
+    def _try_lock(self, journal_path):
+        """尝试对事务加排他锁（不等待），成功返回 True；锁由其他进程持有时返回 False"""
+        if journal_path in self._locks:
+            return True
+        lock_file = try_lock_file(self._lock_path(journal_path))
+        if lock_file is None:
+            return False
+        self._locks[journal_path] = lock_file
+        return True
+    
+    def release(self, journal_path):
+        """释放事务锁；日志已经删除（事务结束）时一并删除锁文件"""
+        lock_file = self._locks.pop(journal_path, None)
+        if lock_file is None:
+            return
+        if not os.path.exists(journal_path):
+            with contextlib.suppress(OSError):
+                os.remove(self._lock_path(journal_path))
+        lock_file.close()
+    
+    def journal_paths(self):
+        """返回回收目录中的所有日志"""
+        try:
+            names = sorted(os.listdir(self.trash_dir))
+        except OSError:
+            return []
+        return [os.path.join(self.trash_dir, name) for name in names
+                if name.startswith('journal_') and name.endswith('.json')]
+    
+    def begin(self, plugins, source_dir=None, backup_location=None):
+        """为待删除的插件分配回收位置并写入 prepared 日志，返回(日志路径, 日志)"""
+        # 同一进程在一秒内可能开始多个事务（监视模式的连续清理），加随机后缀避免冲突
+        txn = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{uuid.uuid4().hex[:8]}"
+        entries = []
+        txn_dirs = set()
+        for plugin in plugins:
+            directory = os.path.dirname(os.path.abspath(plugin['path']))
+            txn_dir = os.path.join(self.trash_dir_for(directory), txn)
+            txn_dirs.add(txn_dir)
+            entries.append({
+                'source': plugin['path'],
+                'trash': os.path.join(txn_dir, os.path.basename(directory), plugin['original_name']),
+                'is_dir': plugin['is_dir']
+            })
+        
+        journal = {
+            'txn': txn,
+            'state': 'prepared',
+            'owner': {'pid': os.getpid(), 'host': platform.node()},
+            'timestamp': datetime.now().isoformat(),
+            'source_dir': source_dir,
+            'backup_location': backup_location,
+            'txn_dirs': sorted(txn_dirs),
+            'entries': entries
+        }
+        os.makedirs(self.trash_dir, exist_ok=True)
+        journal_path = os.path.join(self.trash_dir, f"journal_{txn}.json")
+        # 写日志之前先持有锁，其他进程的恢复流程不会碰这个事务
+        if not self._try_lock(journal_path):
+            raise OSError(f"事务已被其他进程锁定: {journal_path}")
+        self._write(journal_path, journal)
+        return journal_path, journal
+    
+    def commit(self, journal_path, journal):
+        """所有插件都已移入回收目录后，把日志标记为 committed"""
+        # 先让重命名本身落盘，再提交日志
+        for directory in {os.path.dirname(path) for entry in journal['entries'] for path in (entry['source'], entry['trash'])}:
+            self._fsync_dir(directory)
+        journal['state'] = 'committed'
+        self._write(journal_path, journal)
+    
+    def rollback(self, journal_path, journal):
+        """把已移入回收目录的插件移回原位置并删除日志，返回移回的数量"""
+        restored = 0
+        for entry in journal['entries']:
+            if os.path.lexists(entry['trash']) and not os.path.lexists(entry['source']):
+                os.rename(entry['trash'], entry['source'])
+                restored += 1
+        for txn_dir in journal.get('txn_dirs', []):
+            shutil.rmtree(txn_dir, ignore_errors=True)
+        os.remove(journal_path)
+        return restored
+    
+    def purge(self, journal_path, journal, throttle=None):
+        """彻底删除回收目录中的插件并删除日志，返回删除的数量"""
+        purged = 0
+        for entry in journal['entries']:
+            if not os.path.lexists(entry['trash']):
+                continue
+            if entry['is_dir'] and not os.path.islink(entry['trash']):
+                if throttle is not None:
+                    throttle.remove_tree(entry['trash'], ignore_errors=True)
+                else:
+                    shutil.rmtree(entry['trash'], ignore_errors=True)
+            else:
+                with contextlib.suppress(FileNotFoundError):
+                    if throttle is not None:
+                        throttle.remove(entry['trash'])
+                    else:
+                        os.remove(entry['trash'])
+            purged += 1
+        for txn_dir in journal.get('txn_dirs', []):
+            shutil.rmtree(txn_dir, ignore_errors=True)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(journal_path)
+        return purged
+    
+    def recover(self, rollback=True, purge=True, throttle=None):
+        """处理上次遗留的日志：prepared 的回滚，committed 的继续清理
+        
+        只处理能拿到锁的事务，仍被其他进程持有的事务计入 active。
+        返回 {'rolled_back': 回滚的事务数, 'purged': 清理的事务数, 'pending': 未处理的事务数, 'active': 进行中的事务数}
+        """
+        stats = {'rolled_back': 0, 'purged': 0, 'pending': 0, 'active': 0}
+        for journal_path in self.journal_paths():
+            if journal_path in self._locks:
+                # 当前进程自己的事务
+                continue
+            try:
+                if not self._try_lock(journal_path):
+                    stats['active'] += 1
+                    continue
+            except OSError:
+                stats['pending'] += 1
+                continue
+            
+            try:
+                with open(journal_path, 'r', encoding='utf-8') as f:
+                    journal = json.load(f)
+            except FileNotFoundError:
+                # 其他进程（例如后台清理）已经处理完
+                self.release(journal_path)
+                continue
+            
+            try:
+                if journal.get('state') == 'committed' and purge:
+                    self.purge(journal_path, journal, throttle)
+                    stats['purged'] += 1
+                elif journal.get('state') == 'prepared' and rollback:
+                    self.rollback(journal_path, journal)
+                    stats['rolled_back'] += 1
+                else:
+                    stats['pending'] += 1
+            finally:
+                self.release(journal_path)
+        return stats
+
+
+def spawn_background_purge(trash_dir, extra_args=()):
+    """启动与当前进程分离的子进程清理回收目录，当前进程可以立即退出
+    
+    extra_args 传给子进程（例如限速和降低优先级的参数）。
+    """
+    command = [sys.executable, os.path.abspath(__file__), '--purge-trash', trash_dir] + list(extra_args)
+    options = {'stdin': subprocess.DEVNULL, 'stdout': subprocess.DEVNULL, 'stderr': subprocess.DEVNULL, 'close_fds': True}
+    if os.name == 'nt':
+        options['creationflags'] = getattr(subprocess, 'DETACHED_PROCESS', 0x8) | getattr(subprocess, 'CREATE_NEW_PROCESS_GROUP', 0x200)
+    else:
+        options['start_new_session'] = True
+    subprocess.Popen(command, **options)
+
+class TokenBucket:
+    """线程安全的令牌桶：按 rate 每秒补充令牌，最多积累 burst 个
+    
+    令牌不足时允许透支，由调用方在锁外等待透支部分补足，多个线程按到达顺序排队。
+    桶初始为空，短时间的运行也不会因为初始的满桶而超出限速。
+    """
+    
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def consume(self, amount):
+        """取出 amount 个令牌，必要时等待，返回等待的秒数"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+class IOThrottle:
+    """备份复制和删除的 I/O 限速：字节数和文件操作数各用一个令牌桶
+    
+    复制按数据块计入字节数，每个文件、目录的创建/删除/链接/重命名计为一次操作；
+    删除只计操作数。同时统计实际处理量，用于输出有效吞吐量。
+    """
+    
+    CHUNK_SIZE = 1024 * 1024
+    
+    def __init__(self, bytes_per_sec=None, ops_per_sec=None):
+        for limit in (bytes_per_sec, ops_per_sec):
+            if limit is not None and not limit > 0:
+                raise ValueError(f"限速必须大于 0: {limit}")
+        self.bytes_bucket = TokenBucket(bytes_per_sec) if bytes_per_sec else None
+        self.ops_bucket = TokenBucket(ops_per_sec) if ops_per_sec else None
+        self.bytes_per_sec = bytes_per_sec
+        self.ops_per_sec = ops_per_sec
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.ops = 0
+        self.waited = 0.0
+        self.started = None
+    
+    def acquire(self, nbytes=0, ops=1):
+        """在执行 I/O 之前调用，超出限速时阻塞"""
+        with self.lock:
+            if self.started is None:
+                self.started = time.monotonic()
+        waited = 0.0
+        if self.ops_bucket is not None and ops:
+            waited += self.ops_bucket.consume(ops)
+        if self.bytes_bucket is not None and nbytes:
+            waited += self.bytes_bucket.consume(nbytes)
+        with self.lock:
+            self.bytes += nbytes
+            self.ops += ops
+            self.waited += waited
+    
+    def copy_file(self, src, dst):
+        """按块复制文件并保留元数据，可作为 shutil.copytree 的 copy_function"""
+        self.acquire(0, 1)
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            for chunk in iter(lambda: fsrc.read(self.CHUNK_SIZE), b''):
+                self.acquire(len(chunk), 0)
+                fdst.write(chunk)
+        shutil.copystat(src, dst)
+        return dst
+    
+    def reader(self, fileobj):
+        """包装只读文件对象，读取时按实际读到的字节数限速"""
+        return _ThrottledReader(fileobj, self)
+    
+    def link(self, src, dst):
+        """建立硬链接，只计一次操作"""
+        self.acquire(0, 1)
+        os.link(src, dst)
+        return dst
+    
+    def remove(self, path):
+        """删除单个文件"""
+        self.acquire(0, 1)
+        os.remove(path)
+    
+    def remove_tree(self, path, ignore_errors=False):
+        """自底向上逐个删除目录树，每个文件和目录计为一次操作"""
+        def onerror(error):
+            if not ignore_errors:
+                raise error
+        
+        try:
+            for root, dirs, files in os.walk(path, topdown=False, onerror=onerror):
+                for name in files:
+                    self.remove(os.path.join(root, name))
+                for name in dirs:
+                    child = os.path.join(root, name)
+                    self.acquire(0, 1)
+                    if os.path.islink(child):
+                        os.remove(child)
+                    else:
+                        os.rmdir(child)
+            self.acquire(0, 1)
+            os.rmdir(path)
+        except OSError:
+            if not ignore_errors:
+                raise
+    
+    def reset_stats(self):
+        """清空统计（限速状态保留），用于分别统计多次清理"""
+        with self.lock:
+            self.bytes = 0
+            self.ops = 0
+            self.waited = 0.0
+            self.started = None
+    
+    def report(self):
+        """返回实际处理量和有效吞吐量（从第一次 I/O 到调用时为止），应在备份/删除完成后立即调用"""
+        elapsed = (time.monotonic() - self.started) if self.started is not None else 0.0
+        return {
+            'bytes': self.bytes,
+            'ops': self.ops,
+            'elapsed': round(elapsed, 3),
+            'waited': round(self.waited, 3),
+            'bytes_per_sec': round(self.bytes / elapsed) if elapsed > 0 else None,
+            'ops_per_sec': round(self.ops / elapsed, 1) if elapsed > 0 else None
+        }
+    
+    def summary(self):
+        """返回用于输出的吞吐量说明"""
+        stats = self.report()
+        if not stats['ops']:
+            return None
+        if stats['elapsed'] <= 0:
+            return f"I/O: {format_size(stats['bytes'])}, {stats['ops']} 次操作"
+        return (f"I/O 吞吐: {format_size(stats['bytes_per_sec'])}/s, {stats['ops_per_sec']} 次操作/s "
+                f"(共 {format_size(stats['bytes'])}, {stats['ops']} 次操作, 耗时 {stats['elapsed']:.2f}s, "
+                f"限速等待 {stats['waited']:.2f}s)")
+
+class _ThrottledReader:
+    """只读文件对象的包装：每次 read 之后按读到的字节数计入限速，供 zip/tar 按块写入"""
+    
+    __slots__ = ('fileobj', 'throttle')
+    
+    def __init__(self, fileobj, throttle):
+        self.fileobj = fileobj
+        self.throttle = throttle
+    
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        if data:
+            self.throttle.acquire(len(data), 0)
+        return data
+
+# ioprio_set 的系统调用号（按 CPU 架构）
+IOPRIO_SET_SYSCALLS = {'x86_64': 251, 'amd64': 251, 'i386': 289, 'i686': 289, 'aarch64': 30, 'arm64': 30,
+                       'armv7l': 314, 'ppc64le': 273, 's390x': 282, 'riscv64': 30}
+IOPRIO_CLASSES = {'realtime': 1, 'best-effort': 2, 'idle': 3}
+
+def lower_process_priority(nice=10, io_class='idle', io_level=7):
+    """降低当前进程（以及之后创建的子进程）的 CPU 和 I/O 优先级，返回实际生效的设置说明
+    
+    CPU 优先级通过 os.nice 调整；I/O 优先级通过 Linux 的 ioprio_set 系统调用设置，
+    其他平台或不支持的架构上跳过 I/O 优先级。
+    """
+    applied = []
+    if nice and hasattr(os, 'nice'):
+        try:
+            applied.append(f"nice {os.nice(nice)}")
+        except OSError as e:
+            print(f"  调整 CPU 优先级失败: {e}")
+    
+    syscall_number = IOPRIO_SET_SYSCALLS.get(platform.machine().lower())
+    if sys.platform.startswith('linux') and syscall_number and io_class:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        # IOPRIO_WHO_PROCESS=1，who=0 表示当前进程；优先级 = 类别 << 13 | 级别
+        ioprio = (IOPRIO_CLASSES[io_class] << 13) | (io_level if io_class == 'best-effort' else 0)
+        if libc.syscall(syscall_number, 1, 0, ioprio) == 0:
+            applied.append(f"ioprio {io_class}")
+        else:
+            print(f"  调整 I/O 优先级失败: {os.strerror(ctypes.get_errno())}")
+    return applied
+
+
+class InotifyWatcher:
+    """通过 ctypes 调用 inotify 监视目录中条目的增删（仅 Linux，无额外依赖，不递归子目录）"""
+    
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+                  | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+    
+    # struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[]; }
+    _EVENT_HEADER = struct.Struct('iIII')
+    
+    def __init__(self):
+        if not sys.platform.startswith('linux'):
+            raise OSError("监视模式只支持 Linux (inotify)")
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        # {watch 描述符: 目录}
+        self.watches = {}
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+    
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+    
+    def add_watch(self, directory):
+        """开始监视目录"""
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), ctypes.c_uint32(self.WATCH_MASK))
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), directory)
+        self.watches[wd] = directory
+        return wd
+    
+    def read_events(self, timeout=None):
+        """等待事件，返回[(目录, 条目名, 事件掩码)]，超时返回空列表"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = self._EVENT_HEADER.unpack_from(data, pos)
+                pos += self._EVENT_HEADER.size
+                name = os.fsdecode(data[pos:pos + length].rstrip(b'\0'))
+                pos += length
+                if mask & self.IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                events.append((self.watches.get(wd), name, mask))
+        return events
+
+
+class PhaseProfiler:
+    """记录各阶段及单个插件操作的耗时区间，可导出 Chrome trace 和汇总 JSON"""
+    
+    enabled = True
+    
+    def __init__(self):
+        self.spans = []
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+    
+    @contextlib.contextmanager
+    def span(self, name, category='phase', **args):
+        """记录一个区间，with 块内可以向返回的字典补充字节数、文件数等信息"""
+        started = time.perf_counter()
+        try:
+            yield args
+        except Exception as e:
+            args['error'] = str(e)
+            raise
+        finally:
+            # list.append 是原子操作，多个工作线程可以同时记录
+            self.spans.append({
+                'name': name,
+                'cat': category,
+                'start': started - self.origin,
+                'dur': time.perf_counter() - started,
+                'tid': threading.get_ident(),
+                'args': args
+            })
+    
+    def export_chrome_trace(self, path):
+        """导出 Chrome trace-event 格式（可在 chrome://tracing 或 Perfetto 中打开）"""
+        events = [{
+            'name': span['name'],
+            'cat': span['cat'],
+            'ph': 'X',
+            'ts': round(span['start'] * 1e6, 3),
+            'dur': round(span['dur'] * 1e6, 3),
+            'pid': self.pid,
+            'tid': span['tid'],
+            'args': span['args']
+        } for span in self.spans]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+    
+    def summary(self):
+        """按(类别, 名称)汇总次数、耗时、字节数、文件数和错误数"""
+        totals = {}
+        for span in self.spans:
+            key = f"{span['cat']}:{span['name']}"
+            item = totals.setdefault(key, {'count': 0, 'seconds': 0.0, 'bytes': 0, 'files': 0, 'errors': 0})
+            item['count'] += 1
+            item['seconds'] += span['dur']
+            item['bytes'] += span['args'].get('bytes', 0)
+            item['files'] += span['args'].get('files', 0)
+            item['errors'] += 1 if 'error' in span['args'] else 0
+        for item in totals.values():
+            item['seconds'] = round(item['seconds'], 6)
+        return totals
+    
+    def export_summary(self, path):
+        """导出汇总 JSON"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=2, ensure_ascii=False)
+
+
+class _NullSpan:
+    """关闭性能分析时使用的空区间"""
+    
+    def __enter__(self):
+        return None
+    
+    def __exit__(self, *exc_info):
+        return False
+
+
+class NullProfiler:
+    """关闭性能分析时的占位实现，span() 总是返回同一个空区间，几乎没有开销"""
+    
+    enabled = False
+    _null_span = _NullSpan()
+    
+    def span(self, name, category='phase', **args):
+        return self._null_span
+
+
+def profiled_phase(name):
+    """把方法的执行记录为一个阶段区间"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.profiler.span(name):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
 
 class SmartPluginCleaner:
-    def __init__(self, plugin_dir, backup_dir=None):
+    # 备份方式，按开销从低到高排列
+    BACKUP_METHODS = ('move', 'hardlink', 'reflink', 'copy')
+    # 备份格式：目录或单个压缩包
+    BACKUP_FORMATS = {'dir': None, 'zip': '.zip', 'tar.gz': '.tar.gz', 'tar.xz': '.tar.xz'}
+    # 扫描索引格式版本，插件解析规则变化时需要递增
+    SCAN_INDEX_FORMAT = 5
+    # 目录在该时间内被修改过时不信任其 mtime，避免同一时间刻度内的变化被漏掉
+    SCAN_INDEX_RACY_SECONDS = 2
+    # jar 校验级别：quick 只检查中央目录，full 校验所有条目的 CRC
+    JAR_VERIFY_LEVELS = ('quick', 'full')
+    JAR_VERIFY_CACHE_FORMAT = 1
+    # 安装发现：每个候选路径的探测超时（秒）、有限深度遍历的超时倍数、结果缓存有效期（秒）
+    DISCOVERY_TIMEOUT = 2.0
+    DISCOVERY_WALK_TIMEOUT_FACTOR = 5
+    DISCOVERY_CACHE_TTL = 3600
+    # 有路径探测超时时结果不完整，只缓存较短时间，暂时变慢的挂载点不会被长时间排除
+    DISCOVERY_PARTIAL_CACHE_TTL = 60
+    # 流式计划中估算每条记录在内存中占用的额外字节数（列表、整数等对象开销）
+    STREAM_RECORD_OVERHEAD = 320
+    # 监视模式下最后一个事件之后等待多久再分析和清理（秒）
+    WATCH_DEBOUNCE = 5.0
+    # 多路归并时同时打开的临时文件数上限，超过时先分批归并
+    STREAM_MERGE_FANIN = 128
+    # 预览和结果的排列方式：按插件名，或按可回收空间从大到小
+    SORT_KEYS = ('name', 'size')
+    # 两阶段删除时回收目录的清理方式：立即清理、后台进程清理、留到下次启动
+    PURGE_MODES = ('now', 'background', 'later')
+    # Eclipse安装目录的标志文件
+    INSTALL_MARKERS = ('eclipse.ini', '.eclipseproduct', 'configuration')
+    # 已经压缩过的文件在 zip 中直接存储，不再重复压缩
+    STORED_EXTENSIONS = ('.jar', '.zip', '.war', '.ear', '.gz', '.xz', '.bz2', '.png', '.jpg', '.jpeg', '.gif')
+    
+    def __init__(self, plugin_dir, backup_dir=None, extra_dirs=None, scan_workers=4, backup_strategy='auto',
+                 workers=4, backup_format='dir', backup_store=None, use_scan_index=False, cache_dir=None,
+                 use_manifest=False, respect_dependencies=False, profiler=None, record_hashes=False,
+                 journaled=False, purge_mode='background', sort_by='name', respect_p2=True, verify_jars=None,
+                 io_limit=None, ops_limit=None):
+        if backup_strategy != 'auto' and backup_strategy not in self.BACKUP_METHODS:
+            raise ValueError(f"未知的备份方式: {backup_strategy}")
+        if backup_format not in self.BACKUP_FORMATS:
+            raise ValueError(f"未知的备份格式: {backup_format}")
+        if backup_store and backup_format != 'dir':
+            raise ValueError("去重备份库不能与压缩包备份同时使用")
+        if verify_jars and verify_jars not in self.JAR_VERIFY_LEVELS:
+            raise ValueError(f"未知的 jar 校验级别: {verify_jars}")
+        if sort_by not in self.SORT_KEYS:
+            raise ValueError(f"未知的排序方式: {sort_by}")
+        if purge_mode not in self.PURGE_MODES:
+            raise ValueError(f"未知的清理方式: {purge_mode}")
+        
         self.plugin_dir = plugin_dir
         self.backup_dir = backup_dir or os.path.join(plugin_dir, f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        # 需要一起扫描的目录（plugins/、dropins/ 以及其他安装的插件目录）
+        main_dir = os.path.normpath(plugin_dir)
+        self.scan_dirs = [main_dir] + [d for d in SmartPluginCleaner._normalize_and_deduplicate_paths(extra_dirs or []) if d != main_dir]
+        self.scan_workers = max(1, scan_workers)
+        self.backup_strategy = backup_strategy
+        self.backup_format = backup_format
+        # 压缩包备份的路径（目录备份时为 None）
+        self.backup_archive = None
+        if backup_format != 'dir':
+            self.backup_archive = self.backup_dir + self.BACKUP_FORMATS[backup_format]
+        # 备份复制和删除的 I/O 限速（字节/秒、操作/秒），不限速时为 None
+        self.throttle = IOThrottle(io_limit, ops_limit) if io_limit is not None or ops_limit is not None else None
+        # 按内容哈希去重的备份库（可选）
+        self.backup_store = BackupStore(backup_store, self.throttle) if backup_store else None
+        self.backup_manifest_path = None
+        # 持久化扫描索引（按目录 mtime/inode 校验，只重新解析变化的条目）
+        self.use_scan_index = use_scan_index
+        self.cache_dir = cache_dir or self.default_cache_dir()
+        # 备份时是否记录大小、文件数和内容哈希供还原时校验（需要额外遍历并读取插件；备份库条目总带有大小）
+        self.record_hashes = record_hashes
+        # 性能分析（默认关闭，使用几乎无开销的空实现）
+        self.profiler = profiler or NullProfiler()
+        # 保留仍被其他插件 Require-Bundle 依赖的旧版本（需要读取清单）
+        self.respect_dependencies = respect_dependencies
+        # 从 OSGi 清单读取插件名和版本，而不是从文件名推断
+        self.use_manifest = use_manifest or respect_dependencies
+        # 选择保留版本前校验重复插件的 jar，损坏时退回到最新的完整版本（None 表示不校验）
+        self.verify_jars = verify_jars
+        # 读取 p2 元数据，保护 Eclipse 实际加载的插件，删除后同步更新 bundles.info 和 artifact 索引
+        self.respect_p2 = respect_p2
+        self.p2 = None
+        # 两阶段删除：先把插件重命名到回收目录并记录日志，之后再清理回收目录
+        self.journaled = journaled
+        self.sort_by = sort_by
+        self.purge_mode = purge_mode
+        self.journal = DeleteJournal(DeleteJournal.trash_dir_for(plugin_dir))
+        # 备份/删除执行器的并发数
+        self.workers = max(1, workers)
+        # 每个待删除插件的执行结果
+        self.results = []
+        # 每个插件实际使用的备份方式 {插件路径: 方式}
+        self.backup_methods = {}
         self.plugins_by_name = defaultdict(list)
-        self.to_delete = []
-        self.to_keep = []
+        self.plan = CleanupPlan()
+    
+    @property
+    def to_keep(self):
+        """保留的插件"""
+        return self.plan.to_keep
+    
+    @property
+    def to_delete(self):
+        """待删除的插件"""
+        return self.plan.to_delete
+    
+    @property
+    def backup_location(self):
+        """备份的实际位置：去重备份库、压缩包或备份目录"""
+        if self.backup_store:
+            return self.backup_store.store_dir
+        return self.backup_archive or self.backup_dir
+    
+    @staticmethod
+    def default_cache_dir():
+        """返回默认的缓存目录"""
+        if platform.system() == "Windows":
+            base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+        else:
+            base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+        return os.path.join(base, 'smart_plugin_cleaner')
     
     @staticmethod
     def find_eclipse_from_registry():
@@ -117,45 +1940,144 @@ class SmartPluginCleaner:
         except Exception as e:
             print(f"开始菜单查找出错: {e}")
         
-        return SmartPluginCleaner._normalize_and_deduplicate_paths(eclipse_paths)
+        return SmartPluginCleaner._normalize_and_deduplicate_paths(eclipse_paths)
+    
+    @staticmethod
+    def _probe_concurrently(probe, items, timeout, max_workers=16):
+        """并发执行探测函数，每项有独立的超时时间，返回({项: 结果}, [超时的项])
+        
+        每个探测运行在独立的守护线程中，卡在失效 NFS/自动挂载路径上的线程会被放弃，
+        不会阻塞启动，也不会阻止进程退出。
+        """
+        results = {}
+        timed_out = []
+        pending = list(reversed(items))
+        running = {}
+        finished = queue.Queue()
+        
+        def worker(item):
+            try:
+                finished.put((item, probe(item), None))
+            except Exception as e:
+                finished.put((item, None, e))
+        
+        while pending or running:
+            while pending and len(running) < max_workers:
+                item = pending.pop()
+                running[item] = time.monotonic()
+                threading.Thread(target=worker, args=(item,), daemon=True).start()
+            
+            # 等待到最早开始的探测超时为止
+            wait = min(running.values()) + timeout - time.monotonic()
+            try:
+                item, value, error = finished.get(timeout=max(0, wait))
+                if item in running:
+                    del running[item]
+                    if error is None:
+                        results[item] = value
+            except queue.Empty:
+                pass
+            
+            now = time.monotonic()
+            for item, started in list(running.items()):
+                if now - started >= timeout:
+                    del running[item]
+                    timed_out.append(item)
+        
+        return results, timed_out
+    
+    @staticmethod
+    def _is_eclipse_installation(names):
+        """根据目录中的标志文件（eclipse.ini、.eclipseproduct、configuration/）判断是否为Eclipse安装"""
+        return any(marker in names for marker in SmartPluginCleaner.INSTALL_MARKERS)
+    
+    @staticmethod
+    def _walk_for_installations(root, max_depth):
+        """有限深度的 scandir 遍历，返回包含安装标志的目录（找到后不再深入）"""
+        installations = []
+        stack = [(root, 0)]
+        
+        while stack:
+            path, depth = stack.pop()
+            try:
+                with os.scandir(path) as entries:
+                    subdirs = []
+                    names = set()
+                    for entry in entries:
+                        names.add(entry.name)
+                        if depth < max_depth and not entry.name.startswith('.') and entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+            except OSError:
+                continue
+            
+            if SmartPluginCleaner._is_eclipse_installation(names) and ('plugins' in names or 'dropins' in names):
+                installations.append(path)
+                continue
+            stack.extend((subdir, depth + 1) for subdir in subdirs)
+        
+        return installations
+    
+    @staticmethod
+    def _discovery_cache_path(cache_dir, roots, max_depth):
+        """返回发现结果缓存文件路径（不同的搜索根目录和深度分别缓存）"""
+        key = hashlib.sha1(json.dumps([sorted(roots or []), max_depth, os.getcwd()]).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(cache_dir or SmartPluginCleaner.default_cache_dir(), 'discovery', key + '.json')
     
     @staticmethod
-    def find_eclipse_plugin_dirs():
-        """自动查找Eclipse插件目录"""
+    def find_eclipse_plugin_dirs(roots=None, max_depth=2, timeout=None, use_cache=True, cache_ttl=None, cache_dir=None):
+        """自动查找Eclipse插件目录
+        
+        roots: 额外进行有限深度遍历的根目录，按安装标志识别其中的Eclipse安装
+        timeout: 每个候选路径的探测超时（秒）
+        use_cache/cache_ttl: 在有效期内直接返回上次的发现结果；有探测超时的结果只缓存 DISCOVERY_PARTIAL_CACHE_TTL 秒
+        """
+        timeout = timeout or SmartPluginCleaner.DISCOVERY_TIMEOUT
+        cache_ttl = SmartPluginCleaner.DISCOVERY_CACHE_TTL if cache_ttl is None else cache_ttl
+        cache_path = SmartPluginCleaner._discovery_cache_path(cache_dir, roots, max_depth)
+        
+        if use_cache:
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    cached = json.load(f)
+                if time.time() - cached['timestamp'] < min(cache_ttl, cached.get('ttl', cache_ttl)):
+                    return cached['plugin_dirs']
+            except (OSError, ValueError, KeyError):
+                pass
+        
         plugin_dirs = []
+        search_paths = []
+        timed_out = []
         
-        # 1. Windows平台优先从注册表查找
+        # 1. Windows平台优先从注册表和开始菜单查找（同样放在超时探测中，卡住的快捷方式目标不会阻塞启动）
         if platform.system() == "Windows":
-            registry_paths = SmartPluginCleaner.find_eclipse_from_registry()
-            for path in registry_paths:
-                plugin_dirs.extend(SmartPluginCleaner._check_eclipse_installation(path))
-            
-            # 从开始菜单查找
-            start_menu_paths = SmartPluginCleaner.find_eclipse_from_start_menu()
-            for path in start_menu_paths:
-                plugin_dirs.extend(SmartPluginCleaner._check_eclipse_installation(path))
+            sources = {
+                'registry': SmartPluginCleaner.find_eclipse_from_registry,
+                'start_menu': SmartPluginCleaner.find_eclipse_from_start_menu
+            }
+            source_results, source_timed_out = SmartPluginCleaner._probe_concurrently(
+                lambda source: sources[source](), list(sources),
+                timeout * SmartPluginCleaner.DISCOVERY_WALK_TIMEOUT_FACTOR)
+            timed_out.extend(source_timed_out)
+            for source in sources:
+                search_paths.extend(source_results.get(source, []))
         
         # 2. 常见的Eclipse安装路径
-        search_paths = []
-        
-        # Windows系统：遍历所有可用盘符
+        # Windows系统：遍历所有盘符（盘符是否可用也交给并发探测判断，避免失效的网络盘阻塞）
         if platform.system() == "Windows":
             import string
             for drive in string.ascii_uppercase:
-                drive_path = f"{drive}:/"
-                if os.path.exists(drive_path):
-                    # 每个盘符的常见安装位置
-                    search_paths.extend([
-                        f"{drive}:/eclipse",
-                        f"{drive}:/Eclipse",
-                        f"{drive}:/Program Files/Eclipse",
-                        f"{drive}:/Program Files (x86)/Eclipse",
-                        f"{drive}:/ProgramData/Eclipse",
-                        f"{drive}:/Users/%USERNAME%/eclipse",
-                        f"{drive}:/Dev/eclipse",
-                        f"{drive}:/Tools/eclipse",
-                        f"{drive}:/IDE/eclipse"
-                    ])
+                # 每个盘符的常见安装位置
+                search_paths.extend([
+                    f"{drive}:/eclipse",
+                    f"{drive}:/Eclipse",
+                    f"{drive}:/Program Files/Eclipse",
+                    f"{drive}:/Program Files (x86)/Eclipse",
+                    f"{drive}:/ProgramData/Eclipse",
+                    f"{drive}:/Users/%USERNAME%/eclipse",
+                    f"{drive}:/Dev/eclipse",
+                    f"{drive}:/Tools/eclipse",
+                    f"{drive}:/IDE/eclipse"
+                ])
         else:
             # 非Windows系统的常见路径
             search_paths.extend([
@@ -178,16 +2100,46 @@ class SmartPluginCleaner:
                 break
             current_dir = parent
         
-        # 搜索所有可能的路径
-        for base_path in search_paths:
-            if not os.path.exists(base_path):
-                continue
-            
-            plugin_dirs.extend(SmartPluginCleaner._check_eclipse_installation(base_path))
+        # 4. 并发探测所有候选路径，单个路径超时不影响其他路径
+        candidates = list(dict.fromkeys(search_paths))
+        results, candidates_timed_out = SmartPluginCleaner._probe_concurrently(
+            SmartPluginCleaner._check_eclipse_installation, candidates, timeout)
+        timed_out.extend(candidates_timed_out)
+        for path in candidates:
+            plugin_dirs.extend(results.get(path, []))
+        
+        # 5. 在指定根目录下按安装标志有限深度遍历
+        if roots:
+            walk_results, walk_timed_out = SmartPluginCleaner._probe_concurrently(
+                lambda root: SmartPluginCleaner._walk_for_installations(root, max_depth), list(dict.fromkeys(roots)),
+                timeout * SmartPluginCleaner.DISCOVERY_WALK_TIMEOUT_FACTOR)
+            timed_out.extend(walk_timed_out)
+            installations = [path for root in roots for path in walk_results.get(root, [])]
+            install_results, install_timed_out = SmartPluginCleaner._probe_concurrently(
+                SmartPluginCleaner._check_eclipse_installation, list(dict.fromkeys(installations)), timeout)
+            timed_out.extend(install_timed_out)
+            for path in installations:
+                plugin_dirs.extend(install_results.get(path, []))
+        
+        for path in timed_out:
+            print(f"  跳过响应超时的路径: {path}")
         
         # 去重并排序（Windows大小写不敏感处理）
         plugin_dirs = SmartPluginCleaner._normalize_and_deduplicate_paths(plugin_dirs)
         
+        if use_cache:
+            try:
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                tmp_path = cache_path + f'.{os.getpid()}.tmp'
+                entry = {'timestamp': time.time(), 'plugin_dirs': plugin_dirs}
+                if timed_out:
+                    entry['ttl'] = SmartPluginCleaner.DISCOVERY_PARTIAL_CACHE_TTL
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(entry, f, ensure_ascii=False)
+                os.replace(tmp_path, cache_path)
+            except OSError:
+                pass
+        
         return plugin_dirs
     
     @staticmethod
@@ -307,12 +2259,18 @@ class SmartPluginCleaner:
         return drives
     
     @staticmethod
-    def select_plugin_dir():
-        """让用户选择插件目录"""
+    def select_plugin_dir(found_dirs=None, **discovery_options):
+        """让用户选择插件目录
+        
+        found_dirs: 已经查找到的插件目录，None 时使用 discovery_options 调用 find_eclipse_plugin_dirs 查找
+        """
         print("=== Eclipse 插件目录选择 ===\n")
         
         # 自动查找插件目录
-        found_dirs = SmartPluginCleaner.find_eclipse_plugin_dirs()
+        if found_dirs is None:
+            found_dirs = SmartPluginCleaner.find_eclipse_plugin_dirs(**discovery_options)
+        else:
+            found_dirs = list(found_dirs)
         
         # 添加当前目录选项
         current_dir = os.getcwd()
@@ -364,10 +2322,30 @@ class SmartPluginCleaner:
                 print("\n\n用户取消操作")
                 return None
         
-    def parse_plugin_info(self, filename):
-        """解析插件信息，返回(name, version, full_version)"""
+    def _read_manifest(self, path, is_dir):
+        """读取插件清单，读取失败或没有清单时返回空字典"""
+        try:
+            return read_bundle_manifest(path, is_dir) or {}
+        except (OSError, zipfile.BadZipFile, struct.error, zlib.error):
+            return {}
+    
+    def parse_plugin_info(self, filename, is_dir=None, directory=None, manifest=None):
+        """解析插件信息，返回(original_name, name, version, is_dir)
+        
+        manifest 为调用方已经读取的清单，避免重复读取。
+        """
         original_name = filename
-        is_dir = os.path.isdir(os.path.join(self.plugin_dir, filename))
+        if is_dir is None:
+            # 调用方没有提供 DirEntry 类型信息时才额外 stat 一次
+            is_dir = os.path.isdir(os.path.join(directory or self.plugin_dir, filename))
+        
+        if self.use_manifest:
+            if manifest is None:
+                manifest = self._read_manifest(os.path.join(directory or self.plugin_dir, filename), is_dir)
+            identity = bundle_identity(manifest)
+            if identity:
+                name, version = identity
+                return original_name, name, version, is_dir
         
         if filename.endswith('.jar'):
             filename = filename[:-4]
@@ -376,188 +2354,1563 @@ class SmartPluginCleaner:
         if '_' not in filename:
             return original_name, None, None, is_dir
         
-        parts = filename.rsplit('_', 1)
-        name = parts[0]
-        version_str = parts[1]
+        # 保留完整版本号 (1.2.3.v20200101-1000)，限定符参与排序
+        name, version = filename.rsplit('_', 1)
         
-        # 提取主版本号 (1.2.3.v20200101-1000 -> 1.2.3)
-        main_version = re.split(r'\.v', version_str)[0] if '.v' in version_str else version_str
-        
-        return original_name, name, main_version, is_dir
+        return original_name, name, version, is_dir
     
     def version_to_tuple(self, version_str):
-        """将版本字符串转换为可比较的元组"""
-        if not version_str:
-            return (0, 0, 0)
+        """将版本字符串转换为可比较的元组 (major, minor, micro, 限定符类别, 数字限定符, qualifier)"""
+        return parse_version(version_str).key
+    
+    def _scan_index_path(self, directory):
+        """返回目录对应的扫描索引文件路径"""
+        key = hashlib.sha1(os.path.abspath(directory).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, 'scan_index', key + '.json')
+    
+    def _load_scan_index(self, directory):
+        """读取目录的扫描索引，格式不符或损坏时返回 None"""
+        try:
+            with open(self._scan_index_path(directory), 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        
+        if (index.get('format') != self.SCAN_INDEX_FORMAT or index.get('directory') != os.path.abspath(directory)
+                or index.get('use_manifest', False) != self.use_manifest):
+            return None
+        return index
+    
+    def _save_scan_index(self, directory, dir_signature, entries):
+        """原子地写入扫描索引，并发运行时读者只会看到完整的文件"""
+        index_path = self._scan_index_path(directory)
+        try:
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(index_path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'format': self.SCAN_INDEX_FORMAT,
+                    'directory': os.path.abspath(directory),
+                    'use_manifest': self.use_manifest,
+                    'dir_signature': dir_signature,
+                    'entries': entries
+                }, f)
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            print(f"  扫描索引写入失败: {e}")
+    
+    @staticmethod
+    def _content_signature(path, is_dir):
+        """插件内容的签名：jar 为 [大小, mtime_ns]，目录插件为其清单文件的 [大小, mtime_ns]（没有清单时为 None）
+        
+        从清单读取插件名和版本时，原地改写 jar 或清单不会改变目录的 mtime 和条目的 inode，
+        只能靠它判断缓存的解析结果是否仍然有效。
+        """
+        try:
+            st = os.stat(os.path.join(path, 'META-INF', 'MANIFEST.MF') if is_dir else path)
+        except OSError:
+            return None
+        return [st.st_size, st.st_mtime_ns]
+    
+    def _make_record(self, directory, original_name, name, version, is_dir, require_bundle=None):
+        """生成插件记录"""
+        return PluginRecord(directory, original_name, name, version, self.version_to_tuple(version), is_dir, require_bundle)
+    
+    def _scan_directory(self, directory):
+        """单次 scandir 扫描一个目录，返回该目录下的插件记录列表"""
+        index = None
+        dir_signature = None
+        if self.use_scan_index:
+            st = os.stat(directory)
+            # 刚被修改过的目录 mtime 不可靠，此时不记录签名，下次仍会重新 scandir
+            if time.time() - st.st_mtime > self.SCAN_INDEX_RACY_SECONDS:
+                dir_signature = [st.st_dev, st.st_ino, st.st_mtime_ns]
+            index = self._load_scan_index(directory)
+            
+            # 目录未变化：直接使用索引，无需 scandir。插件名和版本来自清单时，
+            # 条目内容可能被原地改写而目录 mtime 不变，仍需逐个核对内容签名
+            if index and dir_signature and index['dir_signature'] == dir_signature and not self.use_manifest:
+                return [self._make_record(directory, original_name, name, version, is_dir, require_bundle)
+                        for original_name, (_, is_dir, name, version, require_bundle, _) in index['entries'].items()
+                        if name and version]
+        
+        cached_entries = index['entries'] if index else {}
+        entries_out = {}
+        records = []
+        script_name = os.path.basename(__file__)
+        
+        scanned = []
+        to_parse = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                # 跳过备份目录和当前脚本文件
+                if entry.name.startswith('backup_') or entry.name == script_name:
+                    continue
+                
+                # DirEntry 自带类型信息，无需再逐个 stat
+                try:
+                    is_dir = entry.is_dir()
+                    inode = entry.inode()
+                except OSError:
+                    continue
+                
+                # 条目签名(inode, 类型, 内容签名)未变化时沿用索引中的解析结果；
+                # 不读取清单时插件名和版本只取决于文件名，无需内容签名
+                signature = self._content_signature(entry.path, is_dir) if self.use_manifest else None
+                cached = cached_entries.get(entry.name)
+                if cached and cached[0] == inode and cached[1] == is_dir and cached[5] == signature:
+                    scanned.append(cached)
+                else:
+                    scanned.append(None)
+                    to_parse.append((len(scanned) - 1, entry.name, is_dir, inode, signature))
+                entries_out[entry.name] = None
         
-        # 移除非数字字符，只保留数字和点
-        clean_version = re.sub(r'[^\d.]', '', version_str)
+        # 读取清单需要打开文件，条目较多时并行解析
+        def parse(item):
+            _, filename, is_dir, inode, signature = item
+            manifest = self._read_manifest(os.path.join(directory, filename), is_dir) if self.use_manifest else None
+            _, name, version, is_dir = self.parse_plugin_info(filename, is_dir, directory, manifest)
+            return [inode, is_dir, name, version, manifest.get('Require-Bundle') if manifest else None, signature]
         
-        # 分割版本号并转换为整数
-        parts = [int(x) for x in clean_version.split('.')]
+        if self.use_manifest and len(to_parse) > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                parsed = list(executor.map(parse, to_parse))
+        else:
+            parsed = [parse(item) for item in to_parse]
+        for item, value in zip(to_parse, parsed):
+            scanned[item[0]] = value
+        
+        for filename, value in zip(entries_out, scanned):
+            entries_out[filename] = value
+            _, is_dir, name, version, require_bundle, _ = value
+            if name and version:
+                records.append(self._make_record(directory, filename, name, version, is_dir, require_bundle))
         
-        # 补齐到4位 (major.minor.patch.build)
-        while len(parts) < 4:
-            parts.append(0)
+        if self.use_scan_index:
+            self._save_scan_index(directory, dir_signature, entries_out)
         
-        return tuple(parts[:4])
+        return records
+    
+    def _profiled_scan_directory(self, directory):
+        """扫描单个目录并记录区间"""
+        with self.profiler.span('scan_dir', 'directory', directory=directory) as span:
+            records = self._scan_directory(directory)
+            if span is not None:
+                span['entries'] = len(records)
+            return records
     
+    @profiled_phase('scan')
     def scan_plugins(self):
-        """扫描插件目录"""
-        print(f"扫描插件目录: {self.plugin_dir}")
+        """扫描插件目录（多个目录时并行扫描）"""
+        existing_dirs = []
+        for directory in self.scan_dirs:
+            print(f"扫描插件目录: {directory}")
+            if os.path.isdir(directory):
+                existing_dirs.append(directory)
+            elif directory == os.path.normpath(self.plugin_dir):
+                print(f"错误: 目录 {directory} 不存在")
+                return False
+            else:
+                print(f"  跳过不存在的目录: {directory}")
+        
+        workers = min(self.scan_workers, len(existing_dirs))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [(directory, executor.submit(self._profiled_scan_directory, directory)) for directory in existing_dirs]
+            
+            # 按目录顺序合并结果，保证输出稳定
+            for directory, future in futures:
+                try:
+                    records = future.result()
+                except OSError as e:
+                    print(f"  扫描失败: {directory} - {e}")
+                    if directory == os.path.normpath(self.plugin_dir):
+                        return False
+                    continue
+                
+                for record in records:
+                    self.plugins_by_name[record['name']].append(record)
+        
+        print(f"发现 {len(self.plugins_by_name)} 种插件")
+        
+        if self.respect_p2:
+            self._load_p2_metadata()
+        return True
+    
+    def _install_root(self):
+        """插件目录所在的安装目录"""
+        return os.path.dirname(os.path.normpath(os.path.abspath(self.plugin_dir)))
+    
+    def _load_p2_metadata(self):
+        """读取插件目录所在安装的 p2 元数据（没有时不启用）
+        
+        重新读取（监视模式下元数据变化）失败时保留之前读取的结果，避免失去对活动插件的保护。
+        """
+        with self.profiler.span('p2_index', 'phase'):
+            try:
+                metadata = P2Metadata.load(self._install_root())
+            except (OSError, ValueError, ElementTree.ParseError, zipfile.BadZipFile, KeyError) as e:
+                print(f"  读取 p2 元数据失败，已忽略: {e}")
+                return
+        self.p2 = metadata if metadata.found else None
+        if metadata.found:
+            print(f"读取 p2 元数据: 活动插件 {len(metadata.active_bundles)} 个")
+    
+    @profiled_phase('analyze')
+    def analyze_duplicates(self, names=None):
+        """分析重复插件，names 不为 None 时只分析这些插件名（监视模式下的增量分析）"""
+        if names is None:
+            families = self.plugins_by_name
+        else:
+            families = {name: self.plugins_by_name[name] for name in names if self.plugins_by_name.get(name)}
+        
+        self.plan = CleanupPlan()
+        invalid = self._verify_candidate_jars(families) if self.verify_jars else {}
+        fallbacks = 0
+        # 按版本排序（从高到低）
+        for name, sorted_plugins in sort_plugin_groups(families).items():
+            # 保留最新的完整版本，其余标记为待删除；只有一个版本的插件保留
+            survivor = next((plugin for plugin in sorted_plugins if plugin['path'] not in invalid), sorted_plugins[0])
+            if survivor is not sorted_plugins[0]:
+                fallbacks += 1
+            self.plan.keep([survivor])
+            self.plan.delete([plugin for plugin in sorted_plugins if plugin is not survivor])
+        
+        # 先保护 Eclipse 实际加载的版本，依赖分析再从全部保留的插件出发
+        active = self._retain_active_bundles() if self.p2 else 0
+        retained = self._retain_required_versions() if self.respect_dependencies else 0
+        
+        print(f"\n分析结果:")
+        print(f"  保留插件: {len(self.to_keep)} 个")
+        print(f"  删除插件: {len(self.to_delete)} 个")
+        if fallbacks:
+            print(f"  因最新版本 jar 损坏改为保留旧版本: {fallbacks} 个")
+        if active:
+            print(f"  因在 bundles.info 中被加载额外保留: {active} 个")
+        if retained:
+            print(f"  因依赖关系额外保留: {retained} 个")
+    
+    def _jar_verify_cache_path(self):
+        """返回 jar 校验结果缓存文件路径"""
+        key = hashlib.sha1(os.path.abspath(self.plugin_dir).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, 'jar_verify', key + '.json')
+    
+    def _load_jar_verify_cache(self):
+        """读取 jar 校验结果缓存 {路径: [大小, mtime_ns, inode, 级别, 错误]}"""
+        try:
+            with open(self._jar_verify_cache_path(), 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return cache.get('entries', {}) if cache.get('format') == self.JAR_VERIFY_CACHE_FORMAT else {}
+    
+    def _save_jar_verify_cache(self, entries):
+        """原子地写入 jar 校验结果缓存"""
+        cache_path = self._jar_verify_cache_path()
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'format': self.JAR_VERIFY_CACHE_FORMAT, 'entries': entries}, f)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"  jar 校验缓存写入失败: {e}")
+    
+    def _verify_candidate_jars(self, families):
+        """在线程池中校验所有有多个版本的插件的 jar，返回{路径: 错误}（只包含损坏的 jar）
+        
+        校验以文件读取和 zlib 解压为主，二者都会释放 GIL，线程即可并行，
+        也省去了进程池启动和传递结果的开销（批量清理时每个工作进程各自校验）。
+        
+        结果按文件签名(大小, mtime, inode)缓存，未变化的 jar 不会重新读取；
+        full 级别的结果可以用于 quick 校验，反之不行。
+        """
+        jars = [plugin['path'] for plugins in families.values() if len(plugins) > 1
+                for plugin in plugins if not plugin['is_dir']]
+        cache = self._load_jar_verify_cache()
+        entries = {}
+        pending = []
+        
+        with self.profiler.span('verify_jars', 'phase', jars=len(jars)):
+            for path in jars:
+                try:
+                    st = os.stat(path)
+                except OSError as e:
+                    entries[path] = [None, None, None, self.verify_jars, str(e)]
+                    continue
+                signature = [st.st_size, st.st_mtime_ns, st.st_ino]
+                cached = cache.get(path)
+                if (cached and cached[:3] == signature
+                        and (cached[3] == 'full' or self.verify_jars == 'quick' or cached[4] is not None)):
+                    entries[path] = cached
+                else:
+                    entries[path] = signature + [self.verify_jars, None]
+                    pending.append(path)
+            
+            if len(pending) > 1:
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    errors = list(executor.map(verify_jar, pending, itertools.repeat(self.verify_jars)))
+            else:
+                errors = [verify_jar(path, self.verify_jars) for path in pending]
+            for path, error in zip(pending, errors):
+                entries[path][4] = error
+        
+        invalid = {path: entry[4] for path, entry in entries.items() if entry[4] is not None}
+        
+        # 完整分析时只保留当前的 jar，增量分析时合并到已有缓存
+        if families is not self.plugins_by_name:
+            cache.update(entries)
+            entries = cache
+        self._save_jar_verify_cache({path: entry for path, entry in entries.items() if entry[0] is not None})
+        print(f"校验 jar ({self.verify_jars}): {len(jars)} 个, 重新读取 {len(pending)} 个, 损坏 {len(invalid)} 个")
+        for path, error in sorted(invalid.items()):
+            print(f"  损坏: {os.path.basename(path)} - {error}")
+        return invalid
+    
+    def _retain_active_bundles(self):
+        """保留 bundles.info 中列出的插件，返回额外保留的数量"""
+        active = [plugin for plugin in self.to_delete if self.p2.is_active(plugin)]
+        if active:
+            self.plan.retain(active)
+        return len(active)
+    
+    def _update_p2_metadata(self, results):
+        """删除完成后从 bundles.info 和 artifact 索引中去掉已删除的插件"""
+        if not self.p2:
+            return
+        deleted = [result['plugin'] for result in results if result['deleted']]
+        try:
+            changes = self.p2.remove_bundles(deleted)
+        except (OSError, ValueError, xml.sax.SAXException, zipfile.BadZipFile, KeyError) as e:
+            print(f"更新 p2 元数据失败: {e}")
+            return
+        for path, count in changes.items():
+            print(f"已更新 {os.path.relpath(path, self.p2.install_root)}: 移除 {count} 个条目")
+    
+    def _parse_version_range(self, version_range):
+        """把 OSGi 版本范围解析为(下限, 下限是否包含, 上限, 上限是否包含)，上限为 None 表示无上限"""
+        if not version_range:
+            return None, True, None, True
+        if version_range[0] in '[(' and version_range[-1] in '])' and ',' in version_range:
+            low, high = version_range[1:-1].split(',', 1)
+            return self.version_to_tuple(low), version_range[0] == '[', self.version_to_tuple(high), version_range[-1] == ']'
+        return self.version_to_tuple(version_range), True, None, True
+    
+    def _retain_required_versions(self):
+        """保留仍被已保留插件 Require-Bundle 依赖的旧版本，返回额外保留的数量
+        
+        每个插件名的版本排序后用二分查找做范围查询，每个插件最多处理一次，整体接近线性。
+        """
+        # 只对实际被依赖的插件名按版本排序（增量分析时不必排序全部插件）
+        installed = {}
+        
+        def installed_versions(name):
+            if name not in installed:
+                ordered = sorted(self.plugins_by_name[name], key=operator.attrgetter('version_tuple'))
+                installed[name] = (ordered, [plugin['version_tuple'] for plugin in ordered])
+            return installed[name]
+        
+        kept_keys = defaultdict(list)
+        for plugin in self.to_keep:
+            bisect.insort(kept_keys[plugin['name']], plugin['version_tuple'])
+        
+        def in_range(keys, low, low_inclusive, high, high_inclusive):
+            """返回有序版本列表中落在范围内的最高版本位置，没有时返回 -1"""
+            if high is None:
+                pos = len(keys)
+            else:
+                pos = bisect.bisect_right(keys, high) if high_inclusive else bisect.bisect_left(keys, high)
+            pos -= 1
+            if pos < 0 or low is None:
+                return pos
+            if keys[pos] > low or (low_inclusive and keys[pos] == low):
+                return pos
+            return -1
+        
+        retained = []
+        worklist = list(self.to_keep)
+        while worklist:
+            plugin = worklist.pop()
+            for required_name, version_range in parse_require_bundle(plugin['require_bundle']):
+                if not self.plugins_by_name.get(required_name):
+                    continue
+                version_bounds = self._parse_version_range(version_range)
+                if in_range(kept_keys[required_name], *version_bounds) >= 0:
+                    continue
+                
+                # 已保留的版本都不满足依赖时，保留范围内最高的已安装版本
+                ordered, keys = installed_versions(required_name)
+                pos = in_range(keys, *version_bounds)
+                if pos < 0:
+                    continue
+                required = ordered[pos]
+                bisect.insort(kept_keys[required_name], required['version_tuple'])
+                retained.append(required)
+                worklist.append(required)
+        
+        if retained:
+            self.plan.retain(retained)
+        return len(retained)
+    
+    def _iter_stream_entries(self):
+        """逐个产出 (目录序号, 文件名, 是否目录)，不在内存中保留整个目录列表"""
+        script_name = os.path.basename(__file__)
+        for dir_index, directory in enumerate(self.scan_dirs):
+            if not os.path.isdir(directory):
+                if directory == os.path.normpath(self.plugin_dir):
+                    raise FileNotFoundError(f"目录 {directory} 不存在")
+                continue
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    # 跳过备份目录和当前脚本文件
+                    if entry.name.startswith('backup_') or entry.name == script_name:
+                        continue
+                    try:
+                        yield dir_index, entry.name, entry.is_dir()
+                    except OSError:
+                        continue
+    
+    def _iter_stream_rows(self, batch_size=1024):
+        """按扫描顺序解析插件，产出排序行 [插件名, 版本键, -序号, 目录序号, 文件名, 版本, 是否目录]
+        
+        序号取负数：同名同版本的插件按 (插件名, 版本键, -序号) 升序排列后整组反转，
+        得到的顺序与 analyze_duplicates 的稳定降序排序完全一致。
+        """
+        def parse(item):
+            dir_index, filename, is_dir = item
+            directory = self.scan_dirs[dir_index]
+            manifest = self._read_manifest(os.path.join(directory, filename), is_dir) if self.use_manifest else None
+            return self.parse_plugin_info(filename, is_dir, directory, manifest)
+        
+        entries = self._iter_stream_entries()
+        seq = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for batch in iter(lambda: list(itertools.islice(entries, batch_size)), []):
+                parsed = executor.map(parse, batch) if self.use_manifest else map(parse, batch)
+                for (dir_index, _, _), (original_name, name, version, is_dir) in zip(batch, parsed):
+                    if not (name and version):
+                        continue
+                    seq += 1
+                    yield [name, list(self.version_to_tuple(version)), -seq, dir_index, original_name, version, is_dir]
+    
+    @staticmethod
+    def _spill_run(rows, run_dir, run_name):
+        """把有序的行逐行写入临时文件，返回文件路径"""
+        run_path = os.path.join(run_dir, f"run_{run_name}.jsonl")
+        with open(run_path, 'w', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False))
+                f.write('\n')
+        return run_path
+    
+    def _reduce_runs(self, run_paths, run_dir):
+        """临时文件过多时分批归并，直到数量不超过 STREAM_MERGE_FANIN"""
+        merged_index = 0
+        while len(run_paths) > self.STREAM_MERGE_FANIN:
+            reduced = []
+            for start in range(0, len(run_paths), self.STREAM_MERGE_FANIN):
+                batch = run_paths[start:start + self.STREAM_MERGE_FANIN]
+                with contextlib.ExitStack() as stack:
+                    run_files = [stack.enter_context(open(path, 'r', encoding='utf-8')) for path in batch]
+                    rows = heapq.merge(*[map(json.loads, run_file) for run_file in run_files])
+                    reduced.append(self._spill_run(rows, run_dir, f"merged_{merged_index:06d}"))
+                merged_index += 1
+                for path in batch:
+                    os.remove(path)
+            run_paths = reduced
+        return run_paths
+    
+    def stream_plan(self, output_path, memory_mb=64, temp_dir=None):
+        """流式生成清理计划，内存占用受 memory_mb 限制，与目录大小无关
+        
+        scandir 逐条产出 -> 解析 -> 外部排序（超出内存预算时把有序批次写入临时文件，
+        最后多路归并）-> 按插件名分组决策，逐行写入 output_path (JSON lines)：
+            {"action": "keep"|"delete", "name", "version", "original_name", "path", "is_dir"}
+        决策结果与 scan_plugins + analyze_duplicates 相同（不支持 respect_dependencies）。
+        返回统计信息。
+        """
+        if self.respect_dependencies:
+            raise ValueError("流式计划不支持依赖关系分析")
+        
+        budget = max(1, memory_mb) * 1024 * 1024
+        stats = {'entries': 0, 'families': 0, 'keep': 0, 'delete': 0, 'runs': 0}
+        
+        with tempfile.TemporaryDirectory(prefix='plugin_plan_', dir=temp_dir) as run_dir:
+            run_paths = []
+            buffer = []
+            buffered_bytes = 0
+            with self.profiler.span('stream_sort', 'phase') as span:
+                for row in self._iter_stream_rows():
+                    stats['entries'] += 1
+                    buffer.append(row)
+                    buffered_bytes += len(row[0]) + len(row[4]) + len(row[5]) + self.STREAM_RECORD_OVERHEAD
+                    if buffered_bytes >= budget:
+                        buffer.sort()
+                        run_paths.append(self._spill_run(buffer, run_dir, f"{len(run_paths):06d}"))
+                        buffer = []
+                        buffered_bytes = 0
+                
+                buffer.sort()
+                if run_paths and buffer:
+                    run_paths.append(self._spill_run(buffer, run_dir, f"{len(run_paths):06d}"))
+                    buffer = []
+                stats['runs'] = len(run_paths)
+                run_paths = self._reduce_runs(run_paths, run_dir)
+                if span is not None:
+                    span['entries'] = stats['entries']
+                    span['runs'] = stats['runs']
+            
+            with contextlib.ExitStack() as stack:
+                if run_paths:
+                    run_files = [stack.enter_context(open(path, 'r', encoding='utf-8')) for path in run_paths]
+                    rows = heapq.merge(*[map(json.loads, run_file) for run_file in run_files])
+                else:
+                    rows = iter(buffer)
+                
+                with self.profiler.span('stream_decide', 'phase'), open(output_path, 'w', encoding='utf-8') as out:
+                    for name, group in itertools.groupby(rows, key=operator.itemgetter(0)):
+                        # 组内为版本升序，反转后第一个就是要保留的最新版本
+                        group = list(group)
+                        group.reverse()
+                        stats['families'] += 1
+                        for position, (_, _, _, dir_index, original_name, version, is_dir) in enumerate(group):
+                            action = 'keep' if position == 0 else 'delete'
+                            stats[action] += 1
+                            out.write(json.dumps({
+                                'action': action,
+                                'name': name,
+                                'version': version,
+                                'original_name': original_name,
+                                'path': os.path.join(self.scan_dirs[dir_index], original_name),
+                                'is_dir': is_dir
+                            }, ensure_ascii=False))
+                            out.write('\n')
+        
+        return stats
+    
+    def preview_changes(self, assume_yes=False):
+        """预览将要删除的插件及可回收空间，assume_yes 为 True 时不询问直接确认"""
+        if not self.to_delete:
+            print("没有发现重复插件")
+            return True
+        
+        self._print_preview()
+        if assume_yes:
+            return True
+        # 等待用户确认的时间不计入 preview 阶段
+        return input(f"\n确认删除这 {len(self.to_delete)} 个插件吗? (y/N): ").lower() == 'y'
+    
+    @profiled_phase('preview')
+    def _print_preview(self):
+        """输出将要删除的插件（按插件名分组）及可回收空间"""
+        total_size = self.compute_sizes()
+        
+        print("\n=== 将要删除的插件 ===")
+        
+        # 按插件名分组显示
+        groups = list(self.plan.delete_by_name.items())
+        if self.sort_by == 'size':
+            size_key = operator.attrgetter('size')
+            groups = [(name, sorted(plugins, key=size_key, reverse=True)) for name, plugins in groups]
+            groups.sort(key=lambda item: sum(plugin.size for plugin in item[1]), reverse=True)
+        
+        for name, plugins in groups:
+            print(f"\n插件: {name}")
+            
+            # 找到对应的保留插件
+            kept = self.plan.kept(name)
+            if kept:
+                keep_plugin = kept[0]
+                print(f"  保留: {keep_plugin['original_name']} (v{keep_plugin['version']})")
+            
+            for plugin in plugins:
+                print(f"  删除: {plugin['original_name']} (v{plugin['version']}, {format_size(plugin['size'])})")
+        
+        print(f"\n可回收空间: {format_size(total_size)}")
+    
+    def _candidate_backup_methods(self, source_path):
+        """根据文件系统情况列出可用的备份方式（按开销从低到高）"""
+        if self.backup_strategy != 'auto':
+            return [self.backup_strategy]
+        
+        try:
+            same_fs = os.stat(os.path.dirname(source_path)).st_dev == os.stat(self.backup_dir).st_dev
+        except OSError:
+            same_fs = False
+        
+        # 同一文件系统上可以直接重命名或硬链接，跨文件系统只能复制
+        if same_fs:
+            return list(self.BACKUP_METHODS)
+        return ['reflink', 'copy']
+    
+    @staticmethod
+    def _reflink_file(src, dst, throttle=None):
+        """使用 reflink(FICLONE) 或 copy_file_range 在内核中复制文件
+        
+        throttle: 可选的 IOThrottle。克隆不搬运数据，只计一次操作；
+        退回 copy_file_range 时按块复制，每块复制前计入字节数。
+        """
+        if throttle is not None:
+            throttle.acquire(0, 1)
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            cloned = False
+            try:
+                import fcntl
+                FICLONE = 0x40049409
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                cloned = True
+            except (ImportError, OSError):
+                pass
+            
+            if not cloned:
+                if not hasattr(os, 'copy_file_range'):
+                    raise OSError("当前系统不支持 reflink 或 copy_file_range")
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    count = remaining
+                    if throttle is not None:
+                        count = min(remaining, throttle.CHUNK_SIZE)
+                        throttle.acquire(count, 0)
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), count)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+        
+        shutil.copystat(src, dst)
+        return dst
+    
+    def _backup_with_method(self, plugin, backup_path, method):
+        """使用指定方式备份单个插件"""
+        src = plugin['path']
+        throttle = self.throttle
+        
+        if method == 'move':
+            if throttle is not None:
+                throttle.acquire(0, 1)
+            os.rename(src, backup_path)
+            return
+        
+        if method == 'hardlink':
+            copy_function = throttle.link if throttle is not None else os.link
+        elif method == 'reflink':
+            copy_function = functools.partial(self._reflink_file, throttle=throttle)
+        else:
+            copy_function = throttle.copy_file if throttle is not None else shutil.copy2
+        
+        if plugin['is_dir']:
+            shutil.copytree(src, backup_path, copy_function=copy_function)
+        else:
+            copy_function(src, backup_path)
+    
+    def _backup_relpath(self, plugin):
+        """插件在备份中的相对路径（以 / 分隔）
+        
+        主插件目录中的插件直接放在备份根下；其他扫描目录中的插件放在以来源目录命名的子目录中，
+        避免不同目录中的同名插件互相冲突。
+        """
+        directory = os.path.dirname(plugin['path'])
+        if directory == self.scan_dirs[0]:
+            return plugin['original_name']
+        key = hashlib.sha1(os.path.abspath(directory).encode('utf-8', 'surrogateescape')).hexdigest()[:8]
+        return f"{os.path.basename(directory)}_{key}/{plugin['original_name']}"
+    
+    def _backup_plugin(self, plugin, backup_path):
+        """按开销从低到高尝试各备份方式，返回实际使用的方式"""
+        if os.path.lexists(backup_path):
+            raise FileExistsError(f"备份目标已存在: {backup_path}")
+        os.makedirs(os.path.dirname(backup_path), exist_ok=True)
+        
+        last_error = None
+        
+        for method in self._candidate_backup_methods(plugin['path']):
+            try:
+                self._backup_with_method(plugin, backup_path, method)
+                return method
+            except OSError as e:
+                last_error = e
+                # 清理失败方式留下的半成品，再尝试下一种方式
+                if os.path.isdir(backup_path) and not os.path.islink(backup_path):
+                    shutil.rmtree(backup_path, ignore_errors=True)
+                elif os.path.lexists(backup_path):
+                    os.remove(backup_path)
+        
+        raise last_error
+    
+    def _rollback_moved_backups(self):
+        """备份失败时，把已经移动到备份目录的插件移回原位置"""
+        for plugin in self.to_delete:
+            if self.backup_methods.get(plugin['path']) != 'move':
+                continue
+            try:
+                os.rename(os.path.join(self.backup_dir, *self._backup_relpath(plugin).split('/')), plugin['path'])
+                del self.backup_methods[plugin['path']]
+                print(f"  已还原: {plugin['original_name']}")
+            except OSError as e:
+                print(f"  还原失败: {plugin['original_name']} - {e}")
+    
+    def _run_tasks(self, task, plugins):
+        """在有界线程池中并行处理各插件，按原顺序收集每项的结果和错误"""
+        results = []
+        
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(task, plugin) for plugin in plugins]
+            
+            for plugin, future in zip(plugins, futures):
+                result = {
+                    'plugin': plugin,
+                    'backed_up': False,
+                    'backup_method': None,
+                    'deleted': False,
+                    'error': None
+                }
+                try:
+                    result.update(future.result())
+                except Exception as e:
+                    result['error'] = str(e)
+                results.append(result)
+        
+        return results
+    
+    @staticmethod
+    def _tree_stats(path, is_dir):
+        """统计插件占用的(字节数, 文件数)"""
+        if not is_dir:
+            return os.lstat(path).st_size, 1
+        
+        total = 0
+        count = 0
+        for root, dirs, files in os.walk(path):
+            for file in files:
+                try:
+                    total += os.lstat(os.path.join(root, file)).st_size
+                    count += 1
+                except OSError:
+                    pass
+        return total, count
+    
+    @staticmethod
+    def _path_size(path, is_dir):
+        """统计插件占用的字节数"""
+        return SmartPluginCleaner._tree_stats(path, is_dir)[0]
+    
+    def compute_sizes(self, plugins=None):
+        """并行统计插件可回收的磁盘空间，写入每个插件的 'size'，返回总字节数
+        
+        硬链接的文件只有在所有链接都位于这些插件中时才计入（删除后才真正释放），
+        并且只计入第一个包含它的插件，不会重复统计。
+        """
+        plugins = self.to_delete if plugins is None else plugins
+        
+        def measure(plugin):
+            try:
+                return disk_usage(plugin['path'], plugin['is_dir'])
+            except OSError:
+                return 0, {}, 0
+        
+        with self.profiler.span('size', 'phase', count=len(plugins)):
+            with ThreadPoolExecutor(max_workers=self.scan_workers) as executor:
+                usages = list(executor.map(measure, plugins))
+            
+            links_seen = defaultdict(int)
+            for _, files, _ in usages:
+                for key, (_, _, occurrences) in files.items():
+                    links_seen[key] += occurrences
+            
+            counted = set()
+            total = 0
+            for plugin, (dir_bytes, files, _) in zip(plugins, usages):
+                size = dir_bytes
+                for key, (nlink, file_bytes, _) in files.items():
+                    if key in counted or links_seen[key] < nlink:
+                        continue
+                    counted.add(key)
+                    size += file_bytes
+                plugin['size'] = size
+                total += size
+        return total
+    
+    def reclaimable_bytes(self):
+        """统计删除待删除插件后可回收的磁盘空间"""
+        return self.compute_sizes()
+    
+    def _bundle_span_args(self, plugin):
+        """性能分析开启时统计插件的字节数和文件数，作为单个插件区间的附加信息
+        
+        需要在区间开始之前调用，遍历插件的耗时不计入备份/删除区间。
+        """
+        args = {'plugin': plugin['original_name']}
+        if self.profiler.enabled:
+            try:
+                args['bytes'], args['files'] = self._tree_stats(plugin['path'], plugin['is_dir'])
+            except OSError:
+                pass
+        return args
+    
+    def _backup_task(self, plugin):
+        """备份单个插件"""
+        with self.profiler.span('backup', 'bundle', **self._bundle_span_args(plugin)) as span:
+            # 需要还原校验时，备份前记录大小/文件数和哈希（需要额外遍历并读取整个插件）
+            fingerprint = tree_fingerprint(plugin['path'], plugin['is_dir'], True) if self.record_hashes else None
+            
+            if self.backup_store:
+                entry = self.backup_store.add_plugin(plugin)
+                self.backup_methods[plugin['path']] = 'store'
+                return {'backed_up': True, 'backup_method': 'store', 'store_entry': entry, 'fingerprint': fingerprint}
+            
+            backup_path = os.path.join(self.backup_dir, *self._backup_relpath(plugin).split('/'))
+            method = self._backup_plugin(plugin, backup_path)
+            self.backup_methods[plugin['path']] = method
+            if span is not None:
+                span['method'] = method
+            return {'backed_up': True, 'backup_method': method, 'fingerprint': fingerprint}
+    
+    def _delete_task(self, plugin):
+        """删除单个插件"""
+        # 以重命名方式备份的插件已经不在原位置
+        if self.backup_methods.get(plugin['path']) == 'move':
+            return {'deleted': True}
+        
+        with self.profiler.span('delete', 'bundle', **self._bundle_span_args(plugin)):
+            if self.throttle is not None:
+                if plugin['is_dir']:
+                    self.throttle.remove_tree(plugin['path'])
+                else:
+                    self.throttle.remove(plugin['path'])
+            elif plugin['is_dir']:
+                shutil.rmtree(plugin['path'])
+            else:
+                os.remove(plugin['path'])
+        return {'deleted': True}
+    
+    def _journaled_delete(self, plugins):
+        """两阶段删除的第一阶段：把插件重命名到回收目录，任一失败则全部移回
+        
+        返回与 _run_tasks 相同格式的结果；回收目录按 purge_mode 清理。
+        """
+        results = [{'plugin': plugin, 'backed_up': False, 'backup_method': None, 'deleted': False, 'error': None}
+                   for plugin in plugins]
+        # 以重命名方式备份的插件已经不在原位置
+        pending = []
+        for result in results:
+            if self.backup_methods.get(result['plugin']['path']) == 'move':
+                result['deleted'] = True
+            else:
+                pending.append(result)
+        if not pending:
+            return results
+        
+        journal_path, journal = self.journal.begin([result['plugin'] for result in pending],
+                                                   source_dir=self.plugin_dir, backup_location=self.backup_location)
+        with self.profiler.span('journal_rename', 'phase', count=len(pending)):
+            try:
+                for entry in journal['entries']:
+                    os.makedirs(os.path.dirname(entry['trash']), exist_ok=True)
+                    if self.throttle is not None:
+                        self.throttle.acquire(0, 1)
+                    os.rename(entry['source'], entry['trash'])
+                self.journal.commit(journal_path, journal)
+            except OSError as e:
+                for result in pending:
+                    result['error'] = f"移入回收目录失败，已全部移回: {e}"
+                try:
+                    self.journal.rollback(journal_path, journal)
+                finally:
+                    self.journal.release(journal_path)
+                return results
+        
+        for result in pending:
+            result['deleted'] = True
+        
+        try:
+            if self.purge_mode == 'now':
+                with self.profiler.span('purge', 'phase', count=len(pending)):
+                    self.journal.purge(journal_path, journal, self.throttle)
+        finally:
+            # 释放锁之后后台清理进程或下次启动才能接手回收目录
+            self.journal.release(journal_path)
+        if self.purge_mode == 'background':
+            try:
+                spawn_background_purge(self.journal.trash_dir, self._throttle_args())
+            except OSError as e:
+                print(f"后台清理启动失败，回收目录将在下次启动时清理: {e}")
+        return results
+    
+    def _delete_backed_up(self, results):
+        """删除已经备份成功的插件，把删除结果合并回 results"""
+        backed_up = [result for result in results if result['backed_up'] and not result['error']]
+        plugins = [result['plugin'] for result in backed_up]
+        if self.journaled:
+            delete_results = self._journaled_delete(plugins)
+        else:
+            delete_results = self._run_tasks(self._delete_task, plugins)
+        for result, delete_result in zip(backed_up, delete_results):
+            result['deleted'] = delete_result['deleted']
+            result['error'] = delete_result['error']
+    
+    def _throttle_args(self):
+        """把限速设置转换为传给后台清理进程的命令行参数"""
+        if self.throttle is None:
+            return []
+        args = []
+        if self.throttle.bytes_per_sec:
+            args += ['--io-limit', str(self.throttle.bytes_per_sec)]
+        if self.throttle.ops_per_sec:
+            args += ['--ops-limit', str(self.throttle.ops_per_sec)]
+        # 后台清理总是以低优先级运行
+        return args + ['--low-priority']
+    
+    def _print_throughput(self):
+        """限速时输出实际达到的吞吐量"""
+        if self.throttle is not None:
+            summary = self.throttle.summary()
+            if summary:
+                print(summary)
+    
+    def recover_interrupted_deletes(self):
+        """根据遗留的日志回滚中断的删除，或继续清理已提交的回收目录
+        
+        只在两阶段删除模式下执行；其他进程仍在进行的事务不会被处理。
+        """
+        if not self.journaled or not self.journal.journal_paths():
+            return
+        stats = self.journal.recover(purge=self.purge_mode != 'later', throttle=self.throttle)
+        if stats['rolled_back']:
+            print(f"检测到中断的删除，已回滚 {stats['rolled_back']} 个事务")
+        if stats['purged']:
+            print(f"已清理上次遗留的回收目录 ({stats['purged']} 个事务)")
+        if stats['active']:
+            print(f"有 {stats['active']} 个删除事务正由其他进程执行，已跳过")
+    
+    def _build_backup_manifest(self, results):
+        """根据执行结果生成备份清单，只包含备份成功的插件"""
+        backup_manifest = {
+            'timestamp': datetime.now().isoformat(),
+            'source_dir': self.plugin_dir,
+            'backup_format': 'store' if self.backup_store else self.backup_format,
+            'backup_strategy': self.backup_strategy,
+            'deleted_plugins': []
+        }
+        
+        # 记录插件在 p2 元数据中的原始条目，还原插件时一并加回
+        p2_entries = {}
+        if self.p2:
+            try:
+                p2_entries = self.p2.collect_entries([result['plugin'] for result in results if result['backed_up']])
+            except (OSError, ElementTree.ParseError, zipfile.BadZipFile, KeyError) as e:
+                print(f"读取 p2 元数据失败，备份清单中不记录 p2 条目: {e}")
+            if p2_entries:
+                backup_manifest['p2_install_root'] = self.p2.install_root
+        
+        for result in results:
+            if not result['backed_up']:
+                continue
+            plugin = result['plugin']
+            entry = {
+                'original_name': plugin['original_name'],
+                'name': plugin['name'],
+                'version': plugin['version'],
+                'is_dir': plugin['is_dir'],
+                'source_path': plugin['path'],
+                'backup_method': result['backup_method']
+            }
+            if not self.backup_store:
+                # 备份目录/压缩包中的相对路径，其他扫描目录的插件带有来源目录前缀
+                entry['backup_path'] = self._backup_relpath(plugin)
+            if plugin['path'] in p2_entries:
+                entry['p2'] = p2_entries[plugin['path']]
+            entry.update(result.get('fingerprint') or {})
+            # 去重备份库中的插件只记录 blob 引用
+            store_entry = result.get('store_entry') or {}
+            entry.update(store_entry)
+            if 'files' in store_entry and 'size' not in entry:
+                # 备份库条目本身带有各文件大小，无需额外遍历即可供还原时校验
+                entry['size'] = sum(file_entry['size'] for file_entry in store_entry['files'])
+                entry['file_count'] = len(store_entry['files'])
+            backup_manifest['deleted_plugins'].append(entry)
+        
+        return backup_manifest
+    
+    def _write_backup_manifest(self, results):
+        """把备份成功的插件写入备份清单"""
+        backup_manifest = self._build_backup_manifest(results)
+        if self.backup_store:
+            try:
+                self.backup_manifest_path = self.backup_store.write_manifest(backup_manifest)
+            finally:
+                self.backup_store.end_session()
+            return
+        
+        manifest_path = os.path.join(self.backup_dir, 'backup_manifest.json')
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(backup_manifest, f, indent=2, ensure_ascii=False)
+    
+    def _print_results(self, results):
+        """统一输出执行结果"""
+        if self.sort_by == 'size':
+            results = sorted(results, key=lambda result: result['plugin'].get('size', 0), reverse=True)
+        for result in results:
+            name = result['plugin']['original_name']
+            if result['error']:
+                stage = "删除失败" if result['backed_up'] else "备份失败"
+                print(f"  {stage}: {name} - {result['error']}")
+            elif result['deleted']:
+                details = [format_size(result['plugin']['size'])] if 'size' in result['plugin'] else []
+                if result['backed_up']:
+                    details.append(f"备份方式: {result['backup_method']}")
+                print(f"  删除: {name}" + (f" ({', '.join(details)})" if details else ""))
+            elif result['backed_up']:
+                print(f"  备份: {name} ({result['backup_method']})")
+    
+    def _reclaimed_space(self, results):
+        """统计已删除插件的空间，返回 (实际释放, 仍留在同一文件系统备份中)
+        
+        移动、硬链接、reflink 或复制到同一文件系统上的备份仍然占用这块磁盘，只算移入备份；
+        压缩包备份按压缩包的实际大小计算。只有统计过大小的插件才计入。
+        """
+        if self.backup_store:
+            location = self.backup_store.objects_dir
+        elif self.backup_archive:
+            location = self.backup_archive
+        else:
+            location = self.backup_dir
+        
+        freed = retained = 0
+        same_fs = {}
+        for result in results:
+            if not result['deleted']:
+                continue
+            size = result['plugin'].get('size', 0)
+            parent = os.path.dirname(result['plugin']['path'])
+            if parent not in same_fs:
+                same_fs[parent] = _same_filesystem(location, parent)
+            if result.get('backed_up') and same_fs[parent]:
+                retained += size
+            else:
+                freed += size
+        
+        if self.backup_archive and retained:
+            try:
+                archived = min(retained, os.path.getsize(self.backup_archive))
+            except OSError:
+                archived = retained
+            freed += retained - archived
+            retained = archived
+        return freed, retained
+    
+    def _print_reclaimed(self, results):
+        """输出实际释放的磁盘空间，以及移入同一文件系统上备份的空间"""
+        freed, retained = self._reclaimed_space(results)
+        if freed:
+            print(f"释放空间: {format_size(freed)}")
+        if retained:
+            print(f"移入备份: {format_size(retained)}（备份与插件位于同一文件系统，删除备份后才会释放）")
+    
+    def _add_to_zip(self, archive, plugin, arcname):
+        """把单个插件流式写入 zip 中的 arcname，已压缩的文件直接存储"""
+        if not plugin['is_dir']:
+            self._zip_write_file(archive, plugin['path'], arcname)
+            return
+        
+        for root, dirs, files in os.walk(plugin['path']):
+            dirs.sort()
+            rel_root = os.path.normpath(os.path.join(arcname, os.path.relpath(root, plugin['path'])))
+            if not files and not dirs:
+                # 保留空目录
+                archive.write(root, rel_root)
+            for file in sorted(files):
+                self._zip_write_file(archive, os.path.join(root, file), os.path.join(rel_root, file))
+    
+    def _zip_write_file(self, archive, path, arcname):
+        """写入单个文件；限速时按块读取源文件，每块计入字节数"""
+        compress_type = self._zip_compress_type(path)
+        if self.throttle is None:
+            archive.write(path, arcname, compress_type=compress_type)
+            return
+        
+        self.throttle.acquire(0, 1)
+        zinfo = zipfile.ZipInfo.from_file(path, arcname)
+        zinfo.compress_type = compress_type
+        # 与 ZipFile.write 相同，大文件预先使用 zip64 头
+        force_zip64 = zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT
+        with open(path, 'rb') as src, archive.open(zinfo, 'w', force_zip64=force_zip64) as dst:
+            shutil.copyfileobj(self.throttle.reader(src), dst, self.throttle.CHUNK_SIZE)
+    
+    def _zip_compress_type(self, path):
+        """根据扩展名选择 zip 压缩方式"""
+        if path.lower().endswith(self.STORED_EXTENSIONS):
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+    
+    def _add_to_tar(self, archive, plugin, arcname):
+        """把单个插件写入 tar 中的 arcname；限速时逐个条目写入，文件内容按块读取并计入字节数"""
+        if self.throttle is None:
+            archive.add(plugin['path'], arcname)
+            return
+        
+        def add(path, name):
+            tarinfo = archive.gettarinfo(path, name)
+            if tarinfo is None:
+                # 套接字等无法归档的特殊文件，与 TarFile.add 一样跳过
+                return
+            self.throttle.acquire(0, 1)
+            if tarinfo.isreg():
+                with open(path, 'rb') as f:
+                    archive.addfile(tarinfo, self.throttle.reader(f))
+            else:
+                archive.addfile(tarinfo)
+        
+        add(plugin['path'], arcname)
+        if not plugin['is_dir'] or os.path.islink(plugin['path']):
+            return
+        # os.walk 不进入指向目录的符号链接，这些链接和 TarFile.add 一样作为链接条目写入
+        for root, dirs, files in os.walk(plugin['path']):
+            dirs.sort()
+            rel_root = os.path.relpath(root, plugin['path']).replace(os.sep, '/')
+            prefix = arcname if rel_root == '.' else f"{arcname}/{rel_root}"
+            for name in dirs + sorted(files):
+                add(os.path.join(root, name), f"{prefix}/{name}")
+    
+    def _write_backup_archive(self, plugins):
+        """把待删除插件依次流式写入一个压缩包，并在包内附带备份清单
+        
+        任一插件写入失败即停止写入后续插件，只有完整写入的插件会被标记为已备份。
+        """
+        results = []
+        written_names = set()
+        failed = False
         
-        if not os.path.exists(self.plugin_dir):
-            print(f"错误: 目录 {self.plugin_dir} 不存在")
-            return False
+        if self.backup_format == 'zip':
+            archive = zipfile.ZipFile(self.backup_archive, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+        else:
+            archive = tarfile.open(self.backup_archive, 'w:' + self.backup_format.split('.')[1])
         
-        for item in os.listdir(self.plugin_dir):
-            # 跳过备份目录
-            if item.startswith('backup_'):
-                continue
+        with archive:
+            for plugin in plugins:
+                result = {
+                    'plugin': plugin,
+                    'backed_up': False,
+                    'backup_method': None,
+                    'deleted': False,
+                    'error': None
+                }
+                results.append(result)
                 
-            item_path = os.path.join(self.plugin_dir, item)
-            
-            # 跳过当前脚本文件
-            if item == os.path.basename(__file__):
-                continue
-            
-            original_name, name, version, is_dir = self.parse_plugin_info(item)
-            
-            if name and version:
-                self.plugins_by_name[name].append({
-                    'original_name': original_name,
-                    'name': name,
-                    'version': version,
-                    'version_tuple': self.version_to_tuple(version),
-                    'is_dir': is_dir,
-                    'path': item_path
-                })
-        
-        print(f"发现 {len(self.plugins_by_name)} 种插件")
-        return True
-    
-    def analyze_duplicates(self):
-        """分析重复插件"""
-        for name, plugins in self.plugins_by_name.items():
-            if len(plugins) > 1:
-                # 按版本排序（从高到低）
-                sorted_plugins = sorted(plugins, key=lambda x: x['version_tuple'], reverse=True)
+                if failed:
+                    result['error'] = "压缩包写入已中止"
+                    continue
+                arcname = self._backup_relpath(plugin)
+                if arcname in written_names:
+                    result['error'] = f"压缩包中已存在同名条目: {arcname}"
+                    continue
                 
-                # 保留最新的，其余标记为待删除
-                latest = sorted_plugins[0]
-                to_delete_list = sorted_plugins[1:]
+                try:
+                    with self.profiler.span('archive', 'bundle', **self._bundle_span_args(plugin)):
+                        if self.record_hashes:
+                            result['fingerprint'] = tree_fingerprint(plugin['path'], plugin['is_dir'], True)
+                        if self.backup_format == 'zip':
+                            self._add_to_zip(archive, plugin, arcname)
+                        else:
+                            self._add_to_tar(archive, plugin, arcname)
+                except Exception as e:
+                    result['error'] = str(e)
+                    failed = True
+                    continue
                 
-                self.to_keep.append(latest)
-                self.to_delete.extend(to_delete_list)
+                written_names.add(arcname)
+                self.backup_methods[plugin['path']] = 'archive'
+                result.update({'backed_up': True, 'backup_method': 'archive'})
+            
+            # 备份清单作为最后一个条目写入压缩包
+            manifest_data = json.dumps(self._build_backup_manifest(results), indent=2, ensure_ascii=False).encode('utf-8')
+            if self.backup_format == 'zip':
+                archive.writestr('backup_manifest.json', manifest_data)
             else:
-                # 只有一个版本的插件保留
-                self.to_keep.extend(plugins)
+                info = tarfile.TarInfo('backup_manifest.json')
+                info.size = len(manifest_data)
+                info.mtime = int(datetime.now().timestamp())
+                archive.addfile(info, io.BytesIO(manifest_data))
         
-        print(f"\n分析结果:")
-        print(f"  保留插件: {len(self.to_keep)} 个")
-        print(f"  删除插件: {len(self.to_delete)} 个")
+        return results
     
-    def preview_changes(self):
-        """预览将要删除的插件"""
-        if not self.to_delete:
-            print("没有发现重复插件")
-            return True
-        
-        print("\n=== 将要删除的插件 ===")
+    @staticmethod
+    def extract_from_backup_archive(archive_path, names, target_dir):
+        """从备份压缩包中只解压指定的插件（names 为插件在压缩包中的相对路径），返回解压出的路径列表"""
+        wanted = set(names)
+        extracted = set()
         
-        # 按插件名分组显示
-        delete_by_name = defaultdict(list)
-        for plugin in self.to_delete:
-            delete_by_name[plugin['name']].append(plugin)
+        def select(member_name):
+            # 插件位于压缩包根下或来源目录子目录下，逐级匹配成员路径的前缀
+            parts = member_name.rstrip('/').split('/')
+            for depth in range(1, min(len(parts), 2) + 1):
+                prefix = '/'.join(parts[:depth])
+                if prefix in wanted:
+                    return prefix
+            return None
         
-        for name, plugins in delete_by_name.items():
-            print(f"\n插件: {name}")
-            
-            # 找到对应的保留插件
-            keep_plugin = next((p for p in self.to_keep if p['name'] == name), None)
-            if keep_plugin:
-                print(f"  保留: {keep_plugin['original_name']} (v{keep_plugin['version']})")
-            
-            for plugin in plugins:
-                print(f"  删除: {plugin['original_name']} (v{plugin['version']})")
+        if archive_path.endswith('.zip'):
+            # zip 通过中央目录随机访问，只读取需要的条目
+            with zipfile.ZipFile(archive_path) as archive:
+                for info in archive.infolist():
+                    top = select(info.filename)
+                    if top:
+                        archive.extract(info, target_dir)
+                        extracted.add(top)
+        else:
+            # tar 以流模式顺序读取，只写出匹配的条目
+            with tarfile.open(archive_path, 'r|*') as archive:
+                for member in archive:
+                    top = select(member.name)
+                    if top:
+                        if hasattr(tarfile, 'data_filter'):
+                            archive.extract(member, target_dir, filter='data')
+                        else:
+                            archive.extract(member, target_dir)
+                        extracted.add(top)
         
-        return input(f"\n确认删除这 {len(self.to_delete)} 个插件吗? (y/N): ").lower() == 'y'
+        return sorted(extracted)
+    
+    def _prepare_backup_location(self):
+        """创建备份目录（压缩包模式下创建压缩包所在目录），返回是否成功"""
+        try:
+            if self.backup_store:
+                self.backup_store.ensure_layout()
+                # 存入 blob 之前登记备份会话，防止并发的回收删除本次已引用的 blob
+                self.backup_store.begin_session()
+            elif self.backup_archive:
+                os.makedirs(os.path.dirname(os.path.abspath(self.backup_archive)), exist_ok=True)
+            else:
+                os.makedirs(self.backup_dir, exist_ok=True)
+            return True
+        except OSError as e:
+            print(f"备份失败: {e}")
+            return False
     
+    @profiled_phase('backup')
     def create_backup(self):
-        """创建备份"""
+        """创建备份（并行），任一插件备份失败则整体回滚"""
         if not self.to_delete:
             return True
         
-        print(f"\n创建备份到: {self.backup_dir}")
+        print(f"\n创建备份到: {self.backup_location}")
+        
+        if not self._prepare_backup_location():
+            return False
         
         try:
-            os.makedirs(self.backup_dir, exist_ok=True)
-            
-            # 创建备份清单
-            backup_manifest = {
-                'timestamp': datetime.now().isoformat(),
-                'source_dir': self.plugin_dir,
-                'deleted_plugins': []
-            }
-            
-            for plugin in self.to_delete:
-                backup_path = os.path.join(self.backup_dir, plugin['original_name'])
-                backup_manifest['deleted_plugins'].append({
-                    'original_name': plugin['original_name'],
-                    'name': plugin['name'],
-                    'version': plugin['version'],
-                    'is_dir': plugin['is_dir']
-                })
-                
+            if self.backup_archive:
                 try:
-                    if plugin['is_dir']:
-                        shutil.copytree(plugin['path'], backup_path)
-                    else:
-                        shutil.copy2(plugin['path'], backup_path)
-                    print(f"  备份: {plugin['original_name']}")
-                except Exception as e:
-                    print(f"  备份失败: {plugin['original_name']} - {e}")
+                    results = self._write_backup_archive(self.to_delete)
+                except (OSError, tarfile.TarError, zipfile.BadZipFile) as e:
+                    print(f"备份失败: {e}")
                     return False
+                self._print_results(results)
+                if any(result['error'] for result in results):
+                    return False
+                print("备份完成")
+                self._print_throughput()
+                return True
+            
+            results = self._run_tasks(self._backup_task, self.to_delete)
+            self._print_results(results)
             
-            # 保存备份清单
-            manifest_path = os.path.join(self.backup_dir, 'backup_manifest.json')
-            with open(manifest_path, 'w', encoding='utf-8') as f:
-                json.dump(backup_manifest, f, indent=2, ensure_ascii=False)
+            if any(result['error'] for result in results):
+                self._rollback_moved_backups()
+                return False
+            
+            try:
+                self._write_backup_manifest(results)
+            except OSError as e:
+                print(f"备份失败: {e}")
+                self._rollback_moved_backups()
+                return False
             
             print("备份完成")
+            self._print_throughput()
             return True
-            
-        except Exception as e:
-            print(f"备份失败: {e}")
-            return False
+        finally:
+            # 出错提前返回时也要结束备份会话，释放会话锁
+            if self.backup_store:
+                self.backup_store.end_session()
     
+    @profiled_phase('delete')
     def delete_plugins(self):
-        """删除标记的插件"""
+        """删除标记的插件（并行）"""
         if not self.to_delete:
             print("没有插件需要删除")
             return True
         
         print(f"\n开始删除 {len(self.to_delete)} 个插件...")
         
-        success_count = 0
-        for plugin in self.to_delete:
-            try:
-                if plugin['is_dir']:
-                    shutil.rmtree(plugin['path'])
-                else:
-                    os.remove(plugin['path'])
-                print(f"  删除: {plugin['original_name']}")
-                success_count += 1
-            except Exception as e:
-                print(f"  删除失败: {plugin['original_name']} - {e}")
+        if self.journaled:
+            results = self._journaled_delete(self.to_delete)
+        else:
+            results = self._run_tasks(self._delete_task, self.to_delete)
+        self._print_results(results)
         
+        success_count = sum(1 for result in results if result['deleted'])
         print(f"\n删除完成: 成功 {success_count}/{len(self.to_delete)} 个")
+        self._print_reclaimed(results)
+        self._print_throughput()
+        self._update_p2_metadata(results)
         return success_count == len(self.to_delete)
     
-    def run(self, preview_only=False):
+    @profiled_phase('backup_delete')
+    def backup_and_delete(self):
+        """并行备份，写入备份清单后再并行删除备份成功的插件；清单写入失败时不删除任何插件"""
+        if not self.to_delete:
+            print("没有插件需要删除")
+            return True
+        
+        print(f"\n备份到 {self.backup_location} 并删除 {len(self.to_delete)} 个插件 (并发数: {self.workers})...")
+        
+        if not self._prepare_backup_location():
+            return False
+        
+        try:
+            if self.backup_archive:
+                # 压缩包只能顺序写入，写完后再并行删除已备份的插件
+                try:
+                    self.results = self._write_backup_archive(self.to_delete)
+                except (OSError, tarfile.TarError, zipfile.BadZipFile) as e:
+                    print(f"备份失败: {e}")
+                    return False
+                self._delete_backed_up(self.results)
+            else:
+                # 先并行备份并写入清单，再删除备份成功的插件（日志模式下一次性移入回收目录）
+                self.results = self._run_tasks(self._backup_task, self.to_delete)
+                
+                try:
+                    self._write_backup_manifest(self.results)
+                except OSError as e:
+                    # 没有清单的备份无法还原，备份库中的 blob 也没有引用，此时不能删除任何插件
+                    print(f"备份清单写入失败: {e}")
+                    self._rollback_moved_backups()
+                    return False
+                self._delete_backed_up(self.results)
+            
+            self._print_results(self.results)
+            
+            backup_failed = sum(1 for result in self.results if not result['backed_up'])
+            success_count = sum(1 for result in self.results if result['deleted'])
+            print(f"\n删除完成: 成功 {success_count}/{len(self.to_delete)} 个")
+            self._print_reclaimed(self.results)
+            self._print_throughput()
+            self._update_p2_metadata(self.results)
+            if backup_failed:
+                print(f"备份失败而保留的插件: {backup_failed} 个")
+            return success_count == len(self.to_delete)
+        finally:
+            # 出错提前返回时也要结束备份会话，释放会话锁
+            if self.backup_store:
+                self.backup_store.end_session()
+    
+    def _refresh_entry(self, directory, filename, records_by_path, dependents):
+        """按文件系统的当前状态更新单个条目的记录，返回受影响的插件名集合"""
+        path = os.path.join(directory, filename)
+        affected = set()
+        
+        old = records_by_path.pop(path, None)
+        if old is not None:
+            family = self.plugins_by_name[old['name']]
+            family.remove(old)
+            if not family:
+                del self.plugins_by_name[old['name']]
+            affected.add(old['name'])
+        
+        # 跳过备份目录和当前脚本文件
+        if filename.startswith('backup_') or filename == os.path.basename(__file__) or not os.path.lexists(path):
+            return affected
+        
+        is_dir = os.path.isdir(path)
+        manifest = self._read_manifest(path, is_dir) if self.use_manifest else None
+        _, name, version, is_dir = self.parse_plugin_info(filename, is_dir, directory, manifest)
+        if name and version:
+            record = self._make_record(directory, filename, name, version, is_dir,
+                                       manifest.get('Require-Bundle') if manifest else None)
+            self.plugins_by_name[name].append(record)
+            records_by_path[path] = record
+            self._index_dependents(record, dependents)
+            affected.add(name)
+        return affected
+    
+    @staticmethod
+    def _entry_signature(path):
+        """条目当前的(文件数, 总字节数, 最新 mtime_ns)，目录插件统计整个目录树；条目不存在时返回 None
+        
+        监视模式只监视插件目录本身，目录插件内部的写入和 jar 的追加写入都不会产生新事件，
+        只能靠前后两次观察到的签名一致来判断复制已经完成。
+        """
+        try:
+            st = os.lstat(path)
+        except FileNotFoundError:
+            return None
+        if not stat.S_ISDIR(st.st_mode):
+            return (1, st.st_size, st.st_mtime_ns)
+        
+        count, size, newest = 0, 0, st.st_mtime_ns
+        for root, dirs, files in os.walk(path):
+            for name in dirs + files:
+                try:
+                    st = os.lstat(os.path.join(root, name))
+                except OSError:
+                    continue
+                count += 1
+                size += st.st_size
+                newest = max(newest, st.st_mtime_ns)
+        return (count, size, newest)
+    
+    def _index_watch_records(self):
+        """根据当前的插件记录建立 {路径: 记录} 和依赖关系索引"""
+        records_by_path = {}
+        dependents = defaultdict(set)
+        for family in self.plugins_by_name.values():
+            for record in family:
+                records_by_path[record['path']] = record
+                self._index_dependents(record, dependents)
+        return records_by_path, dependents
+    
+    def _p2_watch_targets(self):
+        """返回监视模式下需要关注的 p2 元数据 {目录: {文件名}}"""
+        install_root = self._install_root()
+        bundles_info = os.path.join(install_root, P2Metadata.BUNDLES_INFO)
+        targets = defaultdict(set)
+        targets[os.path.dirname(bundles_info)].add(os.path.basename(bundles_info))
+        targets[install_root].update(P2Metadata.ARTIFACT_FILES)
+        return {directory: names for directory, names in targets.items() if os.path.isdir(directory)}
+    
+    @staticmethod
+    def _index_dependents(record, dependents):
+        """记录 {被依赖的插件名: 依赖它的插件名}，增量分析时一并重新分析依赖方"""
+        for required_name, _ in parse_require_bundle(record['require_bundle']):
+            dependents[required_name].add(record['name'])
+    
+    def _start_watch_cycle(self, base_backup_dir, cycle):
+        """每次清理使用新的备份位置，并清空上一次的执行状态"""
+        self.backup_dir = f"{base_backup_dir}_{cycle:04d}"
+        if self.backup_format != 'dir':
+            self.backup_archive = self.backup_dir + self.BACKUP_FORMATS[self.backup_format]
+        self.backup_methods = {}
+        self.results = []
+        if self.throttle is not None:
+            self.throttle.reset_stats()
+    
+    def watch(self, debounce=None, max_cycles=None):
+        """监视插件目录（仅 Linux，基于 inotify），增量维护插件记录并自动清理
+        
+        启动时完整扫描一次；之后只根据目录事件更新变化的条目，防抖时间内没有新事件时
+        只重新分析受影响的插件名，有重复版本就备份并删除。开销与变化数量成正比，与目录大小无关。
+        新增或改动的条目要在相隔一个防抖时间的两次观察中内容签名（文件数、大小、mtime）不变，
+        才会参与分析，避免把仍在复制中的插件当作最新版本而删除完整的旧版本。
+        bundles.info 和 artifact 索引也一并监视，变化后重新读取并重新分析全部插件。
+        max_cycles 为执行清理的最大次数（None 表示一直运行，Ctrl+C 退出）。
+        """
+        debounce = self.WATCH_DEBOUNCE if debounce is None else debounce
+        base_backup_dir = self.backup_dir
+        print("=== Eclipse 插件清理工具（监视模式）===\n")
+        self.recover_interrupted_deletes()
+        
+        with InotifyWatcher() as watcher:
+            # 先订阅事件再扫描，扫描期间的变化不会丢失
+            for directory in self.scan_dirs:
+                if os.path.isdir(directory):
+                    watcher.add_watch(directory)
+            p2_targets = self._p2_watch_targets() if self.respect_p2 else {}
+            for directory in p2_targets:
+                if directory not in self.scan_dirs:
+                    watcher.add_watch(directory)
+            if not self.scan_plugins():
+                return False
+            
+            records_by_path, dependents = self._index_watch_records()
+            
+            pending = set()
+            # 尚未稳定的条目 {(目录, 条目名): 上次观察到的签名}
+            unsettled = {}
+            affected = set(self.plugins_by_name)
+            rescan = False
+            reload_p2 = False
+            deadline = time.monotonic()
+            cycles = 0
+            
+            while max_cycles is None or cycles < max_cycles:
+                waiting = pending or affected or rescan or reload_p2
+                events = watcher.read_events(max(0, deadline - time.monotonic()) if waiting else None)
+                if events:
+                    deadline = time.monotonic() + debounce
+                for directory, filename, mask in events:
+                    if mask & InotifyWatcher.IN_Q_OVERFLOW:
+                        # 事件队列溢出，无法知道具体变化，重新完整扫描
+                        rescan = True
+                    elif mask & (InotifyWatcher.IN_DELETE_SELF | InotifyWatcher.IN_MOVE_SELF):
+                        print(f"监视的目录已被删除或移动: {directory}")
+                        return False
+                    elif filename in p2_targets.get(directory, ()):
+                        reload_p2 = True
+                    elif directory in self.scan_dirs and filename and not filename.startswith('backup_'):
+                        pending.add((directory, filename))
+                if events or time.monotonic() < deadline:
+                    continue
+                
+                with self.profiler.span('watch_cycle', 'phase', changes=len(pending)):
+                    if rescan:
+                        print("\n事件队列溢出，重新扫描")
+                        self.plugins_by_name = defaultdict(list)
+                        if not self.scan_plugins():
+                            return False
+                        records_by_path, dependents = self._index_watch_records()
+                        affected = set(self.plugins_by_name)
+                        pending.clear()
+                        unsettled.clear()
+                        rescan = reload_p2 = False
+                    
+                    if reload_p2:
+                        # 活动插件可能变化，全部插件都要重新分析
+                        self._load_p2_metadata()
+                        affected = set(self.plugins_by_name)
+                        reload_p2 = False
+                    
+                    for key in list(pending):
+                        signature = self._entry_signature(os.path.join(*key))
+                        if signature is not None and unsettled.get(key) != signature:
+                            unsettled[key] = signature
+                            continue
+                        # 已删除，或与上次观察时一致（复制已完成）
+                        pending.discard(key)
+                        unsettled.pop(key, None)
+                        affected |= self._refresh_entry(key[0], key[1], records_by_path, dependents)
+                    if pending:
+                        deadline = time.monotonic() + debounce
+                    if not affected:
+                        continue
+                    
+                    names = set(affected)
+                    if self.respect_dependencies:
+                        for name in affected:
+                            names |= dependents.get(name, set())
+                    affected = set()
+                    
+                    print(f"\n[{datetime.now().strftime('%H:%M:%S')}] 重新分析 {len(names)} 种插件")
+                    self.analyze_duplicates(names)
+                    if not self.to_delete:
+                        continue
+                    
+                    cycles += 1
+                    self._start_watch_cycle(base_backup_dir, cycles)
+                    self.preview_changes(assume_yes=True)
+                    self.backup_and_delete()
+                    for result in self.results:
+                        if result['deleted']:
+                            self._refresh_entry(os.path.dirname(result['plugin']['path']), result['plugin']['original_name'],
+                                                records_by_path, dependents)
+        return True
+    
+    def run(self, preview_only=False, assume_yes=False):
         """执行清理流程"""
         print("=== Eclipse 插件清理工具 ===\n")
         
+        # 处理上次中断的两阶段删除（仅预览时不修改任何文件）
+        if not preview_only:
+            self.recover_interrupted_deletes()
+        
         # 1. 扫描插件
         if not self.scan_plugins():
             return False
@@ -566,7 +3919,7 @@ class SmartPluginCleaner:
         self.analyze_duplicates()
         
         # 3. 预览更改
-        if not self.preview_changes():
+        if not self.preview_changes(assume_yes=assume_yes):
             print("用户取消操作")
             return False
         
@@ -574,20 +3927,873 @@ class SmartPluginCleaner:
             print("仅预览模式，不执行实际删除")
             return True
         
-        # 4. 创建备份
-        if not self.create_backup():
-            print("备份失败，中止操作")
-            return False
+        # 4. 备份并删除插件
+        return self.backup_and_delete()
+
+def _resolve_installation(root):
+    """把安装目录或插件目录解析为(安装目录, [插件目录])"""
+    root = os.path.normpath(root)
+    if os.path.basename(root).lower() in ('plugins', 'dropins'):
+        install_root = os.path.dirname(root)
+        plugin_dirs = SmartPluginCleaner._check_eclipse_installation(install_root)
+        if root not in plugin_dirs:
+            plugin_dirs = [root]
+        return install_root, plugin_dirs
+    return root, SmartPluginCleaner._check_eclipse_installation(root)
+
+def _clean_installation(job):
+    """在子进程中对单个安装执行 扫描/分析/备份/删除，返回结果统计"""
+    result = {
+        'install': job['install'],
+        'plugin_dirs': job['plugin_dirs'],
+        'ok': False,
+        'plugins_deleted': 0,
+        'plugins_failed': 0,
+        'reclaimed_bytes': 0,
+        'retained_bytes': 0,
+        'timings': {},
+        'throughput': None,
+        'error': None
+    }
+    log = io.StringIO()
+    started = time.perf_counter()
+    
+    def timed(phase, func, *args):
+        phase_started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            result['timings'][phase] = round(time.perf_counter() - phase_started, 3)
+    
+    try:
+        with contextlib.redirect_stdout(log):
+            cleaner = SmartPluginCleaner(job['plugin_dirs'][0], extra_dirs=job['plugin_dirs'][1:], **job['options'])
+            if not job['dry_run']:
+                cleaner.recover_interrupted_deletes()
+            if not timed('scan', cleaner.scan_plugins):
+                raise RuntimeError("扫描失败")
+            timed('analyze', cleaner.analyze_duplicates)
+            reclaimable = timed('size', cleaner.compute_sizes)
+            
+            if job['dry_run']:
+                result['reclaimed_bytes'] = reclaimable
+                result['plugins_deleted'] = len(cleaner.to_delete)
+                result['ok'] = True
+            else:
+                result['ok'] = timed('backup_delete', cleaner.backup_and_delete)
+                for item in cleaner.results:
+                    if item['deleted']:
+                        result['plugins_deleted'] += 1
+                    else:
+                        result['plugins_failed'] += 1
+                result['reclaimed_bytes'], result['retained_bytes'] = cleaner._reclaimed_space(cleaner.results)
+                if result['plugins_failed']:
+                    result['error'] = f"{result['plugins_failed']} 个插件未能删除"
+                if cleaner.throttle is not None:
+                    result['throughput'] = cleaner.throttle.report()
+    except Exception as e:
+        result['error'] = str(e)
+    
+    result['timings']['total'] = round(time.perf_counter() - started, 3)
+    if not result['ok']:
+        result['log'] = log.getvalue()[-4000:]
+    return result
+
+def run_fleet(roots, jobs=None, dry_run=False, report_path=None, **options):
+    """非交互地并行清理多个Eclipse安装，返回汇总报告
+    
+    roots 可以是安装目录，也可以是 plugins/、dropins/ 目录（例如 find_eclipse_plugin_dirs() 的结果），
+    同一安装下的目录会合并为一个任务。options 传给 SmartPluginCleaner；
+    io_limit/ops_limit 是整个批量任务的限速，按并行进程数平均分配给各进程。
+    """
+    installs = {}
+    for root in roots:
+        install_root, plugin_dirs = _resolve_installation(root)
+        if plugin_dirs:
+            installs.setdefault(install_root, [])
+            installs[install_root].extend(d for d in plugin_dirs if d not in installs[install_root])
+    
+    workers = max(1, min(jobs or os.cpu_count() or 1, len(installs) or 1))
+    for key in ('io_limit', 'ops_limit'):
+        if options.get(key):
+            options[key] = options[key] / workers
+    
+    job_list = [{'install': install_root, 'plugin_dirs': plugin_dirs, 'options': options, 'dry_run': dry_run}
+                for install_root, plugin_dirs in sorted(installs.items())]
+    
+    print(f"共 {len(job_list)} 个安装待处理{' (仅预览)' if dry_run else ''}")
+    started = time.perf_counter()
+    results = []
+    
+    if job_list:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_clean_installation, job): job for job in job_list}
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {'install': job['install'], 'plugin_dirs': job['plugin_dirs'], 'ok': False,
+                              'plugins_deleted': 0, 'plugins_failed': 0, 'reclaimed_bytes': 0, 'retained_bytes': 0,
+                              'timings': {}, 'throughput': None, 'error': str(e)}
+                results.append(result)
+                status = "✅" if result['ok'] else "❌"
+                print(f"  {status} {result['install']}: {'可删除' if dry_run else '删除'} {result['plugins_deleted']} 个, "
+                      f"{'可释放' if dry_run else '释放'} {result['reclaimed_bytes'] / (1024 * 1024):.1f} MB, "
+                      + (f"移入备份 {result['retained_bytes'] / (1024 * 1024):.1f} MB, " if result['retained_bytes'] else "")
+                      + f"耗时 {result['timings'].get('total', 0):.2f}s"
+                      + (f" - {result['error']}" if result['error'] else ""))
+    
+    results.sort(key=lambda item: item['install'])
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'dry_run': dry_run,
+        'installs': results,
+        'total_installs': len(results),
+        'failed_installs': sum(1 for item in results if not item['ok']),
+        'total_plugins_deleted': sum(item['plugins_deleted'] for item in results),
+        'total_reclaimed_bytes': sum(item['reclaimed_bytes'] for item in results),
+        'total_retained_bytes': sum(item['retained_bytes'] for item in results),
+        'elapsed': round(time.perf_counter() - started, 3)
+    }
+    throughputs = [item['throughput'] for item in results if item.get('throughput')]
+    if throughputs:
+        report['io'] = {
+            'bytes': sum(item['bytes'] for item in throughputs),
+            'ops': sum(item['ops'] for item in throughputs),
+            'waited': round(sum(item['waited'] for item in throughputs), 3)
+        }
+        if report['elapsed'] > 0:
+            report['io']['bytes_per_sec'] = round(report['io']['bytes'] / report['elapsed'])
+            report['io']['ops_per_sec'] = round(report['io']['ops'] / report['elapsed'], 1)
+    
+    print(f"\n汇总: {report['total_installs']} 个安装, 失败 {report['failed_installs']} 个, "
+          f"删除 {report['total_plugins_deleted']} 个插件, "
+          f"释放 {report['total_reclaimed_bytes'] / (1024 * 1024):.1f} MB, "
+          + (f"移入备份 {report['total_retained_bytes'] / (1024 * 1024):.1f} MB, " if report['total_retained_bytes'] else "")
+          + f"总耗时 {report['elapsed']:.2f}s")
+    if 'bytes_per_sec' in report.get('io', {}):
+        print(f"I/O 吞吐: {format_size(report['io']['bytes_per_sec'])}/s, {report['io']['ops_per_sec']} 次操作/s "
+              f"(限速等待共 {report['io']['waited']:.2f}s)")
+    
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"报告已写入: {report_path}")
+    
+    return report
+
+def _index_bundle_files(plugin_dirs, include_dir_bundles=True, min_size=4096):
+    """收集各插件目录中的 jar 以及目录插件内的普通文件，返回[(路径, stat)]"""
+    files = []
+    for plugin_dir in plugin_dirs:
+        try:
+            entries = list(os.scandir(plugin_dir))
+        except OSError as e:
+            print(f"  跳过无法读取的目录: {plugin_dir} - {e}")
+            continue
+        
+        for entry in entries:
+            if entry.name.startswith('backup_'):
+                continue
+            try:
+                if entry.is_file(follow_symlinks=False):
+                    if entry.name.endswith('.jar'):
+                        files.append((entry.path, entry.stat(follow_symlinks=False)))
+                elif include_dir_bundles and entry.is_dir(follow_symlinks=False):
+                    for root, dirs, filenames in os.walk(entry.path):
+                        for filename in filenames:
+                            path = os.path.join(root, filename)
+                            st = os.lstat(path)
+                            if stat.S_ISREG(st.st_mode) and st.st_size >= min_size:
+                                files.append((path, st))
+            except OSError:
+                continue
+    return files
+
+def consolidate_bundle_pool(plugin_dirs, pool_dir=None, dry_run=False, workers=4, include_dir_bundles=True,
+                            min_size=4096):
+    """把多个安装中内容完全相同的插件文件替换为指向同一文件的硬链接（类似 p2 bundle pool）
+    
+    先按(设备, 大小)分组，再对候选文件计算哈希确认内容一致。硬链接只能在同一文件系统内建立，
+    pool_dir 不在同一文件系统时退回为以第一份副本作为共享文件。返回统计信息。
+    """
+    stats = {'files_indexed': 0, 'duplicate_groups': 0, 'files_linked': 0, 'bytes_reclaimed': 0, 'errors': []}
+    files = _index_bundle_files(plugin_dirs, include_dir_bundles, min_size)
+    stats['files_indexed'] = len(files)
+    
+    # 1. 按(设备, 大小)分组，同一 inode 只保留一次
+    by_size = defaultdict(lambda: defaultdict(list))
+    for path, st in files:
+        by_size[(st.st_dev, st.st_size)][st.st_ino].append((path, st))
+    candidates = {key: inodes for key, inodes in by_size.items() if len(inodes) > 1}
+    
+    # 2. 对候选 inode 各计算一次哈希
+    hash_jobs = [(key, ino, links[0][0]) for key, inodes in candidates.items() for ino, links in inodes.items()]
+    digests = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(BackupStore.hash_file, path): (key, ino) for key, ino, path in hash_jobs}
+        for future in as_completed(futures):
+            try:
+                digests[futures[future]] = future.result()
+            except OSError as e:
+                stats['errors'].append(str(e))
+    
+    pool_dev = None
+    if pool_dir:
+        if not dry_run:
+            os.makedirs(pool_dir, exist_ok=True)
+        if os.path.isdir(pool_dir):
+            pool_dev = os.stat(pool_dir).st_dev
+    
+    # 3. 内容相同的 inode 合并为指向同一文件的硬链接
+    for (dev, size), inodes in candidates.items():
+        by_digest = defaultdict(list)
+        for ino, links in inodes.items():
+            digest = digests.get(((dev, size), ino))
+            if digest:
+                by_digest[digest].append(links)
+        
+        for digest, groups in by_digest.items():
+            if len(groups) < 2:
+                continue
+            stats['duplicate_groups'] += 1
+            
+            # 已被链接次数最多的 inode 作为共享文件
+            groups.sort(key=lambda links: (-links[0][1].st_nlink, links[0][0]))
+            canonical = groups[0][0][0]
+            if pool_dev == dev:
+                pool_path = os.path.join(pool_dir, digest[:2], digest)
+                if not dry_run and not os.path.exists(pool_path):
+                    os.makedirs(os.path.dirname(pool_path), exist_ok=True)
+                    os.link(canonical, pool_path)
+                if os.path.exists(pool_path):
+                    canonical = pool_path
+            
+            for links in groups[1:]:
+                replaced = 0
+                for path, st in links:
+                    if dry_run:
+                        replaced += 1
+                        continue
+                    tmp_path = path + '.consolidate.tmp'
+                    try:
+                        # 替换前确认文件未被改动
+                        current = os.lstat(path)
+                        if (current.st_ino, current.st_size, current.st_mtime_ns) != (st.st_ino, st.st_size, st.st_mtime_ns):
+                            raise OSError(f"文件在处理过程中被修改: {path}")
+                        os.link(canonical, tmp_path)
+                        os.replace(tmp_path, path)
+                        replaced += 1
+                    except OSError as e:
+                        if os.path.lexists(tmp_path):
+                            os.remove(tmp_path)
+                        stats['errors'].append(f"{path} - {e}")
+                
+                stats['files_linked'] += replaced
+                # 只有该 inode 的全部链接都被替换时空间才真正释放
+                if replaced == links[0][1].st_nlink:
+                    stats['bytes_reclaimed'] += size
+    
+    return stats
+
+def run_consolidation(plugin_dirs, pool_dir=None, dry_run=False):
+    """执行跨安装的插件文件合并并输出统计"""
+    print(f"合并 {len(plugin_dirs)} 个插件目录中的相同文件{' (仅预览)' if dry_run else ''}...")
+    stats = consolidate_bundle_pool(plugin_dirs, pool_dir=pool_dir, dry_run=dry_run)
+    
+    print(f"  索引文件: {stats['files_indexed']} 个")
+    print(f"  相同内容组: {stats['duplicate_groups']} 组")
+    print(f"  {'可替换' if dry_run else '已替换'}为硬链接: {stats['files_linked']} 个")
+    print(f"  {'可释放' if dry_run else '释放'}空间: {stats['bytes_reclaimed'] / (1024 * 1024):.1f} MB")
+    for error in stats['errors']:
+        print(f"  失败: {error}")
+    return not stats['errors']
+
+def _repack_entries(bundle_dir):
+    """列出目录插件中要写入 jar 的条目，返回[(归档名, 路径, 是否目录)]，清单排在最前
+
+    遇到符号链接或特殊文件时抛出 ValueError，这类插件不能无损地打包。
+    """
+    entries = []
+    for root, dirs, files in os.walk(bundle_dir):
+        dirs.sort()
+        rel_root = os.path.relpath(root, bundle_dir).replace(os.sep, '/')
+        if rel_root != '.':
+            entries.append((rel_root + '/', root, True))
+        for name in sorted(dirs + files):
+            path = os.path.join(root, name)
+            st = os.lstat(path)
+            if stat.S_ISLNK(st.st_mode) or not (stat.S_ISDIR(st.st_mode) or stat.S_ISREG(st.st_mode)):
+                raise ValueError(f"包含符号链接或特殊文件: {path}")
+        for name in sorted(files):
+            arcname = name if rel_root == '.' else f"{rel_root}/{name}"
+            entries.append((arcname, os.path.join(root, name), False))
+    
+    # jar 规范要求 META-INF/ 和清单位于最前
+    head = [entry for entry in entries if entry[0] in ('META-INF/', MANIFEST_ENTRY)]
+    return head + [entry for entry in entries if entry[0] not in ('META-INF/', MANIFEST_ENTRY)]
+
+def _verify_repacked_jar(jar_path, entries):
+    """按源目录逐项核对 jar：条目集合、大小和 CRC 必须一致，并解压校验全部条目"""
+    with zipfile.ZipFile(jar_path) as archive:
+        infos = {info.filename: info for info in archive.infolist()}
+        if set(infos) != set(arcname for arcname, _, _ in entries):
+            return "条目与源目录不一致"
+        for arcname, path, is_dir in entries:
+            if is_dir:
+                continue
+            crc = 0
+            size = 0
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    crc = zlib.crc32(chunk, crc)
+                    size += len(chunk)
+            info = infos[arcname]
+            if info.file_size != size or info.CRC != crc:
+                return f"内容与源文件不一致: {arcname}"
+        bad = archive.testzip()
+        if bad:
+            return f"条目校验失败: {bad}"
+    return None
+
+def repack_dir_bundle(bundle_dir, dry_run=False):
+    """把一个目录插件打包为同名 jar，返回结果字典
+
+    没有清单、声明了 Eclipse-BundleShape: dir、包含符号链接或同名 jar 已存在的插件会被跳过。
+    jar 先写入同一目录的临时文件并按源目录校验，再用重命名替换原目录，失败时恢复原目录。
+    """
+    bundle_dir = bundle_dir.rstrip(os.sep)
+    jar_path = bundle_dir + '.jar'
+    result = {'path': bundle_dir, 'jar': jar_path, 'status': 'skipped', 'reason': None, 'identity': None,
+              'files': 0, 'inodes': 0, 'dir_bytes': 0, 'jar_bytes': 0}
+    
+    try:
+        headers = read_bundle_manifest(bundle_dir, True)
+        if not headers:
+            result['reason'] = "没有 OSGi 清单"
+            return result
+        if headers.get('Eclipse-BundleShape', '').strip().lower() == 'dir':
+            result['reason'] = "Eclipse-BundleShape: dir"
+            return result
+        if os.path.lexists(jar_path):
+            result['reason'] = "同名 jar 已存在"
+            return result
+        entries = _repack_entries(bundle_dir)
+    except (OSError, ValueError) as e:
+        result['reason'] = str(e)
+        return result
+    
+    result['identity'] = bundle_identity(headers)
+    result['files'] = sum(1 for _, _, is_dir in entries if not is_dir)
+    # 去掉的 inode：全部文件和目录，减去新生成的 jar 本身
+    result['inodes'] = len(entries)
+    for _, path, is_dir in entries:
+        if not is_dir:
+            result['dir_bytes'] += os.lstat(path).st_size
+    if dry_run:
+        result['status'] = 'planned'
+        return result
+    
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(jar_path) + '.', suffix='.tmp',
+                                    dir=os.path.dirname(jar_path))
+    old_dir = bundle_dir + '.repack.old'
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            with zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+                for arcname, path, is_dir in entries:
+                    if is_dir:
+                        archive.write(path, arcname)
+                    else:
+                        compress_type = (zipfile.ZIP_STORED if arcname.lower().endswith(SmartPluginCleaner.STORED_EXTENSIONS)
+                                         else zipfile.ZIP_DEFLATED)
+                        archive.write(path, arcname, compress_type=compress_type)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp 创建的文件只有属主可读，改为与原目录一致的读写权限
+        os.chmod(tmp_path, stat.S_IMODE(os.stat(bundle_dir).st_mode) & 0o666)
+        
+        error = _verify_repacked_jar(tmp_path, entries)
+        if error:
+            raise ValueError(error)
+        
+        # 先把原目录移开再放入 jar，jar 放置失败时移回原目录
+        os.rename(bundle_dir, old_dir)
+        try:
+            os.rename(tmp_path, jar_path)
+        except OSError:
+            os.rename(old_dir, bundle_dir)
+            raise
+    except (OSError, ValueError, zipfile.BadZipFile) as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        result['status'] = 'failed'
+        result['reason'] = str(e)
+        return result
+    
+    shutil.rmtree(old_dir, ignore_errors=True)
+    result['jar_bytes'] = os.path.getsize(jar_path)
+    result['status'] = 'packed'
+    return result
+
+def repack_dir_bundles(plugin_dirs, dry_run=False, workers=4):
+    """并行把各插件目录中的目录插件打包为 jar，并同步更新所在安装的 p2 元数据，返回统计信息"""
+    stats = {'packed': 0, 'skipped': 0, 'shape_dir': 0, 'files_removed': 0, 'inodes_removed': 0,
+             'dir_bytes': 0, 'jar_bytes': 0, 'p2_updates': {}, 'errors': []}
+    
+    bundle_dirs = []
+    for plugin_dir in plugin_dirs:
+        try:
+            entries = list(os.scandir(plugin_dir))
+        except OSError as e:
+            print(f"  跳过无法读取的目录: {plugin_dir} - {e}")
+            continue
+        for entry in entries:
+            if entry.name.startswith('backup_') or entry.name.startswith('.') or entry.name.endswith('.repack.old'):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                bundle_dirs.append((plugin_dir, entry.path))
+    
+    packed_by_dir = defaultdict(list)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(repack_dir_bundle, path, dry_run): plugin_dir for plugin_dir, path in bundle_dirs}
+        for future in as_completed(futures):
+            result = future.result()
+            if result['status'] == 'failed':
+                stats['errors'].append(f"{result['path']} - {result['reason']}")
+                continue
+            if result['status'] == 'skipped':
+                stats['skipped'] += 1
+                if result['reason'] == "Eclipse-BundleShape: dir":
+                    stats['shape_dir'] += 1
+                continue
+            stats['packed'] += 1
+            stats['files_removed'] += result['files']
+            stats['inodes_removed'] += result['inodes']
+            stats['dir_bytes'] += result['dir_bytes']
+            stats['jar_bytes'] += result['jar_bytes']
+            if result['identity']:
+                name, version = result['identity']
+                packed_by_dir[futures[future]].append({'path': result['path'], 'name': name, 'version': version})
+    
+    if not dry_run:
+        for plugin_dir, plugins in packed_by_dir.items():
+            metadata = P2Metadata.load(os.path.dirname(os.path.abspath(plugin_dir)))
+            if metadata.found:
+                try:
+                    stats['p2_updates'].update(metadata.repack_bundles(plugins))
+                except (OSError, ValueError, xml.sax.SAXException) as e:
+                    stats['errors'].append(f"更新 p2 元数据失败: {e}")
+    
+    return stats
+
+def run_repack(plugin_dirs, dry_run=False):
+    """把目录插件打包为 jar 并输出统计"""
+    print(f"打包 {len(plugin_dirs)} 个插件目录中的目录插件{' (仅预览)' if dry_run else ''}...")
+    stats = repack_dir_bundles(plugin_dirs, dry_run=dry_run)
+    
+    print(f"  {'可打包' if dry_run else '已打包'}: {stats['packed']} 个")
+    print(f"  跳过: {stats['skipped']} 个 (其中 Eclipse-BundleShape: dir {stats['shape_dir']} 个)")
+    print(f"  {'可减少' if dry_run else '减少'}文件: {stats['files_removed']} 个, inode: {stats['inodes_removed']} 个")
+    if not dry_run:
+        print(f"  文件总大小: {format_size(stats['dir_bytes'])} -> jar {format_size(stats['jar_bytes'])}")
+    for path, changed in stats['p2_updates'].items():
+        print(f"  更新 p2 元数据: {path} ({changed} 处)")
+    for error in stats['errors']:
+        print(f"  失败: {error}")
+    return not stats['errors']
+
+def load_backup_manifest(backup_path):
+    """读取备份清单，backup_path 可以是备份目录、清单文件或备份压缩包，返回(清单, 备份位置)"""
+    if os.path.isdir(backup_path):
+        backup_path = os.path.join(backup_path, 'backup_manifest.json')
+    
+    if backup_path.endswith('.zip'):
+        with zipfile.ZipFile(backup_path) as archive:
+            return json.loads(archive.read('backup_manifest.json').decode('utf-8')), backup_path
+    if backup_path.endswith(('.tar.gz', '.tar.xz')):
+        # 清单是 tar 中的最后一个条目，只能顺序读取
+        with tarfile.open(backup_path, 'r|*') as archive:
+            for member in archive:
+                if member.name == 'backup_manifest.json':
+                    return json.loads(archive.extractfile(member).read().decode('utf-8')), backup_path
+        raise ValueError(f"压缩包中没有备份清单: {backup_path}")
+    
+    with open(backup_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    return manifest, os.path.dirname(os.path.abspath(backup_path))
+
+def _same_filesystem(path_a, path_b):
+    """判断两个路径是否位于同一文件系统"""
+    try:
+        return os.stat(path_a).st_dev == os.stat(path_b).st_dev
+    except OSError:
+        return False
+
+def _restore_from_store(store, entry, target, same_fs):
+    """从去重备份库还原插件：同一文件系统时尽量 reflink，否则复制
+    
+    不硬链接 blob，还原出的插件之后被原地改写不会破坏备份库。
+    """
+    def place(blob, dst):
+        if same_fs:
+            try:
+                SmartPluginCleaner._reflink_file(blob, dst)
+                return
+            except OSError:
+                pass
+        shutil.copy2(blob, dst)
+    
+    if not entry['is_dir']:
+        place(store.blob_path(entry['blob']), target)
+        return
+    
+    os.makedirs(target)
+    for rel_dir in entry.get('empty_dirs', []):
+        os.makedirs(os.path.join(target, rel_dir), exist_ok=True)
+    for file_entry in entry.get('files', []):
+        dst = os.path.join(target, *file_entry['path'].split('/'))
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        place(store.blob_path(file_entry['blob']), dst)
+
+def _link_or_copy(source, target, is_dir, same_fs):
+    """同一文件系统时硬链接，否则（或硬链接失败时）复制，返回使用的方式"""
+    if same_fs:
+        try:
+            if is_dir:
+                shutil.copytree(source, target, copy_function=os.link)
+            else:
+                os.link(source, target)
+            return 'link'
+        except OSError:
+            if os.path.isdir(target) and not os.path.islink(target):
+                shutil.rmtree(target, ignore_errors=True)
+            elif os.path.lexists(target):
+                os.remove(target)
+    if is_dir:
+        shutil.copytree(source, target)
+    else:
+        shutil.copy2(source, target)
+    return 'copy'
+
+def restore_backup(backup_path, names=None, target_dir=None, workers=8, verify=True):
+    """根据备份清单还原插件，返回每个插件的还原结果
+    
+    names: 只还原这些插件（匹配 original_name 或插件名），None 表示全部
+    target_dir: 还原到该目录，默认还原到各插件原来的位置
+    插件先还原到目标旁边的临时目录（同一文件系统上硬链接，否则并行复制），按备份时记录的
+    大小/文件数（以及可选的哈希）校验通过后才重命名到位；校验失败时目标和备份都保持原样。
+    以硬链接还原的目录备份条目在校验通过后从备份中移除。
+    """
+    manifest, location = load_backup_manifest(backup_path)
+    backup_format = manifest.get('backup_format', 'dir')
+    entries = manifest.get('deleted_plugins', [])
+    if names:
+        wanted = set(names)
+        entries = [entry for entry in entries if entry['original_name'] in wanted or entry['name'] in wanted]
+    
+    def target_of(entry):
+        if target_dir:
+            return os.path.join(target_dir, entry['original_name'])
+        return entry.get('source_path') or os.path.join(manifest['source_dir'], entry['original_name'])
+    
+    def backup_path_of(entry):
+        # 旧版清单没有 backup_path，插件直接位于备份根下
+        return entry.get('backup_path', entry['original_name'])
+    
+    results = []
+    pending = []
+    claimed = set()
+    for entry in entries:
+        result = {'original_name': entry['original_name'], 'target': target_of(entry), 'method': None, 'ok': False, 'error': None}
+        results.append(result)
+        if os.path.lexists(result['target']):
+            result['error'] = "目标已存在"
+        elif result['target'] in claimed:
+            # 不同来源目录的同名插件还原到同一个目标目录时，只还原第一个
+            result['error'] = "目标与其他备份条目重复"
+        else:
+            claimed.add(result['target'])
+            pending.append((entry, result))
+    
+    # 压缩包先把需要的插件解压到目标旁边的临时目录，再逐个重命名到位
+    extracted_dirs = {}
+    if backup_format in ('zip', 'tar.gz', 'tar.xz') and pending:
+        by_parent = defaultdict(list)
+        for entry, result in pending:
+            by_parent[os.path.dirname(result['target'])].append(backup_path_of(entry))
+        for parent, parent_names in by_parent.items():
+            os.makedirs(parent, exist_ok=True)
+            extracted_dirs[parent] = tempfile.mkdtemp(prefix='.restore_', dir=parent)
+            SmartPluginCleaner.extract_from_backup_archive(location, parent_names, extracted_dirs[parent])
+    
+    store = BackupStore(os.path.dirname(os.path.dirname(os.path.abspath(backup_path)))) if backup_format == 'store' else None
+    
+    def restore_one(item):
+        entry, result = item
+        target = result['target']
+        parent = os.path.dirname(target)
+        os.makedirs(parent, exist_ok=True)
+        
+        staging_dir = tempfile.mkdtemp(prefix='.restore_', dir=parent)
+        staged = os.path.join(staging_dir, entry['original_name'])
+        source = None
+        try:
+            if store:
+                same_fs = _same_filesystem(store.objects_dir, parent)
+                _restore_from_store(store, entry, staged, same_fs)
+                result['method'] = 'reflink' if same_fs else 'copy'
+            else:
+                source = os.path.join(extracted_dirs[parent] if extracted_dirs else location, *backup_path_of(entry).split('/'))
+                if not os.path.lexists(source):
+                    raise FileNotFoundError(f"备份中找不到: {backup_path_of(entry)}")
+                if extracted_dirs:
+                    # 解压出的临时副本可以直接移动，压缩包本身仍然保留
+                    os.rename(source, staged)
+                    result['method'] = 'extract'
+                    source = None
+                else:
+                    result['method'] = _link_or_copy(source, staged, entry['is_dir'], _same_filesystem(location, parent))
+            
+            if verify and 'size' in entry:
+                actual = tree_fingerprint(staged, entry['is_dir'], 'sha256' in entry)
+                for key in ('size', 'file_count', 'sha256'):
+                    if key in entry and actual.get(key) != entry[key]:
+                        raise ValueError(f"校验失败: {key} 为 {actual.get(key)}，备份时为 {entry[key]}")
+            os.rename(staged, target)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
         
-        # 5. 删除插件
-        return self.delete_plugins()
+        # 校验通过并就位之后，才移除已经以硬链接还原的备份条目
+        if source is not None and result['method'] == 'link':
+            if entry['is_dir'] and not os.path.islink(source):
+                shutil.rmtree(source, ignore_errors=True)
+            else:
+                with contextlib.suppress(OSError):
+                    os.remove(source)
+        result['ok'] = True
+    
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [(result, executor.submit(restore_one, (entry, result))) for entry, result in pending]
+            for result, future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    result['error'] = str(e)
+    finally:
+        for extracted_dir in extracted_dirs.values():
+            shutil.rmtree(extracted_dir, ignore_errors=True)
+    
+    # 还原到原位置时，把删除时从 bundles.info 和 artifact 索引中去掉的条目加回
+    restored = [(entry, result) for entry, result in pending if result['ok'] and entry.get('p2')]
+    if restored and not target_dir and manifest.get('p2_install_root'):
+        try:
+            metadata = P2Metadata.load(manifest['p2_install_root'])
+            metadata.restore_entries([entry['p2'] for entry, result in restored])
+            for entry, result in restored:
+                result['p2'] = True
+        except (OSError, ValueError, xml.sax.SAXException, ElementTree.ParseError, zipfile.BadZipFile, KeyError) as e:
+            for entry, result in restored:
+                result['p2_error'] = str(e)
+    
+    return results
 
-def main():
+def run_restore(backup_path, names=None, target_dir=None, verify=True):
+    """执行还原并输出结果"""
+    print(f"从备份还原: {backup_path}")
+    try:
+        results = restore_backup(backup_path, names=names, target_dir=target_dir, verify=verify)
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile, tarfile.TarError) as e:
+        print(f"还原失败: {e}")
+        return False
+    
+    for result in results:
+        if result['ok']:
+            print(f"  还原: {result['original_name']} ({result['method']}{', p2 条目' if result.get('p2') else ''})")
+            if result.get('p2_error'):
+                print(f"    p2 元数据未能恢复: {result['p2_error']}")
+        else:
+            print(f"  还原失败: {result['original_name']} - {result['error']}")
+    
+    success_count = sum(1 for result in results if result['ok'])
+    print(f"\n还原完成: 成功 {success_count}/{len(results)} 个")
+    return success_count == len(results)
+
+def parse_args(argv=None):
+    """解析命令行参数，不带参数时进入交互模式"""
+    parser = argparse.ArgumentParser(description="Eclipse 插件清理工具")
+    parser.add_argument('--backup-store', metavar='DIR', help="使用按内容去重的备份库")
+    parser.add_argument('--use-manifest', action='store_true', help="从 OSGi 清单读取插件名和版本")
+    parser.add_argument('--respect-dependencies', action='store_true', help="保留仍被其他插件 Require-Bundle 依赖的旧版本")
+    parser.add_argument('--scan-index', action='store_true', help="使用持久化扫描索引，只重新解析变化的条目")
+    parser.add_argument('--fleet', nargs='+', metavar='ROOT', help="非交互地并行清理多个安装目录或插件目录")
+    parser.add_argument('--fleet-auto', action='store_true', help="对自动找到的所有插件目录执行批量清理")
+    parser.add_argument('--workers', type=parse_positive_int, default=4, metavar='N', help="备份与删除的并发线程数（默认 4）")
+    parser.add_argument('--backup-strategy', choices=('auto',) + SmartPluginCleaner.BACKUP_METHODS, default='auto',
+                        help="备份方式（默认 auto：按 重命名 → 硬链接 → reflink → 复制 选择开销最低的方式；copy 保留一份独立副本）")
+    parser.add_argument('--backup-format', choices=tuple(SmartPluginCleaner.BACKUP_FORMATS), default='dir',
+                        help="备份格式（默认 dir：备份目录；zip/tar.gz/tar.xz：流式写入单个压缩包）")
+    parser.add_argument('--jobs', type=int, help="批量清理时的并行进程数（默认 CPU 核数）")
+    parser.add_argument('--dry-run', action='store_true', help="批量清理、文件合并或打包时只分析不修改")
+    parser.add_argument('--report', metavar='FILE', help="批量清理的汇总报告输出路径 (JSON)")
+    parser.add_argument('--consolidate', nargs='+', metavar='DIR', help="把多个插件目录中内容相同的文件合并为硬链接")
+    parser.add_argument('--consolidate-auto', action='store_true', help="对自动找到的所有插件目录执行文件合并")
+    parser.add_argument('--repack', nargs='+', metavar='DIR', help="把这些插件目录中的目录插件打包为 jar，减少文件和 inode 数量")
+    parser.add_argument('--pool', metavar='DIR', help="合并时使用的共享文件池目录（需与插件在同一文件系统）")
+    parser.add_argument('--profile', metavar='DIR', help="记录各阶段耗时，输出 Chrome trace (trace.json) 和汇总 (profile_summary.json)")
+    parser.add_argument('--discover-root', action='append', metavar='DIR', help="按安装标志在该目录下有限深度查找Eclipse安装（可多次指定）")
+    parser.add_argument('--discover-depth', type=int, default=2, help="查找安装时的最大遍历深度")
+    parser.add_argument('--discover-timeout', type=float, help="每个候选路径的探测超时（秒）")
+    parser.add_argument('--refresh-discovery', action='store_true', help="忽略缓存的发现结果重新查找")
+    parser.add_argument('--restore', metavar='BACKUP', help="根据备份目录、清单文件或备份压缩包还原插件后退出")
+    parser.add_argument('--only', nargs='+', metavar='NAME', help="还原时只还原这些插件")
+    parser.add_argument('--target', metavar='DIR', help="还原到该目录（默认还原到原位置）")
+    parser.add_argument('--no-verify', action='store_true', help="还原后不校验大小和哈希")
+    parser.add_argument('--record-hashes', action='store_true', help="备份时记录大小、文件数和内容哈希，供还原时校验")
+    parser.add_argument('--stream-plan', nargs='+', metavar='DIR', help="以流式方式（内存占用有上限）为超大插件目录生成清理计划后退出")
+    parser.add_argument('--plan-output', default='cleanup_plan.jsonl', metavar='FILE', help="流式清理计划的输出文件 (JSON lines)")
+    parser.add_argument('--memory-mb', type=int, default=64, help="流式清理计划的内存预算 (MB)")
+    parser.add_argument('--watch', nargs='+', metavar='DIR', help="持续监视这些插件目录（仅 Linux），有新插件时增量分析并自动清理")
+    parser.add_argument('--debounce', type=float, default=SmartPluginCleaner.WATCH_DEBOUNCE, help="监视模式下最后一次变化后等待的秒数")
+    parser.add_argument('--sort-by', choices=SmartPluginCleaner.SORT_KEYS, default='name', help="预览和结果的排列方式（size: 按可回收空间从大到小）")
+    parser.add_argument('--verify-jars', nargs='?', const='quick', choices=SmartPluginCleaner.JAR_VERIFY_LEVELS,
+                        help="选择保留版本前校验 jar（quick: 只检查中央目录，full: 校验所有条目的 CRC）")
+    parser.add_argument('--ignore-p2', action='store_true', help="不读取 bundles.info/artifacts.xml，也不更新它们")
+    parser.add_argument('--journaled', action='store_true', help="两阶段删除：先把插件移入回收目录并记录日志，中断后下次启动可回滚或继续")
+    parser.add_argument('--purge', choices=SmartPluginCleaner.PURGE_MODES, default='background',
+                        help="两阶段删除后回收目录的清理方式（默认由后台进程清理）")
+    parser.add_argument('--purge-trash', metavar='DIR', help="清理回收目录中已提交的删除后退出")
+    parser.add_argument('--io-limit', type=parse_rate, metavar='RATE', help="备份复制和删除的字节限速，每秒字节数，可带 K/M/G 单位（如 20M）")
+    parser.add_argument('--ops-limit', type=parse_ops_rate, metavar='N', help="备份和删除每秒最多的文件操作数（创建、删除、链接、重命名）")
+    parser.add_argument('--low-priority', action='store_true', help="降低进程的 CPU 和 I/O 优先级（nice，Linux 上使用 idle I/O 类别）")
+    parser.add_argument('--gc-store', metavar='DIR', help="回收备份库中不再被引用的 blob 后退出")
+    parser.add_argument('--keep-days', type=int, help="回收时只保留最近 N 天的备份清单")
+    parser.add_argument('--keep-last', type=int, help="回收时每个源目录只保留最近 N 份备份清单")
+    args = parser.parse_args(argv)
+    if args.backup_store and args.backup_format != 'dir':
+        parser.error("--backup-store 不能与压缩包备份 (--backup-format) 同时使用")
+    return args
+
+def run_stream_plan(plugin_dirs, output_path, memory_mb=64, use_manifest=False):
+    """为超大插件目录流式生成清理计划并输出统计"""
+    print(f"流式生成清理计划: {', '.join(plugin_dirs)} (内存预算 {memory_mb} MB)")
+    cleaner = SmartPluginCleaner(plugin_dirs[0], extra_dirs=plugin_dirs[1:], use_manifest=use_manifest)
+    started = time.perf_counter()
+    try:
+        stats = cleaner.stream_plan(output_path, memory_mb=memory_mb)
+    except OSError as e:
+        print(f"生成失败: {e}")
+        return False
+    
+    print(f"  条目: {stats['entries']} 个, 插件: {stats['families']} 种, 临时文件: {stats['runs']} 个")
+    print(f"  保留: {stats['keep']} 个, 删除: {stats['delete']} 个")
+    print(f"计划已写入: {output_path} ({time.perf_counter() - started:.2f}s)")
+    return True
+
+def gc_backup_store(store_dir, keep_days=None, keep_last=None):
+    """执行备份库回收并输出统计"""
+    if not os.path.isdir(store_dir):
+        print(f"错误: 备份库 {store_dir} 不存在")
+        return False
+    
+    print(f"回收备份库: {store_dir}")
+    try:
+        stats = BackupStore(store_dir).gc(keep_days=keep_days, keep_last=keep_last)
+    except OSError as e:
+        print(f"回收失败: {e}")
+        return False
+    
+    print(f"  删除清单: {stats['manifests_removed']} 份")
+    print(f"  删除 blob: {stats['blobs_removed']} 个")
+    print(f"  释放空间: {stats['bytes_freed'] / (1024 * 1024):.1f} MB")
+    return True
+
+def main(argv=None):
     """主函数"""
+    args = parse_args(argv)
+    
+    if args.low_priority:
+        applied = lower_process_priority()
+        if applied:
+            print(f"已降低进程优先级: {', '.join(applied)}")
+    
+    if args.restore:
+        if not run_restore(args.restore, names=args.only, target_dir=args.target, verify=not args.no_verify):
+            sys.exit(1)
+        return
+    
+    if args.purge_trash:
+        # 只清理已提交的事务，不回滚可能正在进行中的删除
+        throttle = IOThrottle(args.io_limit, args.ops_limit) if args.io_limit is not None or args.ops_limit is not None else None
+        DeleteJournal(args.purge_trash).recover(rollback=False, throttle=throttle)
+        return
+    
+    if args.stream_plan:
+        if not run_stream_plan(args.stream_plan, args.plan_output, memory_mb=args.memory_mb, use_manifest=args.use_manifest):
+            sys.exit(1)
+        return
+    
+    if args.gc_store:
+        gc_backup_store(args.gc_store, keep_days=args.keep_days, keep_last=args.keep_last)
+        return
+    
+    discovery_options = {
+        'roots': args.discover_root,
+        'max_depth': args.discover_depth,
+        'timeout': args.discover_timeout,
+        'use_cache': not args.refresh_discovery
+    }
+    
+    if args.consolidate or args.consolidate_auto:
+        plugin_dirs = args.consolidate or SmartPluginCleaner.find_eclipse_plugin_dirs(**discovery_options)
+        if not run_consolidation(plugin_dirs, pool_dir=args.pool, dry_run=args.dry_run):
+            sys.exit(1)
+        return
+    
+    if args.repack:
+        if not run_repack(args.repack, dry_run=args.dry_run):
+            sys.exit(1)
+        return
+    
+    if args.watch:
+        cleaner = SmartPluginCleaner(args.watch[0], extra_dirs=args.watch[1:], backup_store=args.backup_store,
+                                     use_manifest=args.use_manifest, respect_dependencies=args.respect_dependencies,
+                                     record_hashes=args.record_hashes, journaled=args.journaled, purge_mode=args.purge,
+                                     respect_p2=not args.ignore_p2, verify_jars=args.verify_jars,
+                                     io_limit=args.io_limit, ops_limit=args.ops_limit, workers=args.workers,
+                                     backup_strategy=args.backup_strategy, backup_format=args.backup_format)
+        try:
+            if not cleaner.watch(debounce=args.debounce):
+                sys.exit(1)
+        except KeyboardInterrupt:
+            print("\n已停止监视")
+        except OSError as e:
+            print(f"监视失败: {e}")
+            sys.exit(1)
+        return
+    
+    if args.fleet or args.fleet_auto:
+        roots = args.fleet or SmartPluginCleaner.find_eclipse_plugin_dirs(**discovery_options)
+        report = run_fleet(roots, jobs=args.jobs, dry_run=args.dry_run, report_path=args.report,
+                           backup_store=args.backup_store, use_scan_index=args.scan_index,
+                           use_manifest=args.use_manifest, respect_dependencies=args.respect_dependencies,
+                           record_hashes=args.record_hashes, journaled=args.journaled, purge_mode=args.purge,
+                           respect_p2=not args.ignore_p2, verify_jars=args.verify_jars,
+                           io_limit=args.io_limit, ops_limit=args.ops_limit, workers=args.workers,
+                           backup_strategy=args.backup_strategy, backup_format=args.backup_format)
+        if report['failed_installs']:
+            sys.exit(1)
+        return
+    
     print("=== Eclipse 插件清理工具 ===\n")
     
-    # 让用户选择插件目录
-    plugin_dir = SmartPluginCleaner.select_plugin_dir()
+    profiler = PhaseProfiler() if args.profile else NullProfiler()
+    
+    # 让用户选择插件目录，只有查找过程计入 discovery 阶段，等待用户选择的时间不计入
+    with profiler.span('discovery'):
+        found_dirs = SmartPluginCleaner.find_eclipse_plugin_dirs(**discovery_options)
+    plugin_dir = SmartPluginCleaner.select_plugin_dir(found_dirs)
     
     if plugin_dir is None:
         print("操作已取消")
@@ -596,15 +4802,27 @@ def main():
     print(f"\n选择的插件目录: {plugin_dir}")
     
     # 创建清理器实例
-    cleaner = SmartPluginCleaner(plugin_dir)
+    cleaner = SmartPluginCleaner(plugin_dir, backup_store=args.backup_store, use_scan_index=args.scan_index,
+                                 use_manifest=args.use_manifest, respect_dependencies=args.respect_dependencies,
+                                 profiler=profiler, record_hashes=args.record_hashes,
+                                 journaled=args.journaled, purge_mode=args.purge, sort_by=args.sort_by,
+                                 respect_p2=not args.ignore_p2, verify_jars=args.verify_jars,
+                                 io_limit=args.io_limit, ops_limit=args.ops_limit, workers=args.workers,
+                                 backup_strategy=args.backup_strategy, backup_format=args.backup_format)
     
     # 运行清理
     success = cleaner.run()
     
+    if args.profile:
+        os.makedirs(args.profile, exist_ok=True)
+        profiler.export_chrome_trace(os.path.join(args.profile, 'trace.json'))
+        profiler.export_summary(os.path.join(args.profile, 'profile_summary.json'))
+        print(f"\n📊 性能分析结果: {args.profile}")
+    
     if success:
         print("\n✅ 插件清理完成!")
-        if cleaner.backup_dir:
-            print(f"📁 备份位置: {cleaner.backup_dir}")
+        if cleaner.backup_location:
+            print(f"📁 备份位置: {cleaner.backup_location}")
     else:
         print("\n❌ 插件清理失败!")
 
@@ -0,0 +1,295 @@
+import json
+import os
+import zipfile
+
+import pytest
+
+import smart_plugin_cleaner
+from smart_plugin_cleaner import DeleteJournal, P2Metadata, SmartPluginCleaner, restore_backup, verify_jar
+
+
+BUNDLES_INFO = """#encoding=UTF-8
+#version=1
+a,1.1.0,plugins/a_1.1.0.jar,4,false
+b,2.0.0,plugins/b_2.0.0/,4,false
+gone,1.0.0,plugins/gone_1.0.0.jar,4,false
+"""
+
+ARTIFACTS_XML = """<?xml version='1.0' encoding='UTF-8'?>
+<?artifactRepository version='1.1.0'?>
+<repository name='Bundle pool' type='org.eclipse.equinox.p2.artifact.repository.simpleRepository' version='1'>
+  <artifacts size='4'>
+    <artifact classifier='osgi.bundle' id='a' version='1.0.0.v2020'>
+      <properties size='1'>
+        <property name='download.size' value='2'/>
+      </properties>
+    </artifact>
+    <artifact classifier='osgi.bundle' id='a' version='1.1.0'/>
+    <artifact classifier='osgi.bundle' id='b' version='1.0.0'>
+      <properties size='1'>
+        <property name='artifact.folder' value='true'/>
+      </properties>
+    </artifact>
+    <artifact classifier='osgi.bundle' id='b' version='2.0.0'/>
+  </artifacts>
+</repository>
+"""
+
+
+def write_jar(path, entries=None):
+    """写入一个有效的 jar"""
+    with zipfile.ZipFile(path, 'w') as archive:
+        for name, data in (entries or {'META-INF/MANIFEST.MF': b'Manifest-Version: 1.0\n'}).items():
+            archive.writestr(name, data)
+
+
+@pytest.fixture
+def install(tmp_path):
+    """Eclipse 安装目录：a 有两个 jar 版本，b 有两个目录版本"""
+    root = tmp_path / 'eclipse'
+    plugins = root / 'plugins'
+    (plugins / 'b_1.0.0' / 'sub').mkdir(parents=True)
+    (plugins / 'b_2.0.0').mkdir()
+    (plugins / 'a_1.0.0.v2020.jar').write_bytes(b'old a')
+    (plugins / 'a_1.1.0.jar').write_bytes(b'new a')
+    (plugins / 'b_1.0.0' / 'sub' / 'f.txt').write_bytes(b'old b')
+    (plugins / 'b_1.0.0' / 'plugin.xml').write_bytes(b'<plugin/>')
+    (plugins / 'b_2.0.0' / 'plugin.xml').write_bytes(b'<plugin/>')
+    return root
+
+
+def make_cleaner(install, tmp_path, **options):
+    options.setdefault('backup_dir', str(tmp_path / 'backup'))
+    options.setdefault('cache_dir', str(tmp_path / 'cache'))
+    options.setdefault('purge_mode', 'now')
+    return SmartPluginCleaner(str(install / 'plugins'), **options)
+
+
+def snapshot(directory):
+    """返回目录下所有文件的 {相对路径: 内容}"""
+    files = {}
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            files[os.path.relpath(path, directory)] = open(path, 'rb').read()
+    return files
+
+
+def clean(cleaner):
+    assert cleaner.scan_plugins()
+    cleaner.analyze_duplicates()
+    return cleaner.backup_and_delete()
+
+
+def assert_cleaned(install):
+    assert sorted(os.listdir(install / 'plugins')) == ['a_1.1.0.jar', 'b_2.0.0']
+
+
+@pytest.mark.parametrize('strategy', SmartPluginCleaner.BACKUP_METHODS)
+def test_backup_restore_round_trip_each_strategy(install, tmp_path, strategy):
+    before = snapshot(install / 'plugins')
+    cleaner = make_cleaner(install, tmp_path, backup_strategy=strategy, record_hashes=True)
+
+    assert clean(cleaner)
+    assert_cleaned(install)
+    assert set(cleaner.backup_methods.values()) == {strategy}
+
+    results = restore_backup(cleaner.backup_location)
+    assert [result['error'] for result in results] == [None, None]
+    assert all(result['ok'] for result in results)
+    assert snapshot(install / 'plugins') == before
+
+
+@pytest.mark.parametrize('backup_format', [name for name in SmartPluginCleaner.BACKUP_FORMATS if name != 'dir'])
+def test_backup_restore_round_trip_each_archive_format(install, tmp_path, backup_format):
+    before = snapshot(install / 'plugins')
+    cleaner = make_cleaner(install, tmp_path, backup_format=backup_format, record_hashes=True)
+
+    assert clean(cleaner)
+    assert_cleaned(install)
+    assert os.path.isfile(cleaner.backup_archive)
+
+    results = restore_backup(cleaner.backup_archive)
+    assert all(result['ok'] for result in results)
+    assert snapshot(install / 'plugins') == before
+
+
+def test_backup_restore_round_trip_store(install, tmp_path):
+    before = snapshot(install / 'plugins')
+    cleaner = make_cleaner(install, tmp_path, backup_store=str(tmp_path / 'store'))
+
+    assert clean(cleaner)
+    assert_cleaned(install)
+
+    results = restore_backup(cleaner.backup_manifest_path)
+    assert all(result['ok'] for result in results)
+    assert {result['method'] for result in results} <= {'reflink', 'copy'}
+    assert snapshot(install / 'plugins') == before
+    # 还原的插件不与备份库中的 blob 共享 inode
+    restored = os.stat(install / 'plugins' / 'a_1.0.0.v2020.jar')
+    assert restored.st_nlink == 1
+
+
+def test_restore_rejects_corrupted_backup(install, tmp_path):
+    cleaner = make_cleaner(install, tmp_path, backup_strategy='copy', record_hashes=True)
+    assert clean(cleaner)
+
+    with open(os.path.join(cleaner.backup_dir, 'a_1.0.0.v2020.jar'), 'wb') as f:
+        f.write(b'tampered')
+
+    results = {result['original_name']: result for result in restore_backup(cleaner.backup_dir)}
+    assert not results['a_1.0.0.v2020.jar']['ok']
+    assert results['b_1.0.0']['ok']
+    assert not os.path.exists(install / 'plugins' / 'a_1.0.0.v2020.jar')
+
+
+def test_journaled_delete_rolls_back_when_a_rename_fails(install, tmp_path, monkeypatch):
+    before = snapshot(install / 'plugins')
+    cleaner = make_cleaner(install, tmp_path, backup_strategy='copy', journaled=True)
+
+    real_rename = os.rename
+    renamed = []
+
+    def failing_rename(src, dst):
+        # 第一个插件移入回收目录后，第二个插件的重命名失败
+        if DeleteJournal.TRASH_DIR_NAME in str(dst):
+            if renamed:
+                raise OSError("模拟重命名失败")
+            renamed.append(src)
+        return real_rename(src, dst)
+
+    monkeypatch.setattr(smart_plugin_cleaner.os, 'rename', failing_rename)
+    assert not clean(cleaner)
+    monkeypatch.undo()
+
+    assert renamed
+    assert snapshot(install / 'plugins') == before
+    assert cleaner.journal.journal_paths() == []
+    assert all(result['error'] and not result['deleted'] for result in cleaner.results)
+
+
+def test_journal_recover_rolls_back_prepared_and_purges_committed(install, tmp_path):
+    plugins_dir = install / 'plugins'
+    trash_dir = DeleteJournal.trash_dir_for(str(plugins_dir))
+    journal = DeleteJournal(trash_dir)
+
+    def plugin(name, is_dir):
+        return {'path': str(plugins_dir / name), 'original_name': name, 'is_dir': is_dir}
+
+    # 中断在第一阶段的事务：只有一个插件移入了回收目录
+    prepared_path, prepared = journal.begin([plugin('a_1.0.0.v2020.jar', False), plugin('b_1.0.0', True)])
+    entry = prepared['entries'][0]
+    os.makedirs(os.path.dirname(entry['trash']))
+    os.rename(entry['source'], entry['trash'])
+    journal.release(prepared_path)
+
+    # 已提交、尚未清理的事务
+    committed_path, committed = journal.begin([plugin('a_1.1.0.jar', False)])
+    entry = committed['entries'][0]
+    os.makedirs(os.path.dirname(entry['trash']))
+    os.rename(entry['source'], entry['trash'])
+    journal.commit(committed_path, committed)
+    journal.release(committed_path)
+
+    stats = DeleteJournal(trash_dir).recover()
+
+    assert stats == {'rolled_back': 1, 'purged': 1, 'pending': 0, 'active': 0}
+    assert sorted(os.listdir(plugins_dir)) == ['a_1.0.0.v2020.jar', 'b_1.0.0', 'b_2.0.0']
+    assert DeleteJournal(trash_dir).journal_paths() == []
+
+
+def test_p2_metadata_rewritten_and_restored(install, tmp_path):
+    bundles_info = install / P2Metadata.BUNDLES_INFO
+    bundles_info.parent.mkdir(parents=True)
+    bundles_info.write_text(BUNDLES_INFO, encoding='utf-8')
+    (install / 'artifacts.xml').write_text(ARTIFACTS_XML, encoding='utf-8')
+    with zipfile.ZipFile(install / 'artifacts.jar', 'w') as archive:
+        archive.writestr('artifacts.xml', ARTIFACTS_XML)
+
+    cleaner = make_cleaner(install, tmp_path, backup_strategy='copy')
+    assert clean(cleaner)
+    assert_cleaned(install)
+
+    # 删除的插件不在 bundles.info 中，注释和指向不存在文件的条目原样保留
+    assert bundles_info.read_text(encoding='utf-8') == BUNDLES_INFO
+    for path in cleaner.p2.artifact_paths:
+        keys = P2Metadata.load(str(install)).artifacts[path]
+        assert keys == {('osgi.bundle', 'a', '1.1.0'), ('osgi.bundle', 'b', '2.0.0')}
+        assert os.path.isfile(path + '.bak')
+
+    manifest = json.load(open(os.path.join(cleaner.backup_dir, 'backup_manifest.json'), encoding='utf-8'))
+    assert all('artifacts' in entry['p2'] for entry in manifest['deleted_plugins'])
+
+    results = restore_backup(cleaner.backup_dir)
+    assert all(result['ok'] and result.get('p2') for result in results)
+
+    metadata = P2Metadata.load(str(install))
+    for path in metadata.artifact_paths:
+        assert metadata.artifacts[path] == {
+            ('osgi.bundle', 'a', '1.0.0.v2020'), ('osgi.bundle', 'a', '1.1.0'),
+            ('osgi.bundle', 'b', '1.0.0'), ('osgi.bundle', 'b', '2.0.0')
+        }
+    assert any(metadata.folder_artifacts[path] for path in metadata.artifact_paths)
+
+
+def test_p2_remove_bundles_keeps_comments_and_other_lines(install):
+    bundles_info = install / P2Metadata.BUNDLES_INFO
+    bundles_info.parent.mkdir(parents=True)
+    bundles_info.write_text(BUNDLES_INFO, encoding='utf-8')
+
+    metadata = P2Metadata.load(str(install))
+    changes = metadata.remove_bundles([{'path': str(install / 'plugins' / 'a_1.1.0.jar'), 'name': 'a', 'version': '1.1.0'}])
+
+    assert changes == {metadata.bundles_info_path: 1}
+    assert bundles_info.read_text(encoding='utf-8') == BUNDLES_INFO.replace('a,1.1.0,plugins/a_1.1.0.jar,4,false\n', '')
+
+
+def test_verify_jars_falls_back_to_newest_intact_version(tmp_path):
+    plugins = tmp_path / 'eclipse' / 'plugins'
+    plugins.mkdir(parents=True)
+    write_jar(plugins / 'a_1.0.0.jar')
+    write_jar(plugins / 'a_1.1.0.jar')
+    (plugins / 'a_1.2.0.jar').write_bytes(b'PK broken')
+
+    assert verify_jar(str(plugins / 'a_1.1.0.jar')) is None
+    assert verify_jar(str(plugins / 'a_1.2.0.jar')) is not None
+
+    cleaner = make_cleaner(tmp_path / 'eclipse', tmp_path, verify_jars='quick')
+    assert cleaner.scan_plugins()
+    cleaner.analyze_duplicates()
+
+    assert [plugin['original_name'] for plugin in cleaner.to_keep] == ['a_1.1.0.jar']
+    assert sorted(plugin['original_name'] for plugin in cleaner.to_delete) == ['a_1.0.0.jar', 'a_1.2.0.jar']
+
+
+def test_stream_plan_matches_analyze_duplicates(tmp_path):
+    root = tmp_path / 'eclipse'
+    plugins = root / 'plugins'
+    dropins = root / 'dropins'
+    plugins.mkdir(parents=True)
+    dropins.mkdir()
+    for i in range(30):
+        for version in ('1.0.0', '1.0.10', '1.0.2', '2.0.0.v2020', '2.0.0.20'):
+            (plugins / f"org.example.p{i}_{version}.jar").write_bytes(b'x')
+        (plugins / f"org.example.d{i}_1.0.{i}").mkdir()
+        (plugins / f"org.example.d{i}_1.0.{i + 1}").mkdir()
+        (dropins / f"org.example.p{i}_3.0.0.jar").write_bytes(b'x')
+    (plugins / 'single_1.0.0.jar').write_bytes(b'x')
+
+    cleaner = make_cleaner(root, tmp_path, extra_dirs=[str(dropins)])
+    assert cleaner.scan_plugins()
+    cleaner.analyze_duplicates()
+    expected = {('keep', plugin['path']) for plugin in cleaner.to_keep}
+    expected |= {('delete', plugin['path']) for plugin in cleaner.to_delete}
+
+    streamer = make_cleaner(root, tmp_path, extra_dirs=[str(dropins)])
+    # 每条记录都超出内存预算，强制走多路归并
+    streamer.STREAM_RECORD_OVERHEAD = 2 * 1024 * 1024
+    output = tmp_path / 'plan.jsonl'
+    stats = streamer.stream_plan(str(output), memory_mb=1, temp_dir=str(tmp_path))
+
+    with open(output, encoding='utf-8') as f:
+        actual = {(row['action'], row['path']) for row in map(json.loads, f)}
+    assert stats['runs'] > 1
+    assert actual == expected
+    assert stats['delete'] == len(cleaner.to_delete)